@@ -82,9 +82,10 @@ fi
 #
 # queuemove/queueremove drive the UI's drag-and-drop; relvolume asks the
 # speaker to apply a relative change rather than resolving it against a cached
-# value. They live on this side because macOS grants Local Network access per
-# process: the launchd-run Python server cannot reach the speaker directly at
-# all, while this one talks to it constantly.
+# value; routineload runs a scheduled play -- volume, clear, load -- as one
+# request. They live on this side because macOS grants Local Network access
+# per process: the launchd-run Python server cannot reach the speaker directly
+# at all, while this one talks to it constantly.
 
 step "custom actions"
 mkdir -p "$TARGET/lib/actions"
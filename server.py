@@ -1,15 +1,25 @@
 import anthropic
 import cherrypy
 import spotipy
+from spotipy.cache_handler import CacheFileHandler
 from spotipy.exceptions import SpotifyBaseException, SpotifyException
 from spotipy.oauth2 import SpotifyOAuth, SpotifyOauthError
 import requests
+from urllib3.util.retry import Retry
 import functools
 import inspect
+import itertools
+import array
+import bisect
+import collections
+import concurrent.futures
+import contextlib
 import datetime
 import json
+import heapq
 import logging
 import logging.handlers
+import math
 import os
 import queue
 import re
@@ -18,6 +28,8 @@ import subprocess
 import sys
 import threading
 import time
+import tracemalloc
+import traceback
 import urllib.parse
 
 # Application logging.
@@ -100,9 +112,18 @@ DEFAULTS = {
     # Search results are per-session scratch state, not data worth keeping.
     "search_result_ttl": 3600,
     "max_search_sessions": 100,
-    # Scheduler tick. Must be under 60s or a schedule whose minute falls
-    # between two ticks is skipped entirely.
+    # Scheduler recheck interval while a failed step's retry window is open.
+    # Must be under 60s: retries are claimed on the minute like first
+    # attempts, and a longer interval could step over every one of them.
+    # Steps themselves are no longer found by polling at this rate -- the
+    # scheduler sleeps until the next one is due.
     "schedule_tick_seconds": 20,
+    # Longest single sleep between scheduler wake-ups. Sleeping until the next
+    # fire time is computed from the wall clock, and a jump in that clock (NTP,
+    # DST, a Mac waking from sleep) is only noticed on waking, so this bounds
+    # how late a jump can make a step. 20s polling woke 4,320 times a day to
+    # do nothing; this is 288 at most.
+    "schedule_max_sleep_seconds": 300,
     # A step used to be stamped fired before the Sonos call ran, so a single
     # failure burned it for the whole day -- a wake-up that silently did
     # nothing. Now the attempt is stamped and the success is committed
@@ -112,6 +133,22 @@ DEFAULTS = {
     # the time a failed call returns that minute is often gone.
     "schedule_max_attempts": 3,
     "schedule_retry_window_seconds": 300,
+    # How far ahead of its minute a scheduled playlist or album is loaded.
+    # Expanding a big container takes the speaker ~46s, and a load started on
+    # the minute only starts playing once it finishes, so the alarm went off
+    # most of a minute late. Loaded early and paused, only `play` is left for
+    # the minute itself. 0 loads on the minute, as before.
+    "schedule_preload_seconds": 60,
+    # Step state (attempts, last fired) is appended to a journal rather than
+    # rewriting schedules.json on every claim; past this many records the
+    # journal is rewritten as one record per step.
+    "schedule_journal_compact_records": 500,
+    # How many recent executions each step keeps, with its timings, for
+    # /schedules. Enough to see a pattern in a week of wake-ups.
+    "schedule_history_per_step": 20,
+    # Routines whose steps may run at the same moment. A routine's own steps
+    # always run one after another, in offset order.
+    "schedule_workers": 4,
     # launchd's KeepAlive only sees the process. It cannot see the case that
     # actually happened: node-sonos-http-api alive and answering, but with no
     # system discovered, so every playback call fails. The watchdog watches for
@@ -132,6 +169,10 @@ DEFAULTS = {
     # Cloudflare will close an idle tunnelled connection; a comment line keeps
     # it open and lets the browser notice a dead stream and reconnect.
     "stream_heartbeat_seconds": 25,
+    # Every request is traced -- auth, Spotify, Sonos, Claude, serialising
+    # the reply -- and the slowest this many are kept for /debug/slow, so
+    # "it took ages to queue" can be traced to the call that took the time.
+    "slow_traces_kept": 50,
     "sonos_readiness_timeout": 3,
     "watchdog_tick_seconds": 60,
     "watchdog_failures_before_alert": 2,
@@ -145,6 +186,12 @@ DEFAULTS = {
     "max_chat_message_chars": 500,
     "chat_calls_per_minute": 20,
     "max_chat_sessions": 100,
+    # Tokens /chat may spend per local day, input and output together, after
+    # which it answers 429 without calling Claude until midnight. A DJ
+    # command is a few hundred tokens of prompt and a short reply, so this is
+    # hundreds of commands -- a ceiling on a runaway, not on a party. 0 turns
+    # the budget off.
+    "chat_daily_token_budget": 1000000,
     # Largest legitimate body is a routine with the maximum number of steps,
     # which is a few kilobytes. CherryPy defaults to 100MB, and a 38MB body
     # was accepted and parsed.
@@ -152,6 +199,66 @@ DEFAULTS = {
     # 12h: enough for a wind-down that starts in the evening and ends after
     # midnight, without letting an offset drift into ambiguity.
     "max_step_offset_minutes": 720,
+    # Time every wait for and hold of the shared-state locks, for
+    # /debug/locks. Off by default: it adds two clock reads and a histogram
+    # update to every acquisition, which is worth paying while chasing a
+    # stall and not otherwise.
+    "instrument_locks": False,
+    # Album, track and top-track metadata barely changes, and was fetched
+    # from Spotify afresh on every expand and every "more by this artist".
+    # Entries are kept this many seconds per client method, then served stale
+    # while a refresh runs, up to spotify_cache_entries in all.
+    "spotify_cache_ttl_seconds": {
+        "album": 86400,
+        "track": 86400,
+        "artist_top_tracks": 21600,
+    },
+    "spotify_cache_entries": 500,
+    # An expired entry is served while its refresh runs for at most this
+    # long past expiry, and never for longer than its own TTL. After that a
+    # lookup fetches inline, so a refresh that keeps failing cannot serve one
+    # answer forever.
+    "spotify_cache_max_stale_seconds": 3600,
+    # The same handful of queries ("beatles", "taylor swift") are searched by
+    # every guest in an evening. Raw search responses are shared across
+    # sessions for this long, keyed by the query as typed modulo case and
+    # spacing; a search that found nothing is kept for less, so a typo does
+    # not cost a call per retry but a new release is not hidden for long.
+    "search_cache_ttl_seconds": 300,
+    "search_cache_empty_ttl_seconds": 60,
+    "search_cache_entries": 200,
+    # /suggest waits this long before asking Spotify, so a burst of
+    # keystrokes from one session ends in one call for the last of them.
+    # Answers are kept for SEARCH_CACHE_TTL_SECONDS, up to this many queries,
+    # and a longer query is answered from a shorter one's when it can be.
+    "suggest_debounce_seconds": 0.15,
+    "suggest_cache_entries": 500,
+    # A session that has sent nothing for this long may start counting again
+    # from a lower seq -- a reloaded page, or the CLI after a tab, on the same
+    # session -- rather than being told every query is superseded.
+    "suggest_session_idle_seconds": 5,
+    # Every sp.* call takes a token from one bucket, refilled at this rate up
+    # to spotify_burst. A 429's Retry-After stops every caller, not just the
+    # one that met it. Requests from a person go ahead of background work,
+    # and a caller that would wait longer than its limit here is answered
+    # with a 429 instead of holding a worker.
+    "spotify_rate_per_second": 3,
+    "spotify_burst": 10,
+    "spotify_queue_max_seconds": {
+        "interactive": 5,
+        "background": 60,
+    },
+    # The access token is refreshed in the background once it is within this
+    # many seconds of expiry, so no request pays for the refresh inline.
+    "spotify_token_refresh_ahead_seconds": 300,
+    # When the track changes, fetch in the background what the next tap is
+    # likely to want: the album, the artist's top tracks, and the next
+    # track's metadata and artwork.
+    "prefetch_on_track_change": True,
+    # /container_tracks keeps whole album and playlist listings, a playlist
+    # for as long as its snapshot_id is current. Bounded by tracks held
+    # rather than listings, since one playlist can hold 10,000.
+    "container_cache_tracks": 20000,
 }
 
 
@@ -205,14 +312,148 @@ def _validate_config():
 
 _validate_config()
 
+class _TracedSpotify:
+    """The Spotify client, with each method call recorded as a trace span
+    and timed into /metrics under its method name.
+
+    A wrapper rather than a subclass so that every call is covered, including
+    ones added later, without listing them. Attributes that are not methods
+    pass straight through.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def traced(*args, **kwargs):
+            # The HTTP layer below reads this to say which method a 429
+            # belongs to; restored after, since one call can make another.
+            # The governor's turn comes first and outside the timing: its wait
+            # is _record_spotify_queue_wait's, and a call it refuses never
+            # reached Spotify, so it is neither a call nor a failure here.
+            _spotify_governor.acquire(getattr(_spotify_local, 'priority', 'interactive'))
+            outer = getattr(_spotify_local, 'method', None)
+            _spotify_local.method = name
+            started = time.monotonic()
+            ok = False
+            try:
+                with _Span(f"spotify {name}"):
+                    result = attr(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                _spotify_local.method = outer
+                _record_spotify_call(name, time.monotonic() - started, ok)
+        return traced
+
+
+# The wrapper sees a method's outcome, but not the HTTP under it: spotipy
+# retries 429s and 5xx inside urllib3, sleeping out each Retry-After, so a
+# search that met two 429s before succeeding looks from above like a slow
+# search. Every response is therefore also counted where it arrives -- a
+# retried one in the Retry policy, the one finally returned in a session
+# hook -- tagged with the method the wrapper says is running.
+_spotify_local = threading.local()
+
+
+class _SpotifyRetry(Retry):
+    """spotipy's retry policy, counting each response it retries."""
+
+    def increment(self, method=None, url=None, response=None, error=None,
+                  _pool=None, _stacktrace=None):
+        if response is not None:
+            _record_spotify_response(response.status, response.headers.get('Retry-After'))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def _spotify_response_hook(response, *args, **kwargs):
+    _record_spotify_response(response.status_code, response.headers.get('Retry-After'))
+
+
+def _instrument_spotify(client):
+    """Count every response on `client`'s HTTP session, retried or not, and
+    every access-token refresh its auth manager makes.
+
+    spotipy builds its session with a plain Retry; this swaps in a
+    _SpotifyRetry with the same settings rather than rebuilding the session,
+    so spotipy's own choice of what to retry and how long to back off stands.
+
+    A refresh is the call that, failing, takes every Spotify feature down at
+    once, and until now it left no trace short of the errors that followed.
+    """
+    session = client._session
+    for adapter in session.adapters.values():
+        retry = adapter.max_retries
+        counting = _SpotifyRetry.__new__(_SpotifyRetry)
+        counting.__dict__.update(retry.__dict__)
+        adapter.max_retries = counting
+    session.hooks['response'].append(_spotify_response_hook)
+
+    auth = client.auth_manager
+    if auth is None:
+        return
+    refresh = auth.refresh_access_token
+
+    @functools.wraps(refresh)
+    def counted(refresh_token):
+        background = getattr(_spotify_local, 'priority', None) == 'background'
+        started = time.monotonic()
+        try:
+            token = refresh(refresh_token)
+        except Exception as exc:
+            _record_token_refresh(False, time.monotonic() - started, type(exc).__name__,
+                                  background)
+            raise
+        _record_token_refresh(True, time.monotonic() - started, None, background,
+                              token.get('expires_at') if isinstance(token, dict) else None)
+        return token
+    auth.refresh_access_token = counted
+
+
+class _AtomicCacheFileHandler(CacheFileHandler):
+    """spotipy's .cache handler, writing through a temp file and a rename.
+
+    spotipy truncates .cache and writes it in place, so a reader -- the
+    background refresh, a request thread, a second server process -- could
+    open it between the two and find no token at all. The temp file is
+    unique per process and thread, since two refreshes can overlap; it is
+    created 0600, as the token is a credential from its first byte; and it
+    is fsynced before the rename, because a power cut that leaves .cache
+    empty means a browser and auth.py before anything works again.
+    """
+
+    def save_token_to_cache(self, token_info):
+        tmp = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(token_info, cls=self.encoder_cls))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.cache_path)
+        except OSError as exc:
+            log.warning("Could not write the Spotify token to %s: %s", self.cache_path, exc)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
 # Spotify setup
-sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
+sp = _TracedSpotify(spotipy.Spotify(auth_manager=SpotifyOAuth(
     client_id=config['client_id'],
     client_secret=config['client_secret'],
     redirect_uri="http://127.0.0.1:8888/callback",
     scope="user-library-read user-library-modify playlist-read-private playlist-modify-public playlist-modify-private user-read-recently-played user-top-read",
-    cache_path=os.path.join(os.path.dirname(__file__), '.cache')
-))
+    cache_handler=_AtomicCacheFileHandler(
+        cache_path=os.path.join(os.path.dirname(__file__), '.cache')),
+)))
+_instrument_spotify(sp._client)
 
 # Sonos setup
 #
@@ -232,6 +473,35 @@ SONOS_URL = f"{SONOS_BASE_URL}/{SONOS_ROOM}"
 # Monotonic so uptime is unaffected by the clock being adjusted under us.
 SERVER_START = time.monotonic()
 
+
+class _Clock:
+    """Every reading of the time the scheduler and the expiring caches take.
+
+    Delegates to time and datetime when called, not when constructed, so in
+    production it is the real clock and an existing patch of time.localtime
+    or time.monotonic still reaches everything behind it. Months of uptime
+    are where leaks and drift show, and nobody can wait months for a test:
+    tests/test_soak.py swaps _clock for one it winds forward itself.
+    """
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def localtime(self):
+        return time.localtime()
+
+    def now(self):
+        return datetime.datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+_clock = _Clock()
+
 # Web UI markup, kept out of this file so the HTML/CSS/JS can be edited as
 # HTML rather than as a 400-line Python string literal.
 STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
@@ -290,11 +560,118 @@ COOKIE_MAX_AGE = _setting('cookie_max_age')
 SEARCH_RESULT_TTL = _setting('search_result_ttl')
 MAX_SEARCH_SESSIONS = _setting('max_search_sessions')
 SEARCH_LIMIT = _setting('search_limit')
+# The kinds _search_rows knows how to shape. Anything else used to go to
+# Spotify and come back empty or as a 502; it is the caller's mistake.
+SEARCH_KINDS = ('track', 'album', 'playlist')
 
 # Paths reachable without credentials. Everything else is denied by default,
 # so a new endpoint is protected unless it is deliberately added here.
 PUBLIC_PATHS = {'', '/index', '/ui', '/login'}
 
+# The shared-state locks are taken from request threads, the scheduler, the
+# step pool and the watchdog, and _schedules_lock is held across file
+# writes. When something stalls, the question is which lock it queued on and
+# who was holding it. With instrument_locks on, each named lock is built as
+# an _InstrumentedLock, which records how long every acquire waited and every
+# hold lasted; /debug/locks ranks them. With it off they are plain Locks and
+# cost nothing.
+INSTRUMENT_LOCKS = bool(_setting('instrument_locks'))
+_lock_stats = {}
+_lock_stats_lock = threading.Lock()
+
+
+class _InstrumentedLock:
+    """A Lock that times its waits and holds under `name`.
+
+    Only one thread holds it at a time, so the hold's start can live on the
+    instance. Stats go to _lock_stats under a plain lock of their own, which
+    is never instrumented.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._held_since = None
+        self._holder = None
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            now = time.perf_counter()
+            self._held_since = now
+            self._holder = threading.current_thread().name
+            _record_lock_timing(self.name, 'wait', now - started)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._held_since
+        self._holder = None
+        self._lock.release()
+        _record_lock_timing(self.name, 'hold', held)
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+def _named_lock(name):
+    """A module-level lock, instrumented when instrument_locks is set."""
+    if INSTRUMENT_LOCKS:
+        lock = _InstrumentedLock(name)
+        _named_locks[name] = lock
+        return lock
+    return threading.Lock()
+
+
+_named_locks = {}
+
+# A wait shorter than this is an uncontended acquire that merely took a
+# clock tick, not a thread that queued.
+LOCK_CONTENDED_SECONDS = 0.0001
+
+
+def _record_lock_timing(name, kind, seconds):
+    with _lock_stats_lock:
+        stats = _lock_stats.get(name)
+        if stats is None:
+            stats = _lock_stats[name] = {
+                'acquisitions': 0, 'contended': 0,
+                'wait': _Histogram(LATENCY_BUCKETS_SECONDS),
+                'hold': _Histogram(LATENCY_BUCKETS_SECONDS),
+            }
+        stats[kind].observe(seconds)
+        if kind == 'wait':
+            stats['acquisitions'] += 1
+            if seconds >= LOCK_CONTENDED_SECONDS:
+                stats['contended'] += 1
+
+
+def _lock_report():
+    """Every instrumented lock, the most time spent waiting on it first."""
+    with _lock_stats_lock:
+        rows = [{
+            'name': name,
+            'acquisitions': stats['acquisitions'],
+            'contended': stats['contended'],
+            'wait_seconds_total': round(stats['wait'].total, 4),
+            'hold_seconds_total': round(stats['hold'].total, 4),
+            'wait': stats['wait'].snapshot(),
+            'hold': stats['hold'].snapshot(),
+        } for name, stats in _lock_stats.items()]
+    for row in rows:
+        lock = _named_locks.get(row['name'])
+        row['held_by'] = lock._holder if lock is not None else None
+    rows.sort(key=lambda row: row['wait_seconds_total'], reverse=True)
+    return {'enabled': INSTRUMENT_LOCKS, 'locks': rows}
+
 # Last search results per session, as {session_id: (stored_at, results)}.
 #
 # Every distinct session_id the web UI sends creates an entry, and nothing used
@@ -310,12 +687,12 @@ search_results = {}
 # oldest key and deletes it, a check-then-act where both threads can choose
 # the same key and the second raises KeyError. Reproduced with a short thread
 # switch interval; see test_hardening_sweep.py.
-_results_lock = threading.Lock()
+_results_lock = _named_lock('results')
 
 
 def _expire_search_results_locked():
     """Drop stale sessions, then oldest-first if still over the cap."""
-    now = time.monotonic()
+    now = _clock.monotonic()
     for session_id in [
         s for s, (stored_at, _) in search_results.items()
         if now - stored_at > SEARCH_RESULT_TTL
@@ -334,9 +711,11 @@ def _expire_search_results_locked():
 # what makes a gradual wake-up expressible -- volume 12 and play at +0, then
 # volume 22 at +10, and so on.
 #
-# Steps are matched against the clock on every tick rather than run by sleeping
-# a thread. A restart between the trigger and a +60m step therefore still runs
-# that step, and no work is lost when the process is replaced mid-routine.
+# Steps are matched against the clock when the scheduler wakes, rather than
+# being held in memory as timers. The scheduler thread sleeps until the next
+# fire time and then asks _due_steps what is due, so a restart between the
+# trigger and a +60m step still runs that step, and no work is lost when the
+# process is replaced mid-routine.
 #
 # Time handling is local wall-clock, so the DST consequences are the usual
 # ones: a trigger inside the skipped hour on the spring-forward day does not
@@ -344,25 +723,38 @@ def _expire_search_results_locked():
 # firing anything twice.
 
 SCHEDULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schedules.json')
+SCHEDULE_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'schedules-state.jsonl')
 
 SCHEDULE_TICK_SECONDS = _setting('schedule_tick_seconds')
+SCHEDULE_MAX_SLEEP_SECONDS = _setting('schedule_max_sleep_seconds')
 SCHEDULE_MAX_ATTEMPTS = _setting('schedule_max_attempts')
 SCHEDULE_RETRY_WINDOW_SECONDS = _setting('schedule_retry_window_seconds')
+SCHEDULE_PRELOAD_SECONDS = _setting('schedule_preload_seconds')
+SCHEDULE_JOURNAL_COMPACT_RECORDS = _setting('schedule_journal_compact_records')
+SCHEDULE_HISTORY_PER_STEP = _setting('schedule_history_per_step')
 CONTENT_DEDUP_SECONDS = _setting('content_dedup_seconds')
 MAX_STREAM_CLIENTS = _setting('max_stream_clients')
 STREAM_HEARTBEAT_SECONDS = _setting('stream_heartbeat_seconds')
+SLOW_TRACES_KEPT = _setting('slow_traces_kept')
+SERVER_THREAD_POOL = _setting('server_thread_pool')
 
 # One bounded queue per connected browser. Bounded on purpose: a client that
 # has stopped reading -- a laptop that slept with the tab open -- must not grow
 # a queue until the process dies. It drops events and resyncs on reconnect.
 _stream_clients = []
-_stream_lock = threading.Lock()
+_stream_lock = _named_lock('stream')
 
 # Origin of the speaker currently serving album art, learned from the artwork
 # URL Sonos hands back. Remembered rather than passed through the browser so
 # /albumart can only ever fetch from the speaker -- see _proxied_art.
 _art_origin = None
 _art_lock = threading.Lock()
+# The last few images /albumart fetched, so the one the prefetch warmed for
+# the next track is served without a trip to the speaker. Keyed by origin as
+# well: the same query string from another speaker is another image.
+ART_CACHE_ENTRIES = 8
+_art_cache = collections.OrderedDict()   # (origin, query string) -> (content type, bytes)
 SONOS_READINESS_TIMEOUT = _setting('sonos_readiness_timeout')
 
 # Named because the dedupe below has to tell an ambiguous failure from a
@@ -371,11 +763,23 @@ SONOS_TIMEOUT_ERROR = "Sonos request timed out"
 
 # (action, uri) -> {'finished': monotonic or None, 'result': dict or None}
 _content_loads = {}
-_content_lock = threading.Lock()
+_content_lock = _named_lock('content')
 WATCHDOG_TICK_SECONDS = _setting('watchdog_tick_seconds')
 WATCHDOG_FAILURES_BEFORE_ALERT = _setting('watchdog_failures_before_alert')
 WATCHDOG_NOTIFY = _setting('watchdog_notify')
 
+# Due steps run on a small pool rather than on the scheduler thread. Bounded
+# because every one of them ends in a call to the same node-sonos-http-api:
+# past a handful, more threads only queue on the far side.
+SCHEDULE_WORKERS = _setting('schedule_workers')
+_step_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=SCHEDULE_WORKERS, thread_name_prefix='dj_step')
+
+# Routine id -> batches of claimed steps waiting behind the batch that routine
+# is running now. Present only while the routine has something in flight.
+_step_lanes = {}
+_lanes_lock = _named_lock('lanes')
+
 # (entry id, step index) for every step a tick is currently firing. Claiming is
 # minute-based and a Sonos call can outlast several ticks, so without this the
 # retry path would start a second copy of a step that is still running.
@@ -383,6 +787,8 @@ _steps_in_flight = set()
 MAX_SCHEDULES = _setting('max_schedules')
 MAX_STEPS = _setting('max_steps_per_schedule')
 MAX_OFFSET_MINUTES = _setting('max_step_offset_minutes')
+# Longest window /schedules/timeline will build.
+TIMELINE_MAX_DAYS = 31
 
 # Actions a step may perform, and the field each one requires.
 SCHEDULE_ACTIONS = {
@@ -397,10 +803,20 @@ SCHEDULE_ACTIONS = {
 
 TIME_RE = re.compile(r'^([01]\d|2[0-3]):([0-5]\d)$')
 
-# Guarded because the Monitor thread reads while request handlers write.
-_schedules_lock = threading.Lock()
+# Guarded because the scheduler thread reads while request handlers write.
+_schedules_lock = _named_lock('schedules')
 _schedules = []
 
+# Set whenever a routine is saved, deleted or toggled. The scheduler sleeps on
+# this rather than on a bare timer, so a routine saved for two minutes from now
+# is not left waiting behind a sleep computed before it existed.
+_schedules_changed = threading.Event()
+
+
+def _wake_scheduler():
+    """Make the scheduler recompute its next wake-up now."""
+    _schedules_changed.set()
+
 
 def _migrate_schedule(entry):
     """Bring a pre-routine entry forward.
@@ -421,9 +837,155 @@ def _migrate_schedule(entry):
     return entry
 
 
+# Runtime state of a step, as opposed to its definition. Every claim and every
+# outcome changes it, and each of those used to re-serialise every routine
+# into schedules.json, twice per fired step, while request handlers waited on
+# _schedules_lock. It now lives in memory on the step as before, but goes to
+# disk as one appended line in SCHEDULE_STATE_PATH, written after the lock is
+# released. schedules.json holds definitions only and is written when a
+# routine is actually edited.
+#
+# Each record is the step's whole state, not a delta, and carries a sequence
+# number taken under _schedules_lock. Two threads may append in the opposite
+# order to the one they changed the step in; replay keeps the highest seq
+# per step, so that cannot matter. Records also carry the step's identity, so
+# one written before an edit moved the steps around is not applied to the
+# wrong step.
+_STEP_STATE_FIELDS = ('attempts', 'last_attempt', 'last_fired', 'last_error', 'preload')
+_journal_lock = _named_lock('journal')
+_journal_seq = 0
+_journal_records = 0
+
+
+def _step_identity(step):
+    return [step.get('offset', 0), step.get('action'), step.get('uri'), step.get('volume')]
+
+
+def _state_record_locked(entry, index, step, seq=None):
+    """One journal line for a step. Caller holds _schedules_lock."""
+    global _journal_seq
+    if seq is None:
+        _journal_seq += 1
+        seq = _journal_seq
+    return {
+        'seq': seq, 'id': entry.get('id'), 'index': index,
+        'step': _step_identity(step),
+        'state': {f: step[f] for f in _STEP_STATE_FIELDS if step.get(f) is not None},
+    }
+
+
+def _journal_append(records):
+    """Append state records. Called *without* _schedules_lock held.
+
+    A failed write is logged and otherwise ignored, as a failed save always
+    was: the state is still right in memory, and the worst a restart can then
+    do is forget that a step already ran today.
+    """
+    global _journal_records
+    if not records:
+        return
+    lines = ''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records)
+    with _journal_lock:
+        try:
+            with open(SCHEDULE_STATE_PATH, 'a') as f:
+                f.write(lines)
+        except OSError as exc:
+            log.error("Could not write %s: %s", SCHEDULE_STATE_PATH, exc)
+            return
+        _journal_records += len(records)
+        due = _journal_records >= SCHEDULE_JOURNAL_COMPACT_RECORDS
+    if due:
+        _compact_journal()
+
+
+def _compact_journal():
+    """Rewrite the journal as one record per step.
+
+    The snapshot is taken under _schedules_lock, and _journal_lock is taken
+    before that is released, so no append can land between the two and be
+    lost when the file is replaced. The write itself holds only the journal
+    lock. Lock order is always _schedules_lock before _journal_lock.
+    """
+    with _schedules_lock:
+        snapshot = _state_snapshot_locked()
+        _journal_lock.acquire()
+    try:
+        _write_journal_locked(snapshot)
+    finally:
+        _journal_lock.release()
+
+
+def _state_snapshot_locked():
+    return [_state_record_locked(entry, index, step, seq=_journal_seq)
+            for entry in _schedules
+            for index, step in enumerate(entry.get('steps', []))]
+
+
+def _write_journal_locked(records):
+    """Replace the journal with `records`. Caller holds _journal_lock."""
+    global _journal_records
+    tmp = SCHEDULE_STATE_PATH + '.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            f.write(''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records))
+        os.replace(tmp, SCHEDULE_STATE_PATH)
+    except OSError as exc:
+        log.error("Could not write %s: %s", SCHEDULE_STATE_PATH, exc)
+        return
+    _journal_records = 0
+
+
+def _replay_state_journal(entries):
+    """Apply the journal to freshly loaded definitions, in place.
+
+    A line that does not parse is skipped: the last one may be torn by a
+    crash mid-append, and losing one step's state beats losing all of it.
+    """
+    global _journal_seq
+    latest = {}
+    try:
+        with open(SCHEDULE_STATE_PATH) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    key = (record['id'], record['index'])
+                    seq = record['seq']
+                except (ValueError, KeyError, TypeError):
+                    log.warning("Skipping an unreadable line in %s", SCHEDULE_STATE_PATH)
+                    continue
+                if key not in latest or seq >= latest[key]['seq']:
+                    latest[key] = record
+    except FileNotFoundError:
+        return
+    except OSError as exc:
+        log.error("Cannot read %s (%s) -- step state starts fresh",
+                  SCHEDULE_STATE_PATH, exc)
+        return
+
+    by_id = {e.get('id'): e for e in entries}
+    for (entry_id, index), record in latest.items():
+        _journal_seq = max(_journal_seq, record['seq'])
+        steps = by_id.get(entry_id, {}).get('steps', [])
+        if not isinstance(index, int) or not 0 <= index < len(steps):
+            continue
+        step = steps[index]
+        if record.get('step') != _step_identity(step):
+            continue
+        state = record.get('state') or {}
+        for field in _STEP_STATE_FIELDS:
+            step.pop(field, None)
+        step.update(state)
+        step.setdefault('last_fired', None)
+
+
 def _load_schedules():
-    """Read schedules.json. A missing or corrupt file is not fatal -- losing
-    alarms is better than refusing to serve music."""
+    """Read schedules.json and replay the state journal over it. A missing or
+    corrupt file is not fatal -- losing alarms is better than refusing to
+    serve music.
+
+    A schedules.json written before the journal existed carries step state
+    inline; that is kept as the starting point and the journal applied on top.
+    """
     try:
         with open(SCHEDULES_PATH) as f:
             data = json.load(f)
@@ -440,19 +1002,44 @@ def _load_schedules():
     migrated = [_migrate_schedule(e) for e in data if isinstance(e, dict)]
     if any('steps' not in e for e in data if isinstance(e, dict)):
         log.info("Migrated %d schedule(s) to the routine format", len(migrated))
+    for entry in migrated:
+        for step in entry.get('steps', []):
+            # Definitions are written without state; the key is still expected.
+            step.setdefault('last_fired', None)
+    _replay_state_journal(migrated)
     return migrated
 
 
 def _save_schedules_locked():
-    """Persist via a temp file + rename, so a crash mid-write cannot leave a
-    truncated file that reads back as zero schedules. Caller holds the lock."""
+    """Persist the routine definitions via a temp file + rename, so a crash
+    mid-write cannot leave a truncated file that reads back as zero
+    schedules. Caller holds the lock.
+
+    Only called when a routine is edited, so it also compacts the journal:
+    an edit can move steps to new indices, and the snapshot records them
+    where they now are. Step state is left out of schedules.json.
+    """
+    global _schedules_version
+    _schedules_version += 1
+    definitions = [
+        {**entry, 'steps': [{k: v for k, v in step.items() if k not in _STEP_STATE_FIELDS}
+                            for step in entry.get('steps', [])]}
+        for entry in _schedules
+    ]
     tmp = SCHEDULES_PATH + '.tmp'
     try:
         with open(tmp, 'w') as f:
-            json.dump(_schedules, f, indent=2)
+            json.dump(definitions, f, indent=2)
         os.replace(tmp, SCHEDULES_PATH)
     except OSError as exc:
         log.error("Could not write %s: %s", SCHEDULES_PATH, exc)
+        # The journal snapshot would describe definitions that never reached
+        # disk; the old journal still matches the old file.
+        return
+    snapshot = _state_snapshot_locked()
+    with _journal_lock:
+        _write_journal_locked(snapshot)
+    _prune_step_timings_locked()
 
 
 def _validate_step(action, offset=0, uri=None, volume=None):
@@ -509,6 +1096,14 @@ def _step_fire_time(trigger, offset):
     return f"{minutes // 60:02d}:{minutes % 60:02d}", day_shift
 
 
+def _fire_datetime(trigger_date, fire_at, day_shift):
+    """The local datetime a step of the run triggered on `trigger_date` lands
+    on, given the (HH:MM, day_shift) pair from _step_fire_time."""
+    hour, minute = (int(part) for part in fire_at.split(':'))
+    fired_on = trigger_date + datetime.timedelta(days=day_shift)
+    return datetime.datetime.combine(fired_on, datetime.time(hour, minute))
+
+
 def _next_run(entry, now=None):
     """When this routine next triggers, as an ISO datetime, or None.
 
@@ -524,7 +1119,7 @@ def _next_run(entry, now=None):
     if not TIME_RE.match(trigger):
         return None
 
-    now = now or datetime.datetime.now()
+    now = now or _clock.now()
     days = entry.get('days') or list(range(7))
     hour, minute = int(trigger[:2]), int(trigger[3:])
 
@@ -545,22 +1140,121 @@ def _annotate_schedule(entry, now=None):
 
     Steps gain the wall-clock time they land on, so the editor can show
     '07:15' instead of '+75m' without doing the midnight-wrap arithmetic
-    itself.
+    itself. The routine also carries its lateness histogram and each step
+    its recent executions, so a late wake-up can be read off the page.
     """
     result = dict(entry)
     result['next_run'] = _next_run(entry, now)
     trigger = entry.get('time', '')
     steps = []
-    for step in entry.get('steps', []):
-        step = dict(step)
-        if TIME_RE.match(trigger):
-            step['at'], shift = _step_fire_time(trigger, step.get('offset', 0))
-            step['next_day'] = bool(shift)
-        steps.append(step)
+    with _timings_lock:
+        histogram = _routine_latency.get(entry.get('id'))
+        result['latency'] = histogram.snapshot() if histogram else None
+        for index, step in enumerate(entry.get('steps', [])):
+            history = _step_history.get(_step_history_key(entry.get('id'), index, step))
+            step = dict(step)
+            step['history'] = list(history) if history else []
+            if TIME_RE.match(trigger):
+                step['at'], shift = _step_fire_time(trigger, step.get('offset', 0))
+                step['next_day'] = bool(shift)
+            steps.append(step)
     result['steps'] = steps
     return result
 
 
+# The timeline over the next few days is every step of every routine on every
+# matching day -- routines x steps x days -- and the scheduler page asks for
+# it on every render. It depends only on the definitions and the date, so it
+# is built once per (definitions version, date, days) and reused until a
+# routine is saved, deleted or toggled; _save_schedules_locked bumps the
+# version. One window is kept per `days`, so a page asking for a week and a
+# widget asking for a day do not rebuild each other's; `days` is capped at
+# TIMELINE_MAX_DAYS, which bounds it.
+_schedules_version = 0
+_timeline_cache = {}    # days -> ((version, date), fires, starts)
+_timeline_lock = threading.Lock()
+
+
+def _exists_locally(moment):
+    """False for a wall-clock time the spring-forward skips.
+
+    Such a minute never appears in time.localtime(), so _due_steps never
+    matches it and the step does not fire that day. Round-tripping through a
+    timestamp is what detects it: mktime moves a skipped time onto the far
+    side of the gap.
+    """
+    return datetime.datetime.fromtimestamp(moment.timestamp()) == moment
+
+
+def _build_timeline_locked(start_date, days):
+    """Every step fire from midnight of `start_date` for `days` days, sorted.
+    Caller holds _schedules_lock.
+
+    The same rules as _due_steps, applied in bulk: each step's (HH:MM,
+    day_shift) is worked out once per routine rather than once per day, the
+    weekday filter applies to the trigger date, and a step that wraps past
+    midnight is found by starting from trigger dates before the window.
+    On the fall-back day the repeated hour is listed once, as the fired-stamp
+    makes it fire once.
+    """
+    window_start = datetime.datetime.combine(start_date, datetime.time())
+    window_end = window_start + datetime.timedelta(days=days)
+    fires = []
+    for entry in _schedules:
+        trigger = entry.get('time', '')
+        if not entry.get('enabled', True) or not TIME_RE.match(trigger):
+            continue
+        weekdays = set(entry.get('days') or range(7))
+        placed = [(index, step) + _step_fire_time(trigger, step.get('offset', 0))
+                  for index, step in enumerate(entry.get('steps', []))]
+        if not placed:
+            continue
+        reach = max(shift for _, _, _, shift in placed)
+
+        for ahead in range(-reach, days):
+            trigger_date = start_date + datetime.timedelta(days=ahead)
+            if trigger_date.weekday() not in weekdays:
+                continue
+            for index, step, fire_at, day_shift in placed:
+                at = _fire_datetime(trigger_date, fire_at, day_shift)
+                if not window_start <= at < window_end or not _exists_locally(at):
+                    continue
+                fire = {
+                    'at': at.isoformat(timespec='minutes'),
+                    'id': entry.get('id'),
+                    'label': entry.get('label') or entry.get('id'),
+                    'index': index,
+                    'offset': step.get('offset', 0),
+                    'action': step.get('action'),
+                    'trigger_date': trigger_date.isoformat(),
+                }
+                for field in ('uri', 'volume'):
+                    if step.get(field) is not None:
+                        fire[field] = step[field]
+                fires.append(fire)
+    fires.sort(key=lambda f: (f['at'], f['id'] or '', f['index']))
+    return fires
+
+
+def _schedule_timeline(days, now=None):
+    """Step fires from the current minute onwards, across `days` days."""
+    now = now or _clock.now()
+    with _schedules_lock:
+        stamp = (_schedules_version, now.date())
+        with _timeline_lock:
+            cached = _timeline_cache.get(days)
+            if cached is None or cached[0] != stamp:
+                fires = _build_timeline_locked(now.date(), days)
+                cached = _timeline_cache[days] = (stamp, fires, [f['at'] for f in fires])
+            _, fires, starts = cached
+    # Cached from midnight so the cache survives the whole day; what has
+    # already happened today is trimmed per request. The list is sorted, so
+    # this is one bisect rather than a scan.
+    current = now.replace(second=0, microsecond=0).isoformat(timespec='minutes')
+    first = bisect.bisect_left(starts, current)
+    return fires[first:]
+
+
 def _retry_is_open(step, fire_at, day_shift, now_dt):
     """True if `step` failed earlier and is still inside its retry window.
 
@@ -578,16 +1272,14 @@ def _retry_is_open(step, fire_at, day_shift, now_dt):
         return False
 
     try:
-        trigger_date = datetime.date.fromisoformat(attempted)
-        hour, minute = (int(part) for part in fire_at.split(':'))
+        fire_dt = _fire_datetime(
+            datetime.date.fromisoformat(attempted), fire_at, day_shift)
     except ValueError:
         # A hand-edited schedules.json can carry a malformed stamp. Log it and
         # leave the step alone rather than retrying on a date we cannot read.
         log.warning("Schedule step has unreadable last_attempt %r", attempted)
         return False
 
-    fired_on = trigger_date + datetime.timedelta(days=day_shift)
-    fire_dt = datetime.datetime.combine(fired_on, datetime.time(hour, minute))
     elapsed = (now_dt - fire_dt).total_seconds()
     return 0 <= elapsed <= SCHEDULE_RETRY_WINDOW_SECONDS
 
@@ -604,15 +1296,24 @@ def _due_steps(now=None):
     a step whose Sonos call failed can be claimed again inside its retry
     window rather than being burned for the day. `_steps_in_flight` is what
     stops that retry path from double-firing a step that is merely slow.
+
+    A content load is also claimed up to SCHEDULE_PRELOAD_SECONDS before its
+    minute, marked `_preload`, so the speaker can expand it in advance. That
+    claim is not an attempt: it is stamped in `preload` instead, so it uses
+    up none of SCHEDULE_MAX_ATTEMPTS, and the step is still claimed on its
+    minute to start what was cued.
     """
-    now = now or time.localtime()
+    now = now or _clock.localtime()
     hhmm = f"{now.tm_hour:02d}:{now.tm_min:02d}"
     today = datetime.date(now.tm_year, now.tm_mon, now.tm_mday)
     now_dt = datetime.datetime(now.tm_year, now.tm_mon, now.tm_mday,
                                now.tm_hour, now.tm_min, now.tm_sec)
 
     claimed = []
+    records = []
+    waiting = _clock.monotonic()
     with _schedules_lock:
+        lock_wait = _clock.monotonic() - waiting
         for entry in _schedules:
             if not entry.get('enabled', True):
                 continue
@@ -639,28 +1340,49 @@ def _due_steps(now=None):
                 elif _retry_is_open(step, fire_at, day_shift, now_dt):
                     trigger_date = datetime.date.fromisoformat(step['last_attempt'])
                 else:
-                    continue
+                    trigger_date = _preload_trigger(entry, step, now_dt)
+                    if trigger_date is None:
+                        continue
+                preload = fire_at != hhmm and now_dt < _fire_datetime(
+                    trigger_date, fire_at, day_shift)
 
                 key = (entry.get('id'), index)
                 if key in _steps_in_flight:
                     continue
 
                 stamp = trigger_date.isoformat()
-                step['attempts'] = (
-                    step.get('attempts', 0) + 1 if step.get('last_attempt') == stamp else 1
-                )
-                step['last_attempt'] = stamp
+                if preload:
+                    step['preload'] = {'date': stamp, 'cued': False}
+                else:
+                    step['attempts'] = (
+                        step.get('attempts', 0) + 1 if step.get('last_attempt') == stamp else 1
+                    )
+                    step['last_attempt'] = stamp
                 _steps_in_flight.add(key)
-                claimed.append({
+                records.append(_state_record_locked(entry, index, step))
+
+                due_at = _fire_datetime(trigger_date, fire_at, day_shift)
+                if not preload and step['attempts'] == 1:
+                    # Retries are late by design, so only a first attempt says
+                    # anything about how promptly the scheduler woke. A preload
+                    # is early by design; its lateness is taken when it plays.
+                    _record_schedule_lateness((now_dt - due_at).total_seconds())
+                claim = {
                     **step,
                     'label': entry.get('label') or entry.get('id'),
                     '_entry_id': entry.get('id'),
                     '_step_index': index,
                     '_trigger_date': stamp,
-                })
+                    '_due_at': due_at.isoformat(timespec='minutes'),
+                    '_claimed_at': _clock.time(),
+                    '_lock_wait': lock_wait,
+                }
+                if preload:
+                    claim['_preload'] = True
+                    claim['_preload_volume'] = _preload_volume(entry, index)
+                claimed.append(claim)
 
-        if claimed:
-            _save_schedules_locked()
+    _journal_append(records)
     return claimed
 
 
@@ -699,20 +1421,167 @@ def _record_step_outcome(claimed, ok, error):
                 'attempts': step.get('attempts', 0),
                 'final': step.get('attempts', 0) >= SCHEDULE_MAX_ATTEMPTS,
             }
-        _save_schedules_locked()
+        record = _state_record_locked(entry, key[1], step)
+    _journal_append([record])
 
 
-def _now_load_is_deduped(uri):
-    """True while _content_load would answer a spotify/now for this uri from
-    its dedupe table instead of sending it -- the same load is in flight,
-    timed out ambiguously, or finished within the dedupe window.
+def _record_preload_outcome(claimed, ok):
+    """Release a preload's in-flight claim, noting whether it cued anything.
+
+    Unlike _record_step_outcome this commits nothing and counts no failure:
+    the step is claimed again on its minute either way, and a speaker that
+    was not ready a minute early must not cost a wake-up one of its retries.
+    """
+    key = (claimed.get('_entry_id'), claimed.get('_step_index'))
+    with _schedules_lock:
+        _steps_in_flight.discard(key)
+        entry = next((e for e in _schedules if e.get('id') == key[0]), None)
+        steps = entry.get('steps', []) if entry is not None else []
+        if not ok or not 0 <= key[1] < len(steps):
+            return
+        step = steps[key[1]]
+        step['preload'] = {'date': claimed.get('_trigger_date'), 'cued': True}
+        record = _state_record_locked(entry, key[1], step)
+    _journal_append([record])
+
+
+def _next_step_fire(entry, step, now_dt):
+    """The next local datetime `step` is due at or after `now_dt`, or None.
+
+    Mirrors _due_steps rather than _next_run: the weekday filter applies to
+    the trigger date, a step that wrapped past midnight belongs to the day
+    before, and a run this step has already been claimed for is skipped. The
+    minute in progress still counts -- a routine saved at 07:00:30 for 07:00
+    is due now, exactly as the old poll would have found it. A preload is
+    not an attempt, so a preloaded run is still due on its minute.
+    """
+    trigger = entry.get('time', '')
+    fire_at, day_shift = _step_fire_time(trigger, step.get('offset', 0))
+    days = entry.get('days') or list(range(7))
+
+    # From yesterday, because an offset can carry yesterday's run into today.
+    for ahead in range(-1, 8):
+        trigger_date = now_dt.date() + datetime.timedelta(days=ahead)
+        if trigger_date.weekday() not in days:
+            continue
+        stamp = trigger_date.isoformat()
+        if stamp == step.get('last_fired'):
+            continue
+        due_at = _fire_datetime(trigger_date, fire_at, day_shift)
+        if stamp == step.get('last_attempt') and due_at <= now_dt:
+            continue
+        if due_at + datetime.timedelta(minutes=1) > now_dt:
+            return due_at
+    return None
+
+
+def _preloads(step):
+    """True if `step` is loaded ahead of its minute: a play of a playlist or
+    album. A single track starts in about 50ms, and nothing else loads
+    anything, so every other step still runs on its minute."""
+    return (SCHEDULE_PRELOAD_SECONDS > 0 and step.get('action') == 'play'
+            and _is_container_uri(step.get('uri', '')))
+
+
+def _preload_trigger(entry, step, now_dt):
+    """The trigger date of the run `step` should be preloaded for now, or None.
+
+    Open from SCHEDULE_PRELOAD_SECONDS before the step's minute until the
+    minute arrives, after which the ordinary claim takes over. A run is not
+    preloaded twice: a failed preload falls back to loading on the minute
+    rather than retrying inside the lead window.
+    """
+    if not _preloads(step):
+        return None
+    due_at = _next_step_fire(entry, step, now_dt)
+    if due_at is None:
+        return None
+    lead = datetime.timedelta(seconds=SCHEDULE_PRELOAD_SECONDS)
+    if not due_at - lead <= now_dt < due_at:
+        return None
+    _, day_shift = _step_fire_time(entry['time'], step.get('offset', 0))
+    trigger_date = due_at.date() - datetime.timedelta(days=day_shift)
+    if (step.get('preload') or {}).get('date') == trigger_date.isoformat():
+        return None
+    return trigger_date
+
+
+def _preload_volume(entry, index):
+    """The volume to set before preloading step `index`.
+
+    Its own, if it has one. Otherwise that of a volume step at the same
+    offset ahead of it -- the usual way a routine is written, and one that
+    would otherwise run only after the preloaded play had started, behind it
+    in the routine's lane.
+    """
+    steps = entry.get('steps', [])
+    step = steps[index]
+    if step.get('volume') is not None:
+        return step['volume']
+    for earlier in reversed(steps[:index]):
+        if earlier.get('offset', 0) != step.get('offset', 0):
+            continue
+        if earlier.get('action') == 'volume':
+            return earlier.get('volume')
+    return None
+
+
+def _upcoming_fires(now_dt):
+    """A heap of (due_at, entry id, step index) for every armed step.
+
+    A step whose retry window is open, or that is still in flight and may
+    fail into one, is due again SCHEDULE_TICK_SECONDS from now: retries are
+    claimed on the minute like anything else, so they need the old cadence.
+    A content load not yet preloaded for its run is due when its preload
+    window opens rather than on its minute.
+    """
+    recheck = now_dt + datetime.timedelta(seconds=SCHEDULE_TICK_SECONDS)
+    heap = []
+    with _schedules_lock:
+        for entry in _schedules:
+            if not entry.get('enabled', True) or not TIME_RE.match(entry.get('time', '')):
+                continue
+            for index, step in enumerate(entry.get('steps', [])):
+                key = (entry.get('id'), index)
+                fire_at, day_shift = _step_fire_time(entry['time'], step.get('offset', 0))
+                if key in _steps_in_flight or _retry_is_open(step, fire_at, day_shift, now_dt):
+                    heap.append((recheck, key[0] or '', index))
+                due_at = _next_step_fire(entry, step, now_dt)
+                if due_at is None:
+                    continue
+                trigger_date = due_at.date() - datetime.timedelta(days=day_shift)
+                if _preloads(step) and \
+                        (step.get('preload') or {}).get('date') != trigger_date.isoformat():
+                    due_at -= datetime.timedelta(seconds=SCHEDULE_PRELOAD_SECONDS)
+                heap.append((due_at, key[0] or '', index))
+    heapq.heapify(heap)
+    return heap
+
+
+def _seconds_until_next_fire(now_dt=None):
+    """How long the scheduler may sleep, capped at SCHEDULE_MAX_SLEEP_SECONDS."""
+    now_dt = now_dt or _clock.now()
+    heap = _upcoming_fires(now_dt)
+    if not heap:
+        return SCHEDULE_MAX_SLEEP_SECONDS
+    wait = (heap[0][0] - now_dt).total_seconds()
+    # Floored rather than zero: a step that is due but that _due_steps will
+    # not claim (already in flight for another run, say) would otherwise have
+    # the thread spinning flat out until its minute passed.
+    return min(max(wait, 0.05), SCHEDULE_MAX_SLEEP_SECONDS)
+
+
+def _load_is_deduped(action, uri):
+    """True while _content_load would answer this load of `uri` from its
+    dedupe table instead of sending it -- the same load is in flight, timed
+    out ambiguously, or finished within the dedupe window.
 
     The scheduler asks before clearing the queue ahead of a play: clearing
     and then not re-adding would wipe content that is still arriving (or
     already playing), which is a worse morning than a dirty queue.
     """
-    key = ('now', uri)
-    now = time.monotonic()
+    key = (action, uri)
+    now = _clock.monotonic()
     with _content_lock:
         entry = _content_loads.get(key)
         return entry is not None and now - entry['at'] <= CONTENT_DEDUP_SECONDS
@@ -727,22 +1596,21 @@ def _fire_schedule(dj, entry):
     action = entry.get('action')
     label = entry.get('label') or action
     try:
-        if action == 'play':
-            # Volume before play, so a wake-up cannot blast at whatever level
-            # last night ended on.
-            if entry.get('volume') is not None:
-                dj._do_volume(level=entry['volume'])
-            # Scheduled plays start from an empty queue. spotify/now inserts
-            # rather than replaces, so back-to-back routines piled onto each
-            # other and cleaning up between events was a manual chore. A
-            # failed clear is logged but does not block the play: the alarm
-            # going off matters more than the queue being tidy.
-            if not _now_load_is_deduped(entry['uri']):
-                cleared = dj._do_clearqueue()
-                if isinstance(cleared, dict) and 'error' in cleared:
-                    log.warning("Schedule %r: clearqueue before play failed "
-                                "(%s); playing anyway", label, cleared['error'])
-            result = dj._do_play(uri=entry['uri'])
+        if entry.get('_preload'):
+            return _fire_preloaded(dj, entry)
+        cued = entry.get('preload') == {'date': entry.get('_trigger_date'), 'cued': True}
+        if action == 'play' and cued:
+            # This step's own preload for this run reached the speaker.
+            # Loading it again would clear it away or queue a second copy;
+            # starting it is all that is left to do. Only its own marker
+            # counts: a cue of the same container by another routine, or a
+            # preload that timed out, says nothing about what is on the
+            # speaker now, and a bare resume would skip this step's volume
+            # and clear. Whether a load still in flight makes clearing unsafe
+            # is _load_for_routine's to decide.
+            result = dj._do_resume()
+        elif action == 'play':
+            result = _load_for_routine(dj, 'now', entry['uri'], entry.get('volume'), label)
         elif action == 'volume':
             result = dj._do_volume(level=entry['volume'])
         elif action == 'pause':
@@ -772,6 +1640,70 @@ def _fire_schedule(dj, entry):
     return True, None
 
 
+def _load_for_routine(dj, mode, uri, volume, label):
+    """Set the volume, clear the queue and load `uri` for a scheduled play.
+
+    One request to sonos-actions/routineload.js rather than three: each of
+    volume, clearqueue and spotify/now could fail on its own on wifi, and the
+    wake-up paid for every round trip. Volume comes first so a wake-up cannot
+    blast at whatever level last night ended on, and scheduled plays start
+    from an empty queue because spotify/now inserts rather than replaces.
+
+    Volume and clear stay best effort: the action reports their failures
+    alongside a successful load and they are logged here, because the alarm
+    going off matters more than the queue being tidy.
+    """
+    if _load_is_deduped(mode, uri):
+        # The same load is unsettled, so _content_load will answer from its
+        # dedupe table and send nothing -- and the clear must not go out on
+        # its own, or it would wipe content that is still arriving. Still the
+        # composite below: the entry can age out between the check and the
+        # load, and then what goes out has to be a whole routine load -- a
+        # plain spotify/cue is not a route, and spotify/now would queue
+        # behind whatever is there.
+        if volume is not None:
+            dj._do_volume(level=volume)
+        return dj._content_load(mode, uri, volume=volume, clear=True)
+
+    result = dj._content_load(mode, uri, volume=volume, clear=True)
+    for part, name in (('volumeError', 'volume'), ('clearError', 'clearqueue')):
+        if result.get(part):
+            log.warning("Schedule %r: %s before %s failed (%s); loaded anyway",
+                        label, name, mode, result[part])
+    return result
+
+
+def _fire_preloaded(dj, entry):
+    """Cue a scheduled play ahead of its minute, paused.
+
+    Only the load: the step is claimed again on its minute like any other,
+    and _fire_schedule then finds the cue and sends `play`. Waiting for the
+    minute here would hold a step worker for the whole lead window, and a
+    few routines preloading at once would starve every other lane.
+    Returns (ok, error) like _fire_schedule; _run_step reports it through
+    _record_preload_outcome, so a failure only means loading on the minute.
+    """
+    label = entry.get('label') or 'play'
+
+    # Loading into a speaker that is not there would only fail slowly, after
+    # the lead it was meant to buy.
+    ready, detail = _sonos_readiness()
+    if not ready:
+        log.warning("Schedule %r: Sonos not ready to preload (%s); "
+                    "loading on the minute instead", label, detail)
+        return False, f"Sonos not ready to preload: {detail}"
+
+    loaded = _load_for_routine(dj, 'cue', entry['uri'],
+                               entry.get('_preload_volume'), label)
+    if 'error' in loaded:
+        log.error("Schedule %r: preload failed (%s); loading on the minute instead",
+                  label, loaded['error'])
+        return False, loaded['error']
+
+    log.info("Schedule %r cued ahead of its minute", label)
+    return True, None
+
+
 def _proxied_art(url):
     """Rewrite the speaker's artwork URL to a same-origin path.
 
@@ -801,6 +1733,38 @@ def _proxied_art(url):
     return f"/albumart?{parts.query}" if parts.query else "/albumart"
 
 
+def _album_art(query_string):
+    """(content type, bytes) for one /albumart query: from _art_cache, or
+    from the speaker last seen serving art. Raises the HTTPError /albumart
+    answers with."""
+    with _art_lock:
+        origin = _art_origin
+        cached = _art_cache.get((origin, query_string))
+        if cached is not None:
+            _art_cache.move_to_end((origin, query_string))
+            return cached
+    if not origin:
+        raise cherrypy.HTTPError(404, "no artwork source known yet")
+
+    url = f"{origin}/getaa"
+    if query_string:
+        url += f"?{query_string}"
+
+    try:
+        response = requests.get(url, timeout=SONOS_TIMEOUT)
+    except requests.exceptions.RequestException as exc:
+        raise cherrypy.HTTPError(502, f"could not fetch artwork: {exc.__class__.__name__}")
+    if response.status_code != 200:
+        raise cherrypy.HTTPError(502, f"artwork returned HTTP {response.status_code}")
+
+    image = (response.headers.get('Content-Type', 'image/jpeg'), response.content)
+    with _art_lock:
+        _art_cache[(origin, query_string)] = image
+        while len(_art_cache) > ART_CACHE_ENTRIES:
+            _art_cache.popitem(last=False)
+    return image
+
+
 def _broadcast(payload):
     """Hand one event to every connected browser.
 
@@ -876,20 +1840,65 @@ _metrics = {
     'stream_clients_peak': 0,
     'schedule_fires': 0,
     'schedule_failures': 0,
+    # How long after its minute a step was claimed. Polling every 20s made
+    # this up to 20s by construction; it is the number that says whether the
+    # sleep-until-due scheduler is actually waking on time.
+    'schedule_lateness_samples': 0,
+    'schedule_lateness_seconds_total': 0.0,
+    'schedule_lateness_seconds_max': 0.0,
     'chat_calls': 0,
+    # Claude calls made, those that failed to produce a command, the tokens
+    # they spent, and /chat requests turned away by the daily budget.
+    'claude_calls': 0,
+    'claude_failures': 0,
+    'claude_input_tokens': 0,
+    'claude_output_tokens': 0,
+    'chat_budget_rejections': 0,
+    # Every Spotify client method called, and those that raised. Responses
+    # by status, including the 429s spotipy retried on its own, are in
+    # _spotify_statuses.
+    'spotify_calls': 0,
+    'spotify_failures': 0,
+    'spotify_rate_limited': 0,
+    'spotify_token_refreshes': 0,
+    'spotify_token_refresh_failures': 0,
+    # Refreshes made ahead of expiry by refresh_spotify_token, rather than
+    # inline by the request that found the token expired.
+    'spotify_token_refreshes_background': 0,
+    # sp.* calls the rate governor turned away rather than queue past their
+    # priority's limit.
+    'spotify_governor_rejections': 0,
+    # Track-change prefetches that ran, and those that met an error.
+    'prefetches': 0,
+    'prefetch_failures': 0,
+    # /container_tracks listings served whole from the cache, and those
+    # that had to be paged in from Spotify.
+    'container_cache_hits': 0,
+    'container_cache_misses': 0,
+    # The most workers ever busy at once, and connections turned away
+    # because every worker was busy and the queue was full.
+    'pool_busy_peak': 0,
+    'pool_rejected': 0,
 }
-_metrics_lock = threading.Lock()
+_metrics_lock = _named_lock('metrics')
+# The entries above that are a level -- a high-water mark -- rather than a
+# running total. Everything else in _metrics only ever goes up, and is
+# exposed to Prometheus as a counter so rate() and increase() apply to it.
+_METRIC_LEVELS = frozenset(('sonos_seconds_max', 'content_seconds_max',
+                            'schedule_lateness_seconds_max', 'stream_clients_peak',
+                            'pool_busy_peak'))
 
 
 def _is_content_endpoint(endpoint):
     """Content loads expand a whole container and are the slow class; keeping
     them out of the transport average is the difference between a useful
     number and one dominated by a single 46-second playlist."""
-    return endpoint.startswith('spotify/')
+    return endpoint.startswith(('spotify/', 'routineload/'))
 
 
 def _record_sonos_call(endpoint, seconds, ok):
     with _metrics_lock:
+        _observe_locked(_sonos_latency, _sonos_action(endpoint), seconds)
         _metrics['sonos_calls'] += 1
         if not ok:
             _metrics['sonos_failures'] += 1
@@ -901,9 +1910,660 @@ def _record_sonos_call(endpoint, seconds, ok):
             _metrics['sonos_seconds_max'] = max(_metrics['sonos_seconds_max'], seconds)
 
 
-def _record_metric(name, amount=1):
-    with _metrics_lock:
-        _metrics[name] += amount
+def _record_spotify_call(method, seconds, ok):
+    with _metrics_lock:
+        _observe_locked(_spotify_latency, method, seconds)
+        _metrics['spotify_calls'] += 1
+        if not ok:
+            _metrics['spotify_failures'] += 1
+
+
+def _retry_after_seconds(value):
+    """Retry-After as seconds, or None. Spotify sends a number of seconds;
+    the HTTP-date form is not worth parsing for a counter."""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _record_spotify_response(status, retry_after):
+    method = getattr(_spotify_local, 'method', None) or 'unknown'
+    seconds = _retry_after_seconds(retry_after) if status == 429 else None
+    with _metrics_lock:
+        _spotify_statuses[status] += 1
+        if status == 429:
+            _metrics['spotify_rate_limited'] += 1
+            _spotify_rate_limits[method] += 1
+            if seconds is not None:
+                _spotify_retry_after.observe(seconds)
+    if seconds:
+        _spotify_governor.block_for(seconds)
+
+
+def _record_token_refresh(ok, seconds, error, background=False, expires_at=None):
+    global _token_expires_at
+    with _metrics_lock:
+        _metrics['spotify_token_refreshes'] += 1
+        if background:
+            _metrics['spotify_token_refreshes_background'] += 1
+        if not ok:
+            _metrics['spotify_token_refresh_failures'] += 1
+        _token_refresh_latency.observe(seconds)
+        if expires_at is not None:
+            _token_expires_at = expires_at
+        _token_refreshes.append({
+            'at': round(_clock.time()), 'ok': ok,
+            'seconds': round(seconds, 3), 'error': error,
+            'background': background,
+        })
+
+
+def _record_metric(name, amount=1):
+    with _metrics_lock:
+        _metrics[name] += amount
+
+
+def _record_schedule_lateness(seconds):
+    seconds = max(seconds, 0.0)
+    with _metrics_lock:
+        _metrics['schedule_lateness_samples'] += 1
+        _metrics['schedule_lateness_seconds_total'] += seconds
+        _metrics['schedule_lateness_seconds_max'] = max(
+            _metrics['schedule_lateness_seconds_max'], seconds)
+
+
+class _Histogram:
+    """Counts of observations in fixed buckets, plus their sum and max.
+
+    Fixed upper bounds rather than stored samples, so a routine that has run
+    every morning for a year costs the same as one that ran once. Not
+    thread-safe on its own; callers hold the lock guarding the dict it
+    lives in.
+
+    Percentiles are estimated by interpolating inside the bucket the rank
+    falls in. With doubling buckets that is within a factor of two of the
+    true value, which is plenty to tell a 40ms p95 from a 4s one.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        # One past the last bound for everything slower than all of them.
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def copy(self):
+        other = _Histogram(self.bounds)
+        other.counts = list(self.counts)
+        other.total, other.max = self.total, self.max
+        return other
+
+    def quantile(self, q):
+        samples = sum(self.counts)
+        if not samples:
+            return 0.0
+        rank = q * samples
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[i - 1] if i else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / count
+                return min(estimate, self.max)
+            seen += count
+        return self.max
+
+    def snapshot(self):
+        """JSON view. Empty buckets are left out -- with doubling bounds most
+        of them are, and they would bury the few that say anything."""
+        samples = sum(self.counts)
+        labels = [f"le_{b:g}" for b in self.bounds] + ["slower"]
+        return {
+            'samples': samples,
+            'seconds_avg': round(self.total / samples, 3) if samples else 0.0,
+            'seconds_max': round(self.max, 3),
+            'p50': round(self.quantile(0.50), 4),
+            'p95': round(self.quantile(0.95), 4),
+            'p99': round(self.quantile(0.99), 4),
+            'buckets': {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+# A total, a max and a count cannot say what a typical call costs once one
+# 46-second load has gone into them, and say nothing about the tail. Calls are
+# therefore also kept as histograms -- one per Sonos action and one per HTTP
+# endpoint -- on doubling bounds from 1ms to about two minutes, which spans a
+# volume change and the largest playlist expansion alike. Keyed on the action
+# or handler name only, never on the URI or query, so the number of series is
+# fixed by the code rather than by what callers send.
+LATENCY_BUCKETS_SECONDS = tuple(0.001 * 2 ** i for i in range(18))
+_sonos_latency = {}
+_endpoint_latency = {}
+
+# Spotify, by client method -- search, album, current_user_saved_tracks --
+# which is what says which UI flow is spending the rate limit. Responses by
+# HTTP status, 429s by the method that met them, the Retry-After each 429
+# asked for, and the last few token refreshes. All under _metrics_lock.
+RETRY_AFTER_BUCKETS_SECONDS = (1, 2, 5, 10, 30, 60, 300, 3600)
+SPOTIFY_REFRESHES_KEPT = 20
+_spotify_latency = {}
+_spotify_statuses = collections.Counter()
+_spotify_rate_limits = collections.Counter()
+_spotify_retry_after = _Histogram(RETRY_AFTER_BUCKETS_SECONDS)
+_token_refreshes = collections.deque(maxlen=SPOTIFY_REFRESHES_KEPT)
+_token_refresh_latency = _Histogram(LATENCY_BUCKETS_SECONDS)
+# When the access token last seen expires, epoch seconds, or None.
+_token_expires_at = None
+# How long sp.* calls queued at the governor, by priority.
+_spotify_queue_wait = {}
+
+
+# ==================== SPOTIFY RATE GOVERNOR ====================
+#
+# spotipy retries a 429 by sleeping out its Retry-After, but only for the
+# call that met it: every other thread carried on spending the same limit,
+# met 429s of its own, and one guest's search surfaced the error through
+# _handles_spotify_errors. Background work -- cache refreshes, prefetch --
+# spent the same budget as a person waiting at the page.
+#
+# Every sp.* call now takes a token from one bucket first. A 429 seen
+# anywhere closes the bucket to everyone until its Retry-After has passed.
+# Waiters are served strictly by priority, then by arrival, so a queued
+# refresh never takes the token a search is waiting for. The bucket counts
+# client method calls, not HTTP requests: spotipy's own retries of a call
+# ride on the token it already holds.
+
+SPOTIFY_PRIORITIES = ('interactive', 'background')
+SPOTIFY_RATE_PER_SECOND = _setting('spotify_rate_per_second')
+SPOTIFY_BURST = _setting('spotify_burst')
+SPOTIFY_QUEUE_MAX_SECONDS = {**DEFAULTS['spotify_queue_max_seconds'],
+                             **_setting('spotify_queue_max_seconds')}
+
+
+class _SpotifyGovernor:
+    """Token bucket with a priority queue and a global Retry-After.
+
+    Timed with time.monotonic rather than _clock, since it has to block:
+    a waiter sleeps on a Condition, which only real time can wake.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._waiting = []                  # heap of (priority rank, arrival)
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition(_named_lock('spotify_governor'))
+
+    def _refill_locked(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority):
+        """Take a token, waiting behind anyone of higher priority or who came
+        first. Raises a 429 SpotifyException, Retry-After included, instead
+        of waiting past SPOTIFY_QUEUE_MAX_SECONDS[priority]."""
+        started = time.monotonic()
+        deadline = started + SPOTIFY_QUEUE_MAX_SECONDS[priority]
+        ticket = (SPOTIFY_PRIORITIES.index(priority), next(self._arrivals))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill_locked(now)
+                    ready = max(self.blocked_until,
+                                now + max(0.0, 1 - self.tokens) / self.rate)
+                    if self._waiting[0] == ticket and ready <= now:
+                        self.tokens -= 1
+                        break
+                    if self.blocked_until > deadline or now >= deadline:
+                        wait = max(1, int(max(ready, self.blocked_until) - now + 0.999))
+                        _record_spotify_queue_wait(priority, now - started, rejected=True)
+                        raise SpotifyException(
+                            429, -1, f"Spotify rate limit reached -- retry in {wait}s",
+                            headers={'Retry-After': str(wait)})
+                    # The head sleeps until its token is due; the rest until
+                    # the head moves, which notify_all below announces.
+                    self._cond.wait(min(deadline, ready if self._waiting[0] == ticket
+                                        else deadline) - now)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+        _record_spotify_queue_wait(priority, time.monotonic() - started)
+
+    def block_for(self, seconds):
+        """Close the bucket to every caller for `seconds`, as a 429 asks."""
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def snapshot(self):
+        with self._cond:
+            now = time.monotonic()
+            self._refill_locked(now)
+            return {
+                'tokens': round(self.tokens, 2),
+                'waiting': len(self._waiting),
+                'blocked_seconds': round(max(0.0, self.blocked_until - now), 1),
+                'rate_per_second': self.rate,
+                'burst': self.burst,
+            }
+
+
+_spotify_governor = _SpotifyGovernor(SPOTIFY_RATE_PER_SECOND, SPOTIFY_BURST)
+
+
+@contextlib.contextmanager
+def _spotify_priority(priority):
+    """Run the sp.* calls in this block at `priority`. Background work wraps
+    itself in _spotify_priority('background'); everything else is a person
+    waiting and stays 'interactive'."""
+    outer = getattr(_spotify_local, 'priority', 'interactive')
+    _spotify_local.priority = priority
+    try:
+        yield
+    finally:
+        _spotify_local.priority = outer
+
+
+def _record_spotify_queue_wait(priority, seconds, rejected=False):
+    with _metrics_lock:
+        _observe_locked(_spotify_queue_wait, priority, seconds)
+        if rejected:
+            _metrics['spotify_governor_rejections'] += 1
+
+
+# ==================== SPOTIFY TOKEN REFRESH ====================
+#
+# The access token lasts an hour, and spotipy refreshed it only when a call
+# found it expired -- so once an hour a guest's search waited on the accounts
+# service as well as on the search, and a slow refresh stalled it outright.
+# A Monitor now checks the token every SPOTIFY_TOKEN_CHECK_SECONDS and
+# refreshes it once it is within SPOTIFY_TOKEN_REFRESH_AHEAD_SECONDS of
+# expiry. spotipy writes the new token through _AtomicCacheFileHandler, so
+# every reader sees either the old token or the new one. If the background
+# refresh fails, it is tried again on the next tick. A request that finds the
+# token expired still refreshes it inline, as before.
+
+SPOTIFY_TOKEN_REFRESH_AHEAD_SECONDS = _setting('spotify_token_refresh_ahead_seconds')
+SPOTIFY_TOKEN_CHECK_SECONDS = 60
+
+
+def refresh_spotify_token():
+    """Monitor tick: refresh the access token if it is close to expiry.
+    Never raises -- a failed refresh is counted and logged by the wrapper
+    _instrument_spotify put on the auth manager."""
+    global _token_expires_at
+    auth = getattr(sp._client, 'auth_manager', None)
+    if auth is None:
+        return
+    try:
+        token = auth.cache_handler.get_cached_token()
+        if not token or not token.get('refresh_token'):
+            return
+        with _metrics_lock:
+            _token_expires_at = token.get('expires_at')
+        if token.get('expires_at', 0) - _clock.time() > SPOTIFY_TOKEN_REFRESH_AHEAD_SECONDS:
+            return
+        with _spotify_priority('background'):
+            auth.refresh_access_token(token['refresh_token'])
+    except Exception as exc:
+        log.warning("Background Spotify token refresh failed: %s", type(exc).__name__)
+
+
+def _sonos_action(endpoint):
+    """The action part of a Sonos endpoint: 'volume' for 'volume/20', and
+    the mode too for content loads -- 'spotify/now', 'routineload/cue' --
+    because a load that plays and one that queues are different costs."""
+    parts = endpoint.strip('/').split('/')
+    if parts[0] in ('spotify', 'routineload') and len(parts) > 1:
+        return f"{parts[0]}/{parts[1]}"
+    return parts[0] or 'unknown'
+
+
+def _prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _prometheus_exposition(values, histograms, totals=()):
+    """Render /metrics in the Prometheus text format.
+
+    `values` is the JSON snapshot; its numeric values become one metric
+    each, prefixed dj_. Those named in `totals` only ever go up and are
+    typed counter, with the _total suffix the format expects; the rest are
+    levels and typed gauge. `histograms` maps a metric name to (label name,
+    {label value: _Histogram}), rendered with cumulative buckets as the
+    format requires.
+    """
+    lines = []
+    for name, value in sorted(values.items()):
+        if isinstance(value, bool) or value is None:
+            value = int(bool(value))
+        if not isinstance(value, (int, float)):
+            continue
+        if name in totals:
+            metric = f"dj_{name}" if name.endswith('_total') else f"dj_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+        else:
+            metric = f"dj_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {value}")
+    for metric, (label, table) in histograms.items():
+        lines.append(f"# TYPE {metric} histogram")
+        for key, histogram in sorted(table.items()):
+            tag = f'{label}="{_prometheus_label(key)}"'
+            running = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                running += count
+                lines.append(f'{metric}_bucket{{{tag},le="{bound:g}"}} {running}')
+            running += histogram.counts[-1]
+            lines.append(f'{metric}_bucket{{{tag},le="+Inf"}} {running}')
+            lines.append(f'{metric}_sum{{{tag}}} {histogram.total:.6f}')
+            lines.append(f'{metric}_count{{{tag}}} {running}')
+    return '\n'.join(lines) + '\n'
+
+
+def _observe_locked(table, name, seconds):
+    """Caller holds _metrics_lock."""
+    histogram = table.get(name)
+    if histogram is None:
+        histogram = table[name] = _Histogram(LATENCY_BUCKETS_SECONDS)
+    histogram.observe(seconds)
+
+
+# _metrics holds running totals since start, which say how much but not when:
+# whether Sonos got slower this week, or chat spiked last night, needs the
+# same numbers per minute. A minute's worth is sampled from the totals once a
+# minute into fixed-size arrays indexed by minute modulo a week, so the store
+# is a few hundred kilobytes on day one and on day one thousand, and is
+# written to disk on shutdown so a restart does not wipe the week.
+METRICS_HISTORY_MINUTES = 7 * 24 * 60
+METRICS_HISTORY_SAMPLE_SECONDS = 60
+METRICS_HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'metrics-history.json')
+
+# name -> (array typecode, value for a minute nothing was sampled in). The
+# counts are what happened in that minute; stream_clients and sonos_ready are
+# the state when it was sampled, sonos_ready being 1, 0, or -1 before the
+# watchdog's first check. Transport calls only in sonos_calls and
+# sonos_seconds, for the reason _metrics keeps them apart.
+METRICS_HISTORY_SERIES = {
+    'sonos_calls': ('I', 0),
+    'sonos_seconds': ('f', 0.0),
+    'sonos_failures': ('I', 0),
+    'content_loads': ('I', 0),
+    'chat_calls': ('I', 0),
+    'stream_clients': ('H', 0),
+    'sonos_ready': ('b', -1),
+    'sampled': ('B', 0),
+}
+# Running totals in _metrics whose per-minute difference is recorded.
+_HISTORY_COUNTERS = ('sonos_calls', 'sonos_seconds', 'sonos_failures',
+                     'content_loads', 'chat_calls')
+
+
+class _MetricHistory:
+    """Per-minute series in ring buffers one week long.
+
+    Minutes are counted from the epoch, and minute m lives in slot
+    m % capacity. `latest` is the newest minute written; moving it forward
+    blanks every slot skipped over, so a slot never shows a reading from a
+    week ago as if it were this week's. Not thread-safe on its own; callers
+    hold _history_lock.
+    """
+
+    def __init__(self, capacity=METRICS_HISTORY_MINUTES):
+        self.capacity = capacity
+        self.series = {name: array.array(code, [blank] * capacity)
+                       for name, (code, blank) in METRICS_HISTORY_SERIES.items()}
+        self.latest = None
+        # The totals at the previous sample, to take the next one's
+        # difference from. Zero at start, which is what _metrics starts at.
+        self.previous = dict.fromkeys(_HISTORY_COUNTERS, 0)
+
+    def _advance(self, minute):
+        if self.latest is None:
+            first = minute - self.capacity + 1
+        else:
+            first = max(self.latest + 1, minute - self.capacity + 1)
+        for m in range(first, minute + 1):
+            slot = m % self.capacity
+            for name, (_, blank) in METRICS_HISTORY_SERIES.items():
+                self.series[name][slot] = blank
+        self.latest = minute
+
+    def holds(self, minute):
+        return (self.latest is not None
+                and self.latest - self.capacity < minute <= self.latest)
+
+    def sample(self, minute, totals, state):
+        """Record one sample: the counters' growth since the last one, and
+        the current state. Two samples landing in one minute -- the Monitor
+        drifts -- add up rather than the second replacing the first."""
+        if self.latest is None or minute > self.latest:
+            self._advance(minute)
+        elif not self.holds(minute):
+            return
+        slot = minute % self.capacity
+        for name in _HISTORY_COUNTERS:
+            # A total below the last one means _metrics was reset under us;
+            # count from zero rather than record a negative minute.
+            delta = totals[name] - self.previous[name]
+            if delta < 0:
+                delta = totals[name]
+            self.previous[name] = totals[name]
+            self.series[name][slot] += delta
+        for name, value in state.items():
+            self.series[name][slot] = value
+        self.series['sampled'][slot] = 1
+
+    def window(self, end, minutes, step):
+        """`minutes` ending at minute `end`, in buckets of `step` minutes.
+
+        Counts are summed over a bucket and states take its worst reading:
+        the most stream clients, and Sonos down if it was down at all. A
+        bucket with no sample in it is None throughout, so a sparkline shows
+        a gap rather than a flat zero where the server was not running.
+        """
+        start = end - minutes + 1
+        points = {name: [] for name in METRICS_HISTORY_SERIES if name != 'sampled'}
+        points['sonos_seconds_avg'] = []
+        for bucket in range(start, end + 1, step):
+            slots = [m % self.capacity for m in range(bucket, min(bucket + step, end + 1))
+                     if self.holds(m) and self.series['sampled'][m % self.capacity]]
+            if not slots:
+                for values in points.values():
+                    values.append(None)
+                continue
+            for name in _HISTORY_COUNTERS:
+                points[name].append(sum(self.series[name][s] for s in slots))
+            points['stream_clients'].append(max(self.series['stream_clients'][s] for s in slots))
+            readings = [self.series['sonos_ready'][s] for s in slots
+                        if self.series['sonos_ready'][s] >= 0]
+            points['sonos_ready'].append(min(readings) if readings else None)
+            calls = points['sonos_calls'][-1]
+            points['sonos_seconds_avg'].append(
+                round(points['sonos_seconds'][-1] / calls, 4) if calls else None)
+            points['sonos_seconds'][-1] = round(points['sonos_seconds'][-1], 3)
+        return {
+            'start': start * 60,
+            'step_minutes': step,
+            'points': len(range(start, end + 1, step)),
+            'series': points,
+        }
+
+    def to_json(self):
+        """Oldest first, ending at `latest`."""
+        if self.latest is None:
+            return {'latest': None, 'series': {}}
+        order = [m % self.capacity
+                 for m in range(self.latest - self.capacity + 1, self.latest + 1)]
+        return {
+            'latest': self.latest,
+            'series': {name: [round(values[s], 4) if values.typecode == 'f' else values[s]
+                              for s in order]
+                       for name, values in self.series.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data, capacity=METRICS_HISTORY_MINUTES):
+        """Rebuild from to_json(). Raises ValueError, TypeError or
+        OverflowError on anything that is not one."""
+        history = cls(capacity)
+        latest = data['latest']
+        if latest is None:
+            return history
+        history._advance(int(latest))
+        for name, values in data['series'].items():
+            if name not in history.series:
+                continue
+            values = values[-capacity:]
+            first = history.latest - len(values) + 1
+            for m, value in zip(range(first, history.latest + 1), values):
+                history.series[name][m % capacity] = value
+        return history
+
+
+_history_lock = _named_lock('history')
+_metric_history = _MetricHistory()
+
+
+def sample_metrics_history():
+    """Monitor tick: add this minute's sample. Never raises, for the same
+    reason as the watchdog tick."""
+    try:
+        with _metrics_lock:
+            totals = {
+                'sonos_calls': _metrics['sonos_calls'] - _metrics['content_loads'],
+                'sonos_seconds': _metrics['sonos_seconds_total'],
+                'sonos_failures': _metrics['sonos_failures'],
+                'content_loads': _metrics['content_loads'],
+                'chat_calls': _metrics['chat_calls'],
+            }
+        with _watchdog_lock:
+            ready = _watchdog['ok']
+        with _stream_lock:
+            clients = len(_stream_clients)
+        state = {
+            'stream_clients': min(clients, 0xFFFF),
+            'sonos_ready': -1 if ready is None else int(ready),
+        }
+        minute = int(_clock.time() // 60)
+        with _history_lock:
+            _metric_history.sample(minute, totals, state)
+    except Exception as exc:
+        log.error("Metrics history sample failed: %s: %s", type(exc).__name__, exc)
+
+
+def _load_metrics_history():
+    """Pick up the week saved at the last shutdown, if there is one."""
+    global _metric_history
+    try:
+        with open(METRICS_HISTORY_PATH) as f:
+            history = _MetricHistory.from_json(json.load(f))
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError, TypeError, KeyError, OverflowError) as exc:
+        # Losing the history is a shame; refusing to start over it is worse.
+        log.error("Cannot read %s (%s) -- starting with no metrics history",
+                  METRICS_HISTORY_PATH, exc)
+        return
+    with _history_lock:
+        _metric_history = history
+    log.info("Loaded metrics history from %s", METRICS_HISTORY_PATH)
+
+
+def save_metrics_history():
+    """Engine stop: write the week out. Temp file plus rename, as for
+    schedules, so a kill mid-write leaves the previous snapshot intact."""
+    with _history_lock:
+        data = _metric_history.to_json()
+    tmp = METRICS_HISTORY_PATH + '.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, METRICS_HISTORY_PATH)
+    except OSError as exc:
+        log.error("Cannot write %s: %s", METRICS_HISTORY_PATH, exc)
+
+
+# When a wake-up is late, the claim-lateness counters above cannot say
+# whether it was the tick, a wait on _schedules_lock, a lane still busy with
+# the routine's previous step, or a slow load. Every executed step therefore
+# records its own timeline -- scheduled, claimed, started, finished -- into a
+# bounded per-step history, and how late it actually took effect into a
+# histogram per routine. History is keyed on the step's identity as well as
+# its index, so an edit that moves steps around cannot hand one step's
+# history to another; _prune_step_timings_locked drops what an edit orphans.
+LATENESS_BUCKETS_SECONDS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+_routine_latency = {}
+_step_history = {}
+_timings_lock = threading.Lock()
+
+
+def _step_history_key(entry_id, index, step):
+    return (entry_id, index, tuple(_step_identity(step)))
+
+
+def _record_step_timing(claimed, started, finished, ok, error):
+    """File one execution of a claimed step under its routine and step.
+
+    Times are stored as seconds relative to the scheduled minute, so a
+    preload shows up as a negative start and every number reads as "how far
+    from 07:00". Only a successful step feeds the routine's histogram: a
+    failed one changed nothing on the speaker, and its retry is what lands.
+    """
+    entry_id = claimed.get('_entry_id')
+    due = datetime.datetime.fromisoformat(claimed['_due_at']).timestamp()
+    run = {
+        'date': claimed.get('_trigger_date'),
+        'scheduled': claimed['_due_at'],
+        'claimed': round(claimed.get('_claimed_at', started) - due, 3),
+        'lock_wait': round(claimed.get('_lock_wait', 0.0), 3),
+        'started': round(started - due, 3),
+        'finished': round(finished - due, 3),
+        'ok': ok,
+        'error': error,
+        'attempt': claimed.get('attempts', 1),
+        'preload': bool(claimed.get('_preload')),
+    }
+    key = _step_history_key(entry_id, claimed.get('_step_index'), claimed)
+    with _timings_lock:
+        history = _step_history.get(key)
+        if history is None:
+            history = _step_history[key] = collections.deque(
+                maxlen=SCHEDULE_HISTORY_PER_STEP)
+        history.append(run)
+        # A preload only cued; the play on the minute is what lands.
+        if ok and not claimed.get('_preload'):
+            histogram = _routine_latency.get(entry_id)
+            if histogram is None:
+                histogram = _routine_latency[entry_id] = _Histogram(
+                    LATENESS_BUCKETS_SECONDS)
+            histogram.observe(max(finished - due, 0.0))
+
+
+def _prune_step_timings_locked():
+    """Forget timings for routines and steps that no longer exist. Caller
+    holds _schedules_lock."""
+    live = {_step_history_key(entry.get('id'), index, step)
+            for entry in _schedules
+            for index, step in enumerate(entry.get('steps', []))}
+    ids = {entry.get('id') for entry in _schedules}
+    with _timings_lock:
+        for key in [k for k in _step_history if k not in live]:
+            del _step_history[key]
+        for entry_id in [i for i in _routine_latency if i not in ids]:
+            del _routine_latency[entry_id]
 
 
 def _notify(title, message):
@@ -966,21 +2626,149 @@ def check_sonos_readiness():
         log.error("Watchdog tick failed: %s: %s", type(exc).__name__, exc)
 
 
+def _run_step(dj, step):
+    """Fire one claimed step and report it, whatever happens."""
+    # finally, not just the happy path: an unreleased in-flight claim blocks
+    # that step forever, which is the silent failure the retry work exists to
+    # remove.
+    ok, error = False, "tick aborted before the step reported"
+    started = _clock.time()
+    try:
+        # Timed around the call alone and filed before the outcome: the
+        # outcome waits on _schedules_lock, which is not the speaker's time,
+        # and a failure to record it must not lose the sample as well.
+        try:
+            ok, error = _fire_schedule(dj, step)
+        finally:
+            _record_step_timing(step, started, _clock.time(), ok, error)
+    finally:
+        if step.get('_preload'):
+            _record_preload_outcome(step, ok)
+        else:
+            _record_step_outcome(step, ok, error)
+
+
+def _run_lane(dj, entry_id, steps, done):
+    """Work through one routine's batches in order, then give the lane up.
+
+    Runs on the step pool. Each step is guarded on its own, so a step whose
+    outcome could not be recorded does not strand the ones behind it.
+    """
+    while True:
+        for step in steps:
+            try:
+                _run_step(dj, step)
+            except Exception as exc:
+                log.error("Schedule %r step failed to report: %s: %s",
+                          step.get('label'), type(exc).__name__, exc)
+        done.set_result(None)
+
+        with _lanes_lock:
+            waiting = _step_lanes[entry_id]
+            if not waiting:
+                del _step_lanes[entry_id]
+                return
+            steps, done = waiting.pop(0)
+
+
+def _dispatch_steps(dj, entry_id, steps):
+    """Queue a routine's claimed steps behind anything it is still running.
+
+    Returns a future that resolves once these steps have all reported.
+    """
+    done = concurrent.futures.Future()
+    with _lanes_lock:
+        waiting = _step_lanes.get(entry_id)
+        if waiting is not None:
+            waiting.append((steps, done))
+            return done
+        _step_lanes[entry_id] = []
+    try:
+        _step_executor.submit(_run_lane, dj, entry_id, steps, done)
+    except RuntimeError:
+        # The pool refuses work once the interpreter is shutting down. These
+        # steps are already claimed, so run them here rather than leak them.
+        _run_lane(dj, entry_id, steps, done)
+    return done
+
+
 def run_due_schedules(dj):
-    """Scheduler tick. Wrapped so an unexpected error cannot kill the Monitor
-    thread and silently stop every future routine."""
+    """Scheduler tick: claim what is due and hand it to the step pool.
+
+    Wrapped so an unexpected error cannot kill the scheduler thread and
+    silently stop every future routine.
+
+    Steps used to run one after another on the scheduler thread, so a
+    46-second content load in one routine held up an unrelated volume step
+    in another. Each routine now gets a lane on a bounded pool: its own steps
+    still run in offset order -- volume 12 before play, never after -- while
+    separate routines run side by side.
+
+    Returns one future per routine that had anything due. The scheduler does
+    not wait on them, which is the point; they are there for a caller that
+    needs to know the steps have finished.
+    """
     try:
+        batches = {}
         for step in _due_steps():
-            # finally, not just the happy path: an unreleased in-flight claim
-            # blocks that step forever, which is the silent failure this whole
-            # change exists to remove.
-            ok, error = False, "tick aborted before the step reported"
-            try:
-                ok, error = _fire_schedule(dj, step)
-            finally:
-                _record_step_outcome(step, ok, error)
+            batches.setdefault(step.get('_entry_id'), []).append(step)
+        return [_dispatch_steps(dj, entry_id, steps)
+                for entry_id, steps in batches.items()]
     except Exception as exc:
         log.error("Scheduler tick failed: %s: %s", type(exc).__name__, exc)
+        return []
+
+
+class _Scheduler(cherrypy.process.plugins.SimplePlugin):
+    """Sleep until the next step is due, then run whatever is due.
+
+    Replaces a Monitor that polled every schedule_tick_seconds. Polling made a
+    07:00 wake-up up to 20s late by construction and woke the process 4,320
+    times a day to find nothing. The claim itself is unchanged -- this thread
+    only decides *when* to ask _due_steps, so the attempt stamping, retry
+    window and in-flight guard all behave exactly as they did under the poll.
+
+    A plugin rather than a bare thread for the reason the Monitor was one: it
+    starts and stops with the engine, so a restart cannot orphan it.
+    """
+
+    def __init__(self, bus, dj):
+        super().__init__(bus)
+        self.dj = dj
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        if self.thread is None:
+            self.stopping.clear()
+            self.thread = threading.Thread(
+                target=self.run, name='dj_scheduler', daemon=True)
+            self.thread.start()
+    start.priority = 70
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopping.set()
+            _wake_scheduler()
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stopping.is_set():
+            # Cleared before the work, not after the wait: a save landing
+            # while the tick runs either shows up in the recomputation below
+            # or sets the event again and cuts the next sleep short.
+            _schedules_changed.clear()
+            run_due_schedules(self.dj)
+            try:
+                delay = _seconds_until_next_fire()
+            except Exception as exc:
+                # Same reasoning as the tick: a raise here ends the thread
+                # and every future routine with it.
+                log.error("Scheduler could not compute its next wake-up: %s: %s",
+                          type(exc).__name__, exc)
+                delay = SCHEDULE_TICK_SECONDS
+            _schedules_changed.wait(delay)
 
 
 _schedules = _load_schedules()
@@ -1003,11 +2791,12 @@ MAX_STATIONS = _setting('max_stations')
 MAX_CHAT_MESSAGE_CHARS = _setting('max_chat_message_chars')
 CHAT_CALLS_PER_MINUTE = _setting('chat_calls_per_minute')
 MAX_CHAT_SESSIONS = _setting('max_chat_sessions')
+CHAT_DAILY_TOKEN_BUDGET = _setting('chat_daily_token_budget')
 MAX_REQUEST_BODY_BYTES = _setting('max_request_body_bytes')
 
 # Per-session call times for /chat, as {session_id: [monotonic, ...]}.
 _chat_calls = {}
-_chat_lock = threading.Lock()
+_chat_lock = _named_lock('chat')
 
 
 def _check_chat_rate(session_id):
@@ -1018,7 +2807,7 @@ def _check_chat_rate(session_id):
     A sliding window rather than a fixed one, so a caller cannot get a double
     allowance by straddling a minute boundary.
     """
-    now = time.monotonic()
+    now = _clock.monotonic()
     with _chat_lock:
         recent = [t for t in _chat_calls.get(session_id, []) if now - t < 60]
         if len(recent) >= CHAT_CALLS_PER_MINUTE:
@@ -1039,7 +2828,115 @@ def _check_chat_rate(session_id):
             while len(_chat_calls) > MAX_CHAT_SESSIONS:
                 del _chat_calls[min(_chat_calls, key=lambda s: _chat_calls[s][-1])]
 
-_stations_lock = threading.Lock()
+
+# chat_calls said how often /chat was used and nothing about what it cost.
+# Every Claude call now records its tokens, how long it took, why it stopped
+# and what it decided -- an action, or which way it failed -- totalled per
+# session, per hour for the last two days, and per local day for the budget.
+# All under _metrics_lock, like the rest of /metrics.
+CLAUDE_USAGE_HOURS_KEPT = 48
+_claude_latency = _Histogram(LATENCY_BUCKETS_SECONDS)
+_claude_stop_reasons = collections.Counter()
+_claude_outcomes = collections.Counter()
+_claude_hours = {}      # hour start, epoch seconds -> totals
+_claude_sessions = {}   # session_id -> totals
+_claude_day = {'date': None, 'tokens': 0}
+
+
+def _claude_today_locked():
+    """Today's token count, restarted at local midnight. Caller holds
+    _metrics_lock."""
+    today = _clock.now().date().isoformat()
+    if _claude_day['date'] != today:
+        _claude_day.update(date=today, tokens=0)
+    return _claude_day
+
+
+def _check_chat_budget():
+    """Abort with 429 once today's tokens reach CHAT_DAILY_TOKEN_BUDGET.
+
+    Checked before the call, so the refusal is immediate and free. The call
+    that crosses the line is allowed to finish -- its cost is not known until
+    it has been paid.
+    """
+    if not CHAT_DAILY_TOKEN_BUDGET:
+        return
+    with _metrics_lock:
+        spent = _claude_today_locked()['tokens']
+        if spent >= CHAT_DAILY_TOKEN_BUDGET:
+            _metrics['chat_budget_rejections'] += 1
+    if spent >= CHAT_DAILY_TOKEN_BUDGET:
+        now = _clock.now()
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1),
+                                             datetime.time())
+        _too_many_requests("Today's chat budget is used up -- the buttons still work",
+                           max(1, int((midnight - now).total_seconds())))
+
+
+def _record_claude_call(session_id, seconds, response, outcome):
+    """One Claude call. `response` is None when the call itself failed; the
+    SDK's usage splits input into fresh and cached, and all of it is billed."""
+    usage = getattr(response, 'usage', None)
+    tokens_in = tokens_out = 0
+    if usage is not None:
+        tokens_in = sum(getattr(usage, field, None) or 0 for field in (
+            'input_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens'))
+        tokens_out = getattr(usage, 'output_tokens', None) or 0
+    stop_reason = getattr(response, 'stop_reason', None) if response is not None else None
+    failed = outcome in CLAUDE_FAILURES
+    hour = int(_clock.time() // 3600) * 3600
+
+    with _metrics_lock:
+        _metrics['claude_calls'] += 1
+        _metrics['claude_failures'] += failed
+        _metrics['claude_input_tokens'] += tokens_in
+        _metrics['claude_output_tokens'] += tokens_out
+        _claude_latency.observe(seconds)
+        _claude_outcomes[outcome] += 1
+        if stop_reason:
+            _claude_stop_reasons[stop_reason] += 1
+        _claude_today_locked()['tokens'] += tokens_in + tokens_out
+
+        for table, key in ((_claude_hours, hour), (_claude_sessions, session_id)):
+            totals = table.setdefault(key, {
+                'calls': 0, 'failures': 0, 'input_tokens': 0, 'output_tokens': 0,
+                'seconds_total': 0.0, 'last': 0})
+            totals['calls'] += 1
+            totals['failures'] += failed
+            totals['input_tokens'] += tokens_in
+            totals['output_tokens'] += tokens_out
+            totals['seconds_total'] += seconds
+            totals['last'] = round(_clock.time())
+
+        # Bounded like _chat_calls: the hour table by age, the session table
+        # by count, dropping whoever called least recently.
+        for old in [h for h in _claude_hours if h <= hour - CLAUDE_USAGE_HOURS_KEPT * 3600]:
+            del _claude_hours[old]
+        while len(_claude_sessions) > MAX_CHAT_SESSIONS:
+            del _claude_sessions[min(_claude_sessions,
+                                     key=lambda s: _claude_sessions[s]['last'])]
+
+
+def _claude_usage_locked():
+    """The /metrics view. Caller holds _metrics_lock."""
+    def view(totals):
+        return {**totals, 'seconds_total': round(totals['seconds_total'], 3)}
+
+    today = _claude_today_locked()
+    return {
+        'latency': _claude_latency.snapshot(),
+        'stop_reasons': dict(_claude_stop_reasons),
+        'outcomes': dict(_claude_outcomes),
+        'today': {
+            'date': today['date'],
+            'tokens': today['tokens'],
+            'budget': CHAT_DAILY_TOKEN_BUDGET or None,
+        },
+        'hours': [{'hour': h, **view(t)} for h, t in sorted(_claude_hours.items())],
+        'sessions': {s: view(t) for s, t in _claude_sessions.items()},
+    }
+
+_stations_lock = _named_lock('stations')
 _stations = []
 
 
@@ -1176,8 +3073,9 @@ def _is_authenticated():
 
 def _check_auth():
     """before_handler hook: reject unauthenticated requests with 401 JSON."""
-    if cherrypy.request.path_info.rstrip('/') in PUBLIC_PATHS or _is_authenticated():
-        return
+    with _Span('auth'):
+        if cherrypy.request.path_info.rstrip('/') in PUBLIC_PATHS or _is_authenticated():
+            return
 
     cherrypy.response.status = 401
     cherrypy.response.headers['Content-Type'] = 'application/json'
@@ -1189,6 +3087,466 @@ def _check_auth():
 cherrypy.tools.djauth = cherrypy.Tool('before_handler', _check_auth, priority=10)
 
 
+def _endpoint_name(path_info):
+    """The handler a path resolves to, for labelling its latency.
+
+    The first path segment, if DJServer exposes it -- '/schedules/timeline'
+    is 'schedules'. Anything else is 'unknown', so a scan of made-up paths
+    cannot create a series per path.
+    """
+    name = path_info.strip('/').split('/')[0] or 'index'
+    handler = getattr(DJServer, name, None)
+    return name if getattr(handler, 'exposed', False) else 'unknown'
+
+
+def _start_request_timer():
+    """on_start_resource hook: stamp the request and time it to the end.
+
+    on_end_request rather than before_finalize, so what is measured includes
+    writing the body -- for a streamed response that is nearly all of it.
+    Rejected requests are timed too; a 401 that is slow is still slow.
+    """
+    started = time.monotonic()
+    cherrypy.request.dj_started = started
+    _trace_local.trace = {'t0': started, 'at': time.time(), 'spans': []}
+    cherrypy.request.hooks.attach('on_end_request', _record_request_time)
+    _record_pool_pickup(started)
+
+
+def _record_request_time():
+    started = getattr(cherrypy.request, 'dj_started', None)
+    trace, _trace_local.trace = getattr(_trace_local, 'trace', None), None
+    if started is None:
+        return
+    name = _endpoint_name(cherrypy.request.path_info)
+    seconds = time.monotonic() - started
+    with _metrics_lock:
+        _observe_locked(_endpoint_latency, name, seconds)
+    if trace is not None and name not in UNTRACED_ENDPOINTS:
+        _keep_if_slow(trace, name, seconds)
+
+
+# A guest's "it took ages to queue" used to be unanswerable: nothing tied the
+# request to the Spotify, Sonos and Claude calls it made. Each request now
+# carries a trace in a thread-local -- CherryPy runs a request on one worker
+# thread from start to finish -- and the calls it makes add spans to it. The
+# slowest SLOW_TRACES_KEPT are kept in a min-heap for /debug/slow.
+#
+# Cheap enough to leave on: a span outside a request (the scheduler, the
+# watchdog) is one thread-local read, and inside one it is two monotonic
+# reads and a list append. The span count per trace is capped so a request
+# that loops cannot grow its trace without bound.
+MAX_SPANS_PER_TRACE = 100
+# /stream holds its connection for as long as the tab is open; as "slow"
+# requests they would crowd out every real one.
+UNTRACED_ENDPOINTS = {'stream'}
+_trace_local = threading.local()
+_slow_traces = []
+_slow_seq = 0
+_slow_lock = threading.Lock()
+
+
+class _Span:
+    """Context manager recording one span on the current request's trace.
+
+    Does nothing outside a request. An exception is noted on the span and
+    then allowed to propagate.
+    """
+
+    __slots__ = ('name', 'trace', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = getattr(_trace_local, 'trace', None)
+        if self.trace is not None:
+            self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        trace = self.trace
+        if trace is None or len(trace['spans']) >= MAX_SPANS_PER_TRACE:
+            return False
+        finished = time.monotonic()
+        span = {
+            'name': self.name,
+            'start': round(self.started - trace['t0'], 4),
+            'seconds': round(finished - self.started, 4),
+        }
+        if exc_type is not None:
+            span['error'] = exc_type.__name__
+        trace['spans'].append(span)
+        return False
+
+
+def _traced(name):
+    """Decorator: run the function inside a span called `name`."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def _in_trace(trace):
+    """Add this block's spans to `trace`, a request's trace captured on its
+    worker thread. For work a request hands to a pool thread, which would
+    otherwise record into no trace at all -- see _container_pages."""
+    outer = getattr(_trace_local, 'trace', None)
+    _trace_local.trace = trace
+    try:
+        yield
+    finally:
+        _trace_local.trace = outer
+
+
+def _keep_if_slow(trace, endpoint, seconds):
+    """Offer a finished trace to the slowest-N heap."""
+    global _slow_seq
+    with _slow_lock:
+        if len(_slow_traces) >= SLOW_TRACES_KEPT and seconds <= _slow_traces[0][0]:
+            return
+        _slow_seq += 1
+        record = {
+            'endpoint': endpoint,
+            'path': cherrypy.request.path_info,
+            'status': cherrypy.response.status,
+            'at': datetime.datetime.fromtimestamp(trace['at']).isoformat(timespec='seconds'),
+            'seconds': round(seconds, 4),
+            'spans': trace['spans'],
+        }
+        # The sequence number breaks ties so two equal durations never fall
+        # through to comparing the dicts.
+        item = (seconds, _slow_seq, record)
+        if len(_slow_traces) >= SLOW_TRACES_KEPT:
+            heapq.heapreplace(_slow_traces, item)
+        else:
+            heapq.heappush(_slow_traces, item)
+
+
+def _slowest_traces():
+    with _slow_lock:
+        return [record for _, _, record in sorted(_slow_traces, reverse=True)]
+
+
+# The server runs under launchd, where no profiler can be attached, so it
+# profiles itself on request: /debug/profile samples every thread's stack
+# from sys._current_frames() and returns them collapsed -- one line per
+# distinct stack, root first, with a count -- which flamegraph.pl and
+# speedscope both read directly. /debug/threads is the single-sample version
+# for when the pool is exhausted and the question is what each worker is
+# stuck on right now.
+#
+# One profile at a time: each holds a worker for its whole duration, and
+# stacked profiles would be the exhaustion they are meant to diagnose.
+PROFILE_MAX_SECONDS = 30
+PROFILE_INTERVAL_SECONDS = 0.01
+THREAD_STACK_DEPTH = 30
+_profile_lock = threading.Lock()
+
+
+def _thread_group(name):
+    """'CP Server Thread-12' -> 'CP Server Thread', so the pool's workers
+    fold into one root in the flamegraph instead of thirty."""
+    return re.sub(r'[\s_-]*\d+$', '', name) or name
+
+
+def _sample_profile(seconds):
+    """Sample every other thread's stack for `seconds`; collapsed stacks."""
+    me = threading.get_ident()
+    counts = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            parts.append(_thread_group(names.get(ident, str(ident))))
+            counts[';'.join(reversed(parts))] += 1
+        time.sleep(PROFILE_INTERVAL_SECONDS)
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def _thread_state(stack):
+    """What a thread is doing, from its stack (outermost frame first).
+
+    'stream' is a worker held by an open /stream; 'idle' is a worker waiting
+    on cheroot's connection queue; 'busy' is a worker in any other request.
+    Threads that are not pool workers are 'background'.
+    """
+    if any(f.name == 'events' and f.filename == __file__ for f in stack):
+        return 'stream'
+    names = [f.name for f in stack]
+    if '_process_connections_until_interrupted' not in names:
+        return 'background'
+    below = names[len(names) - names[::-1].index('_process_connections_until_interrupted'):]
+    return 'idle' if below[:1] == ['get'] else 'busy'
+
+
+def _thread_report():
+    frames = sys._current_frames()
+    threads = []
+    for thread in threading.enumerate():
+        frame = frames.get(thread.ident)
+        if frame is None:
+            continue
+        stack = traceback.extract_stack(frame)
+        innermost = stack[-1]
+        threads.append({
+            'name': thread.name,
+            'daemon': thread.daemon,
+            'state': _thread_state(stack),
+            'waiting_in': f"{os.path.basename(innermost.filename)}:"
+                          f"{innermost.lineno} {innermost.name}",
+            'line': innermost.line,
+            'stack': [f"{os.path.basename(f.filename)}:{f.lineno} {f.name}"
+                      for f in stack[-THREAD_STACK_DEPTH:]],
+        })
+    return {
+        'states': dict(collections.Counter(t['state'] for t in threads)),
+        'threads': threads,
+    }
+
+
+# Every long-lived structure here is capped by count -- sessions, search
+# results per session, chat windows, content loads, stream clients -- and a
+# count says nothing about bytes: a hundred search sessions of fifty results
+# each are a hundred entries however large the results are. /debug/memory
+# answers "what is growing" two ways. It measures each named structure
+# directly, and it runs tracemalloc, which is started by the first call
+# rather than at boot because tracing every allocation costs memory and time
+# the server should not pay for months in case someone asks. Each later call
+# reports the top allocation sites and what grew since the call before it;
+# ?stop turns tracing back off.
+MEMORY_TOP_SITES = 20
+_memory_lock = threading.Lock()
+_memory_previous = None   # (taken at, tracemalloc.Snapshot) of the last call
+
+# Allocations made by the measuring itself, not by the server.
+_MEMORY_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def _approximate_size(root):
+    """Bytes held by `root` and everything it contains, counting each object
+    once. Containers are followed; any other object is counted by its own
+    size, which is close enough for the strings, numbers and dicts the named
+    structures hold."""
+    seen = set()
+    total = 0
+    pending = [root]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            pending.extend(obj)
+        elif isinstance(obj, queue.Queue):
+            with obj.mutex:
+                pending.append(list(obj.queue))
+    return total
+
+
+def _structure_sizes():
+    """Entries and approximate bytes of each capped structure, each measured
+    under its own lock so it is not resized mid-walk."""
+    def measure(obj):
+        return {'entries': len(obj), 'bytes': _approximate_size(obj)}
+
+    sizes = {}
+    # Only ever added to or cleared whole, from request threads; a copy is
+    # one C-level call the GIL is not released during.
+    sizes['sessions'] = measure(list(_sessions))
+    with _results_lock:
+        sizes['search_results'] = measure(search_results)
+    with _chat_lock:
+        sizes['chat_calls'] = measure(_chat_calls)
+    with _content_lock:
+        sizes['content_loads'] = measure(_content_loads)
+    with _stream_lock:
+        sizes['stream_clients'] = measure(_stream_clients)
+        sizes['stream_clients']['queued_events'] = sum(c.qsize() for c in _stream_clients)
+    with _slow_lock:
+        sizes['slow_traces'] = measure(_slow_traces)
+    with _timings_lock:
+        sizes['step_history'] = measure(_step_history)
+    with _history_lock:
+        # Fixed at a week by construction; here so the total adds up.
+        sizes['metrics_history'] = {
+            'entries': _metric_history.capacity,
+            'bytes': _approximate_size(_metric_history.series),
+        }
+    with _metrics_lock:
+        sizes['claude_sessions'] = measure(_claude_sessions)
+        sizes['claude_hours'] = measure(_claude_hours)
+    for name, cache in (('spotify_cache', _spotify_cache), ('search_cache', _search_cache)):
+        with cache._lock:
+            sizes[name] = measure(cache._entries)
+    with _suggest_lock:
+        sizes['suggest_cache'] = {'entries': len(_suggest_cache),
+                                  'bytes': _approximate_size(_suggest_cache._root)}
+        sizes['suggest_sessions'] = measure(_suggest_latest)
+    with _art_lock:
+        # Image bytes, so the biggest per entry by far.
+        sizes['art_cache'] = measure(_art_cache)
+    with _containers_lock:
+        sizes['container_cache'] = measure(_container_cache)
+        sizes['container_cache']['tracks'] = sum(
+            len(e['rows']) for e in _container_cache.values())
+    return sizes
+
+
+def _memory_sites(stats, limit):
+    return [{
+        'site': f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+        'bytes': stat.size,
+        'count': stat.count,
+        **({'bytes_diff': stat.size_diff, 'count_diff': stat.count_diff}
+           if isinstance(stat, tracemalloc.StatisticDiff) else {}),
+    } for stat in stats[:limit]]
+
+
+def _memory_report(top, stop=False):
+    """One /debug/memory call. The caller holds _memory_lock."""
+    global _memory_previous
+    report = {'structures': _structure_sizes()}
+    if stop:
+        tracemalloc.stop()
+        _memory_previous = None
+        report['tracing'] = False
+        return report
+
+    # The call that starts tracing has no growth to report: its snapshot
+    # holds next to nothing, and is only what the next call measures from.
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    now = _clock.monotonic()
+    snapshot = tracemalloc.take_snapshot().filter_traces(_MEMORY_IGNORED)
+    current, peak = tracemalloc.get_traced_memory()
+    report.update({
+        'tracing': True,
+        'started': started,
+        'traced_bytes': current,
+        'traced_peak_bytes': peak,
+        'top': _memory_sites(snapshot.statistics('lineno'), top),
+    })
+    if _memory_previous is not None and not started:
+        taken, previous = _memory_previous
+        report['growth_since_seconds'] = round(now - taken, 1)
+        report['growth'] = _memory_sites(
+            [d for d in snapshot.compare_to(previous, 'lineno') if d.size_diff], top)
+    _memory_previous = (now, snapshot)
+    return report
+
+
+cherrypy.tools.djtiming = cherrypy.Tool('on_start_resource', _start_request_timer)
+
+
+# server_thread_pool was sized by guesswork against max_stream_clients, and
+# nothing said how close the pool ran to exhaustion. cheroot's ThreadPool
+# already knows how many workers are idle and how many connections wait in
+# its queue; what it does not record is how long a connection waited there
+# for a worker, which is the number that rises first as the pool runs out.
+# _instrument_thread_pool stamps each connection as it is queued, and the
+# request's first hook reads the stamp on the worker that picked it up.
+#
+# The wait is measured from the queue, not from accept(): between accept and
+# the queue a connection sits in cheroot's selector until the client sends a
+# request, which is the client's time, not a shortage of workers.
+_pool_wait = _Histogram(LATENCY_BUCKETS_SECONDS)
+
+
+def _thread_pool():
+    """cheroot's ThreadPool, or None before the server has started."""
+    return getattr(getattr(cherrypy.server, 'httpserver', None), 'requests', None)
+
+
+def _instrument_thread_pool():
+    """Engine 'start' listener: wrap the pool's put to stamp each connection.
+
+    Subscribed after CherryPy's own server adapter, which is what creates the
+    pool.
+    """
+    pool = _thread_pool()
+    if pool is None or getattr(pool, 'dj_instrumented', False):
+        return
+    put = pool.put
+
+    def timed_put(conn):
+        conn.dj_queued = time.monotonic()
+        try:
+            put(conn)
+        except queue.Full:
+            # cheroot answers these with a 503 from a side thread; every one
+            # is a request the pool had no room for.
+            _record_metric('pool_rejected')
+            raise
+
+    pool.put = timed_put
+    pool.dj_instrumented = True
+
+
+def _record_pool_pickup(now):
+    """How long this request's connection waited for the current worker, and
+    how many workers were busy when it got one."""
+    conn = getattr(threading.current_thread(), 'conn', None)
+    queued = getattr(conn, 'dj_queued', None)
+    pool = _thread_pool()
+    busy = pool and len(pool._threads) - pool.idle
+    with _metrics_lock:
+        if queued is not None:
+            # Once per queueing. cheroot hands a worker one request at a
+            # time: a keep-alive connection goes back through put() after
+            # each response, is stamped afresh, and every request on it is
+            # measured from its own queueing. What clearing the stamp guards
+            # against is this hook running twice for one pickup -- an
+            # InternalRedirect starts a second request on the same worker
+            # without the connection being queued again.
+            conn.dj_queued = None
+            _pool_wait.observe(max(now - queued, 0.0))
+        if busy:
+            _metrics['pool_busy_peak'] = max(_metrics['pool_busy_peak'], busy)
+
+
+def _pool_snapshot():
+    """Worker counts right now. Workers held by /stream count as busy and
+    are reported again on their own, since they are the ones that pile up."""
+    pool = _thread_pool()
+    with _stream_lock:
+        streams = len(_stream_clients)
+    if pool is None:
+        return {'pool_workers': 0, 'pool_idle': 0, 'pool_busy': 0,
+                'pool_streams': streams, 'pool_queued': 0}
+    workers = len(pool._threads)
+    idle = pool.idle
+    return {
+        'pool_workers': workers,
+        'pool_idle': idle,
+        'pool_busy': workers - idle,
+        'pool_streams': streams,
+        'pool_queued': pool.qsize,
+    }
+
+
 # ==================== INPUT VALIDATION ====================
 
 # A Spotify URI is three colon-separated parts, e.g. spotify:track:4uLU6hMCjM.
@@ -1209,6 +3567,33 @@ def _json_error_page(status, message, traceback, version):
     return json.dumps({"error": message or status})
 
 
+def _json_handler(*args, **kwargs):
+    """json_out handler for every endpoint: CherryPy's, with the encoding
+    timed as its own span. A reply of a few thousand search results is not
+    free to serialise, and without this that time belongs to nothing."""
+    value = cherrypy.serving.request._json_inner_handler(*args, **kwargs)
+    with _Span('json'):
+        return json.dumps(value).encode()
+
+
+def _json_or_text_handler(*args, **kwargs):
+    """json_out handler that lets a page handler answer in plain text.
+
+    A handler returning a str is sent as-is, as text/plain unless it chose a
+    text type of its own; anything else is JSON as usual. Lets /metrics serve
+    its Prometheus exposition, and /debug a profile, from the same handler as
+    their JSON instead of from a second endpoint.
+    """
+    value = cherrypy.serving.request._json_inner_handler(*args, **kwargs)
+    if isinstance(value, str):
+        headers = cherrypy.serving.response.headers
+        if not headers.get('Content-Type', '').startswith('text/'):
+            headers['Content-Type'] = 'text/plain'
+        return value.encode()
+    with _Span('json'):
+        return json.dumps(value).encode()
+
+
 def _bad_request(message):
     """Abort the request with a 400 that _json_error_page renders as JSON."""
     raise cherrypy.HTTPError(400, message)
@@ -1333,7 +3718,16 @@ def _handles_spotify_errors(fn):
             detail = getattr(exc, 'msg', None) or str(exc)
             log.warning("Spotify error in %s: HTTP %s %s", fn.__name__, status, detail)
             if status == 429:
-                # Surfaced as-is so clients can back off rather than retry.
+                # Surfaced as-is so clients can back off rather than retry,
+                # with Spotify's or the governor's Retry-After when there is one.
+                wait = _retry_after_seconds((getattr(exc, 'headers', None) or {}).get('Retry-After'))
+                if wait is not None:
+                    # Rounded up, and never 0: the governor's remaining block
+                    # is often a fraction of a second, and a client told 0
+                    # comes straight back into the same refusal.
+                    wait = max(math.ceil(wait), 1)
+                    _too_many_requests(
+                        f"Spotify rate limit reached -- try again in {wait}s", wait)
                 raise cherrypy.HTTPError(429, "Spotify rate limit reached -- try again shortly")
             if status == 404:
                 raise cherrypy.HTTPError(404, f"Spotify found nothing for that request: {detail}")
@@ -1358,6 +3752,362 @@ def _handles_spotify_errors(fn):
     wrapper.__signature__ = inspect.signature(fn)
     return wrapper
 
+
+# ==================== SPOTIFY METADATA CACHE ====================
+#
+# Expanding an album, listing the current album and "more by this artist" all
+# fetch metadata that does not change from one click to the next, and each
+# fetch spends the same rate limit search needs. _spotify_cache keeps those
+# responses: fresh ones are served outright, expired ones are served at once
+# while a background thread refetches them, and a burst of misses for one
+# key -- three tabs expanding the album that just started -- makes one call
+# that the rest wait on.
+#
+# Search goes through a second instance, _search_cache, keyed by the
+# normalised query, type and limit. Only the raw response is shared; each
+# session still gets its own numbered results from set_results.
+#
+# Cached responses are shared between callers, so they are read-only: a
+# handler that wants to change one copies it first.
+
+SPOTIFY_CACHE_TTL_SECONDS = {**DEFAULTS['spotify_cache_ttl_seconds'],
+                             **_setting('spotify_cache_ttl_seconds')}
+SPOTIFY_CACHE_ENTRIES = _setting('spotify_cache_entries')
+SPOTIFY_CACHE_MAX_STALE_SECONDS = _setting('spotify_cache_max_stale_seconds')
+SEARCH_CACHE_TTL_SECONDS = _setting('search_cache_ttl_seconds')
+SEARCH_CACHE_EMPTY_TTL_SECONDS = _setting('search_cache_empty_ttl_seconds')
+SEARCH_CACHE_ENTRIES = _setting('search_cache_entries')
+_cache_refresh_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=2, thread_name_prefix='dj_cache')
+
+
+def _cache_arg(value):
+    """One spelling per Spotify id, so 'abc', 'spotify:album:abc' and the
+    open.spotify.com link share an entry."""
+    if isinstance(value, str):
+        if value.startswith('spotify:'):
+            return value.rsplit(':', 1)[-1]
+        if 'open.spotify.com/' in value:
+            return urllib.parse.urlsplit(value).path.rstrip('/').rsplit('/', 1)[-1]
+    return value
+
+
+def _search_arg(value):
+    """Search text as Spotify matches it: case and runs of spaces do not
+    change the results, so they do not get an entry of their own."""
+    if isinstance(value, str):
+        return ' '.join(value.casefold().split())
+    return value
+
+
+def _is_empty_response(value):
+    """True for a search response whose every section came back without
+    items -- the playlist section can hold only nulls, which is empty too."""
+    sections = [v for v in value.values() if isinstance(v, dict) and 'items' in v] \
+        if isinstance(value, dict) else []
+    return bool(sections) and not any(item for section in sections
+                                      for item in section['items'] or [])
+
+
+class _MetadataCache:
+    """TTL and LRU cache in front of read-only sp.* methods.
+
+    Keyed by method name and arguments, each passed through `normalise`.
+    Only methods with a TTL in `ttls` are cached; asking for any other is a
+    programming error. A method in `empty_ttls` keeps a response with no
+    items for that TTL instead. An expired entry is served stale for up to
+    its TTL again, capped at SPOTIFY_CACHE_MAX_STALE_SECONDS; past that it
+    is dropped and fetched inline like a miss.
+    """
+
+    def __init__(self, ttls, max_entries, executor, empty_ttls=None,
+                 normalise=_cache_arg, name='spotify_cache'):
+        self.ttls = dict(ttls)
+        self.empty_ttls = dict(empty_ttls or {})
+        self.max_entries = max_entries
+        self.executor = executor
+        self.normalise = normalise
+        self._entries = collections.OrderedDict()   # key -> (expires at, value, stale until)
+        self._inflight = {}                         # key -> Future, first misses
+        self._refreshing = set()
+        self._lock = _named_lock(name)
+        self.stats = dict.fromkeys(('hits', 'stale_hits', 'empty_hits', 'misses', 'joined',
+                                    'refreshes', 'refresh_failures', 'evictions',
+                                    'too_stale'), 0)
+
+    def get(self, method, *args, **kwargs):
+        if method not in self.ttls:
+            raise KeyError(method)
+        key = (method, tuple(self.normalise(a) for a in args),
+               tuple(sorted((k, self.normalise(v)) for k, v in kwargs.items())))
+        now = _clock.monotonic()
+        refresh = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now >= entry[2]:
+                # Its refreshes have been failing for as long as a stale
+                # answer may be served.
+                del self._entries[key]
+                self.stats['too_stale'] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                expires, value, _ = entry
+                if now < expires:
+                    self.stats['hits'] += 1
+                    if method in self.empty_ttls and _is_empty_response(value):
+                        self.stats['empty_hits'] += 1
+                    return value
+                self.stats['stale_hits'] += 1
+                refresh = key not in self._refreshing
+                self._refreshing.add(key)
+            else:
+                future = self._inflight.get(key)
+                leader = future is None
+                if leader:
+                    future = self._inflight[key] = concurrent.futures.Future()
+                    self.stats['misses'] += 1
+                else:
+                    self.stats['joined'] += 1
+
+        if entry is not None:
+            # Submitted outside the lock, which the refresh takes to store.
+            if refresh:
+                try:
+                    self.executor.submit(self._refresh, key, method, args, kwargs)
+                except RuntimeError:
+                    # The pool is shut down at engine stop. Left in
+                    # _refreshing, the key would never be refreshed again.
+                    with self._lock:
+                        self._refreshing.discard(key)
+            return value
+        if not leader:
+            return future.result()
+        try:
+            value = getattr(sp, method)(*args, **kwargs)
+        except BaseException as exc:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(exc)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            self._store_locked(key, value)
+        future.set_result(value)
+        return value
+
+    def _refresh(self, key, method, args, kwargs):
+        """Executor thread: refetch one expired entry. The stale value stays
+        in place if this fails -- except on a 404, which means it is gone."""
+        try:
+            with _spotify_priority('background'):
+                value = getattr(sp, method)(*args, **kwargs)
+        except Exception as exc:
+            gone = getattr(exc, 'http_status', None) == 404
+            log.warning("Spotify cache refresh of %s failed: %s", method, type(exc).__name__)
+            with self._lock:
+                self._refreshing.discard(key)
+                self.stats['refresh_failures'] += 1
+                if gone:
+                    self._entries.pop(key, None)
+            return
+        with self._lock:
+            self._refreshing.discard(key)
+            self.stats['refreshes'] += 1
+            self._store_locked(key, value)
+
+    def _store_locked(self, key, value):
+        method = key[0]
+        ttl = self.ttls[method]
+        if method in self.empty_ttls and _is_empty_response(value):
+            ttl = self.empty_ttls[method]
+        expires = _clock.monotonic() + ttl
+        self._entries[key] = (expires, value, expires + min(ttl, SPOTIFY_CACHE_MAX_STALE_SECONDS))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def snapshot(self):
+        """Counters for /metrics, with the hit ratio: lookups answered from
+        the cache, stale or not, over all lookups."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses'] + stats['joined']
+        stats['hit_ratio'] = round((stats['hits'] + stats['stale_hits']) / lookups, 3) \
+            if lookups else 0.0
+        stats['max_entries'] = self.max_entries
+        return stats
+
+
+_spotify_cache = _MetadataCache(SPOTIFY_CACHE_TTL_SECONDS, SPOTIFY_CACHE_ENTRIES,
+                                _cache_refresh_executor)
+
+# Track-change prefetch, see DJServer._prefetch. One worker: a burst of
+# skips queues its prefetches rather than running them all at once.
+PREFETCH_ON_TRACK_CHANGE = _setting('prefetch_on_track_change')
+_prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix='dj_prefetch')
+_prefetch_lock = _named_lock('prefetch')
+_prefetched_uri = None
+# The job for _prefetched_uri, while it may still be waiting for the worker.
+# A run of skips claims a new track before the last one's job has started;
+# that job is cancelled rather than left to spend its Spotify calls on a
+# track nobody is listening to.
+_prefetch_pending = None
+_search_cache = _MetadataCache({'search': SEARCH_CACHE_TTL_SECONDS}, SEARCH_CACHE_ENTRIES,
+                               _cache_refresh_executor,
+                               empty_ttls={'search': SEARCH_CACHE_EMPTY_TTL_SECONDS},
+                               normalise=_search_arg, name='search_cache')
+
+# Album and playlist listings, see _container_listing. The first page gives
+# the total, and the other pages are then requested CONTAINER_PAGE_WINDOW at
+# a time on _page_executor, topped up as each is consumed, so one
+# 10,000-track playlist does not queue a hundred fetches ahead of another
+# guest's album. The governor still paces them; this buys overlap of round
+# trips rather than extra quota. A playlist is cached against its
+# snapshot_id, which Spotify changes on every edit, so an entry is right for
+# exactly as long as it is served. Albums do not change and are kept for the
+# album TTL.
+CONTAINER_PAGE_SIZE = {'album': 50, 'playlist': 100}
+CONTAINER_PAGE_WINDOW = 4
+CONTAINER_CACHE_TRACKS = _setting('container_cache_tracks')
+CONTAINER_COMPACT_FIELDS = ('name', 'artist', 'uri', 'duration_ms')
+PLAYLIST_ITEM_FIELDS = 'items(track(uri,name,duration_ms,artists(name)))'
+_page_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix='dj_pages')
+_containers_lock = _named_lock('containers')
+_container_cache = collections.OrderedDict()   # (kind, id) -> entry dict
+
+
+def _container_rows(kind, items):
+    """Rows for one page. A playlist page wraps each track, and holds null
+    for one since removed from Spotify; an album page is the tracks."""
+    if kind == 'playlist':
+        items = [item.get('track') for item in items if item]
+    return [{
+        "name": t['name'],
+        "artist": t['artists'][0]['name'] if t.get('artists') else '',
+        "uri": t['uri'],
+        "duration_ms": t.get('duration_ms'),
+    } for t in items if t and t.get('uri')]
+
+
+def _container_head(kind, container_id, album=None):
+    """(head, first rows, next offset). An album's first page comes with the
+    album, which _spotify_cache usually holds already -- or the caller, as
+    `album`; a playlist's head is asked for without items, so a cache hit
+    costs one small call.
+
+    Fetched before _container_cache is consulted, because a playlist's head
+    carries the snapshot_id the cached rows are checked against. An album
+    needs no such check, but taking the same path means even an album
+    served from _container_cache costs a _spotify_cache lookup -- usually a
+    hit, and cheap next to the listing.
+    """
+    if kind == 'album':
+        album = album or _spotify_cache.get('album', container_id)
+        items = album['tracks']['items']
+        head = {"name": album['name'], "snapshot_id": None,
+                "total": album['tracks'].get('total', len(items))}
+        return head, _container_rows(kind, items), len(items)
+    playlist = sp.playlist(container_id, fields='name,snapshot_id,tracks(total)')
+    head = {"name": playlist['name'], "snapshot_id": playlist['snapshot_id'],
+            "total": playlist['tracks']['total']}
+    return head, [], 0
+
+
+def _container_page(kind, container_id, offset):
+    if kind == 'album':
+        page = sp.album_tracks(container_id, limit=CONTAINER_PAGE_SIZE[kind], offset=offset)
+    else:
+        page = sp.playlist_items(container_id, limit=CONTAINER_PAGE_SIZE[kind], offset=offset,
+                                 fields=PLAYLIST_ITEM_FIELDS, additional_types=('track',))
+    return _container_rows(kind, page['items'])
+
+
+def _container_pages(kind, container_id, start, total):
+    """Generator: the pages from `start` to `total`, in order, with up to
+    CONTAINER_PAGE_WINDOW of them in flight. The caller's priority and trace
+    go with them to the pool's threads, so every page's call is a span on
+    the request in /debug/slow, not only the head's. Closing it early -- a
+    client that hung up -- cancels what has not begun."""
+    priority = getattr(_spotify_local, 'priority', 'interactive')
+    trace = getattr(_trace_local, 'trace', None)
+
+    def fetch(offset):
+        with _spotify_priority(priority), _in_trace(trace):
+            return _container_page(kind, container_id, offset)
+    offsets = iter(range(start, total, CONTAINER_PAGE_SIZE[kind]))
+    window = collections.deque(
+        _page_executor.submit(fetch, offset)
+        for offset in itertools.islice(offsets, CONTAINER_PAGE_WINDOW))
+    try:
+        while window:
+            page = window.popleft().result()
+            for offset in itertools.islice(offsets, 1):
+                window.append(_page_executor.submit(fetch, offset))
+            yield page
+    finally:
+        for future in window:
+            future.cancel()
+
+
+def _cached_container(kind, container_id, head):
+    """The cached rows if they are still this version of the container."""
+    with _containers_lock:
+        entry = _container_cache.get((kind, container_id))
+        if entry is None:
+            return None
+        if kind == 'playlist':
+            current = entry['snapshot_id'] == head['snapshot_id']
+        else:
+            current = _clock.monotonic() < entry['expires']
+        if not current:
+            del _container_cache[(kind, container_id)]
+            return None
+        _container_cache.move_to_end((kind, container_id))
+        return entry['rows']
+
+
+def _store_container(kind, container_id, head, rows):
+    with _containers_lock:
+        _container_cache[(kind, container_id)] = {
+            "snapshot_id": head['snapshot_id'], "rows": rows,
+            "expires": _clock.monotonic() + SPOTIFY_CACHE_TTL_SECONDS['album']}
+        _container_cache.move_to_end((kind, container_id))
+        # The newest entry stays even when it alone is over the bound.
+        while len(_container_cache) > 1 and \
+                sum(len(e['rows']) for e in _container_cache.values()) > CONTAINER_CACHE_TRACKS:
+            _container_cache.popitem(last=False)
+
+
+def _container_listing(kind, container_id, album=None):
+    """(head, pages, cached) for an album or playlist.
+
+    `pages` yields lists of rows in order; the whole listing is cached once
+    the last one has arrived, so a stream abandoned part-way stores nothing.
+    Cached rows are shared, so they are read-only.
+    """
+    head, first, start = _container_head(kind, container_id, album)
+    rows = _cached_container(kind, container_id, head)
+    if rows is not None:
+        _record_metric('container_cache_hits')
+        return head, (page for page in [rows]), True
+    _record_metric('container_cache_misses')
+
+    def pages():
+        rows = list(first)
+        if first:
+            yield first
+        for page in _container_pages(kind, container_id, start, head['total']):
+            rows.extend(page)
+            yield page
+        _store_container(kind, container_id, head, rows)
+    return head, pages(), False
+
+
 def get_results(session_id='global'):
     """Get search results for a session, or [] if absent or expired."""
     with _results_lock:
@@ -1366,7 +4116,7 @@ def get_results(session_id='global'):
             return []
 
         stored_at, results = entry
-        if time.monotonic() - stored_at > SEARCH_RESULT_TTL:
+        if _clock.monotonic() - stored_at > SEARCH_RESULT_TTL:
             del search_results[session_id]
             return []
         return results
@@ -1379,10 +4129,134 @@ def set_results(results, session_id='global'):
     then adds one more, so the dict settles at MAX_SEARCH_SESSIONS + 1.
     """
     with _results_lock:
-        search_results[session_id] = (time.monotonic(), results)
+        search_results[session_id] = (_clock.monotonic(), results)
         _expire_search_results_locked()
 
 
+# ==================== SUGGEST ====================
+#
+# Search-as-you-type sends a query per keystroke, and each used to be a full
+# /search holding a worker until Spotify answered. /suggest takes a sequence
+# number from the client with every query. A query older than the newest its
+# session has sent is answered at once as superseded: on arrival, after the
+# debounce, and again when Spotify answers, so a slow reply for "beat" never
+# lands on top of "beatles". Answers go into a trie keyed by the normalised
+# query. An exact match is served as it is, and a query that extends one
+# already answered is served by narrowing that answer, as long as enough of
+# it still matches to fill the list.
+
+SUGGEST_DEBOUNCE_SECONDS = _setting('suggest_debounce_seconds')
+SUGGEST_CACHE_ENTRIES = _setting('suggest_cache_entries')
+SUGGEST_SESSION_IDLE_SECONDS = _setting('suggest_session_idle_seconds')
+SUGGEST_LIMIT = 8
+SUGGEST_MIN_CHARS = 2
+
+
+def _suggestion_matches(row, query):
+    """Every word of the query starts a word of the title or artist -- the
+    last one may be half typed."""
+    words = _search_arg(f"{row['name']} {row['artist']}").split()
+    return all(any(w.startswith(part) for w in words) for part in query.split())
+
+
+class _PrefixCache:
+    """Recent suggestion lists in a character trie, LRU-bounded.
+
+    Each node is a dict of child nodes by character; a node that ends a
+    stored query also holds (stored at, rows) under the key None. An empty
+    list is kept for `empty_ttl`, like an empty search in _search_cache.
+    Callers hold _suggest_lock.
+    """
+
+    def __init__(self, max_entries, ttl, empty_ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.empty_ttl = ttl if empty_ttl is None else empty_ttl
+        self._root = {}
+        self._order = collections.OrderedDict()     # query -> None, oldest first
+
+    def lookup(self, query, limit):
+        """(rows, 'cache') for a stored query, (rows, 'prefix') narrowed from
+        the longest stored prefix that still fills `limit`, or (None, None)."""
+        now = _clock.monotonic()
+        node, prefixes = self._root, []
+        for depth, char in enumerate(query, 1):
+            node = node.get(char)
+            if node is None:
+                break
+            entry = node.get(None)
+            if entry is not None and now - entry[0] < (self.ttl if entry[1] else self.empty_ttl):
+                prefixes.append((query[:depth], entry[1]))
+        if prefixes and prefixes[-1][0] == query:
+            self._order.move_to_end(query)
+            return prefixes[-1][1][:limit], 'cache'
+        for prefix, rows in reversed(prefixes):
+            narrowed = [row for row in rows if _suggestion_matches(row, query)]
+            if len(narrowed) >= limit:
+                self._order.move_to_end(prefix)
+                return narrowed[:limit], 'prefix'
+        return None, None
+
+    def store(self, query, rows):
+        node = self._root
+        for char in query:
+            node = node.setdefault(char, {})
+        node[None] = (_clock.monotonic(), rows)
+        self._order[query] = None
+        self._order.move_to_end(query)
+        while len(self._order) > self.max_entries:
+            self._remove(self._order.popitem(last=False)[0])
+
+    def _remove(self, query):
+        """Drop a query's entry and any nodes left leading nowhere."""
+        path, node = [], self._root
+        for char in query:
+            path.append((node, char))
+            node = node[char]
+        node.pop(None, None)
+        for parent, char in reversed(path):
+            if parent[char]:
+                break
+            del parent[char]
+
+    def __len__(self):
+        return len(self._order)
+
+
+_suggest_lock = _named_lock('suggest')
+_suggest_latest = {}    # session_id -> (newest seq, monotonic it arrived)
+_suggest_cache = _PrefixCache(SUGGEST_CACHE_ENTRIES, SEARCH_CACHE_TTL_SECONDS,
+                              SEARCH_CACHE_EMPTY_TTL_SECONDS)
+
+
+def _suggest_is_current(session_id, seq):
+    with _suggest_lock:
+        return _suggest_latest.get(session_id, (seq,))[0] == seq
+
+
+def _claim_suggest_seq(session_id, seq):
+    """Record seq as the session's newest, or return False if a newer one
+    has already arrived. Bounded like search_results.
+
+    The client's counter is only trusted while it is in use: once the
+    session has been idle for SUGGEST_SESSION_IDLE_SECONDS, a lower seq is
+    a counter that started again, not a stale query. A superseded query does
+    not count as activity, so a restarted counter is never locked out for
+    longer than that.
+    """
+    now = _clock.monotonic()
+    with _suggest_lock:
+        latest = _suggest_latest.get(session_id)
+        if latest is not None and latest[0] >= seq \
+                and now - latest[1] < SUGGEST_SESSION_IDLE_SECONDS:
+            return False
+        _suggest_latest[session_id] = (seq, now)
+        while len(_suggest_latest) > MAX_SEARCH_SESSIONS:
+            del _suggest_latest[min(_suggest_latest, key=lambda s: _suggest_latest[s][1])]
+        return True
+
+
+@_traced('claude')
 def call_claude(message, session_id='global'):
     """Send message to Claude and get DJ command"""
     if not ANTHROPIC_API_KEY:
@@ -1436,6 +4310,8 @@ User: "thanks!"
 {{"action": "chat", "message": "You're welcome! Enjoy the music! 🎉"}}
 """
 
+    started = time.monotonic()
+    response = None
     try:
         response = claude.messages.create(
             model=CLAUDE_MODEL,
@@ -1453,31 +4329,54 @@ User: "thanks!"
         )
     except anthropic.RateLimitError:
         # The SDK already retried with backoff; this is the give-up path.
-        return {"action": "chat", "message": "Too many requests right now -- try again in a moment!"}
+        command = {"action": "chat", "message": "Too many requests right now -- try again in a moment!"}
+        outcome = 'rate_limited'
     except anthropic.APIStatusError as exc:
         log.error("Claude API error %s: %s", exc.status_code, exc.message)
-        return {"action": "chat", "message": "Sorry, I had trouble understanding that. Try again!"}
+        command = {"action": "chat", "message": "Sorry, I had trouble understanding that. Try again!"}
+        outcome = 'api_error'
     except anthropic.APIConnectionError as exc:
         log.error("Claude unreachable: %s", exc)
-        return {"action": "chat", "message": "I can't reach my brain right now. Use the buttons instead!"}
+        command = {"action": "chat", "message": "I can't reach my brain right now. Use the buttons instead!"}
+        outcome = 'unreachable'
+    else:
+        command, outcome = _read_claude_reply(response)
+
+    _record_claude_call(session_id, time.monotonic() - started, response, outcome)
+    return command
+
+
+# What call_claude records instead of an action when no command came back.
+CLAUDE_FAILURES = {'rate_limited', 'api_error', 'unreachable', 'refusal', 'empty', 'unparseable'}
+
 
+def _read_claude_reply(response):
+    """(command, outcome) from a Claude response. The outcome is the command's
+    action, or which of CLAUDE_FAILURES stood in for one."""
     if response.stop_reason == "refusal":
-        return {"action": "chat", "message": "I'd rather not answer that one!"}
+        return {"action": "chat", "message": "I'd rather not answer that one!"}, 'refusal'
 
     text = next((b.text for b in response.content if b.type == "text"), None)
     if not text:
         # max_tokens truncation is the realistic cause of an empty response.
         log.warning("Claude returned no text (stop_reason=%s)", response.stop_reason)
-        return {"action": "chat", "message": "Sorry, I had trouble understanding that. Try again!"}
+        return {"action": "chat", "message": "Sorry, I had trouble understanding that. Try again!"}, 'empty'
 
     try:
-        return json.loads(text)
+        command = json.loads(text)
     except ValueError:
         # output_config pins a json_schema, so this should not happen -- but it
         # is the one parse in this function that could still 500 the request,
         # and every other failure above degrades to a spoken reply instead.
         log.error("Claude returned unparseable JSON (stop_reason=%s)", response.stop_reason)
-        return {"action": "chat", "message": "Sorry, I had trouble understanding that. Try again!"}
+        return {"action": "chat", "message": "Sorry, I had trouble understanding that. Try again!"}, 'unparseable'
+
+    # The schema pins the action to its enum; anything else is counted as
+    # 'other' so a misbehaving reply cannot mint new keys in /metrics.
+    action = command.get('action') if isinstance(command, dict) else None
+    if action not in DJ_COMMAND_SCHEMA['properties']['action']['enum']:
+        action = 'other'
+    return command, action
 
 
 class DJServer:
@@ -1486,6 +4385,8 @@ class DJServer:
     # Error pages render as JSON so clients never have to parse HTML.
     _cp_config = {
         'tools.djauth.on': True,
+        'tools.djtiming.on': True,
+        'tools.json_out.handler': _json_handler,
         'error_page.400': _json_error_page,
         'error_page.401': _json_error_page,
         'error_page.404': _json_error_page,
@@ -1697,8 +4598,76 @@ class DJServer:
         payload['event'] = kind
         delivered = _broadcast(payload)
         _record_metric('events_received')
+        self._prefetch_on_change(payload.get('uri'), payload.get('next') or {})
         return {"status": "broadcast", "type": kind, "clients": delivered}
 
+    def _prefetch_on_change(self, uri, upcoming):
+        """Queue a prefetch for `uri` if it is not the track last prefetched.
+        Most events are a volume nudge or a pause, not a new track."""
+        global _prefetched_uri, _prefetch_pending
+        if not PREFETCH_ON_TRACK_CHANGE or not uri:
+            return
+        with _prefetch_lock:
+            if uri == _prefetched_uri:
+                return
+            # Claimed now so a burst of events for one track queues one
+            # prefetch; _prefetch gives it back if it fails.
+            _prefetched_uri = uri
+            stale, _prefetch_pending = _prefetch_pending, None
+        if stale is not None:
+            stale.cancel()
+        try:
+            future = _prefetch_executor.submit(self._prefetch, uri, upcoming)
+        except RuntimeError:
+            # The executor refuses work once the engine is shutting down. The
+            # broadcast has gone out, and a best-effort prefetch must not turn
+            # the webhook into a 500.
+            log.warning("Prefetch for a track change not queued: shutting down")
+            with _prefetch_lock:
+                if _prefetched_uri == uri:
+                    _prefetched_uri = None
+            return
+        with _prefetch_lock:
+            if _prefetched_uri == uri:
+                _prefetch_pending = future
+
+    def _prefetch(self, uri, upcoming):
+        """Executor thread: warm the caches for what follows a track change.
+
+        The album and the artist's top tracks are what "album" and "more by
+        this artist" fetch on the next tap; the next track's metadata and
+        artwork are what the player shows when it starts. Every Spotify call
+        goes through the governor as background, behind anyone waiting at
+        the page. `upcoming` is the `next` of the payload the webhook has
+        just built, so the speaker is not asked for its state a second time.
+        Nothing here raises: a failed prefetch only means the tap fetches for
+        itself, as it always did, and the next event for the track tries
+        again.
+        """
+        global _prefetched_uri
+        try:
+            with _spotify_priority('background'):
+                track_id = self._parse_track_id(uri)
+                if track_id:
+                    track = _spotify_cache.get('track', track_id)
+                    _spotify_cache.get('album', track['album']['id'])
+                    _spotify_cache.get('artist_top_tracks', track['artists'][0]['id'])
+
+                next_id = self._parse_track_id(upcoming.get('uri', ''))
+                if next_id:
+                    _spotify_cache.get('track', next_id)
+                art = upcoming.get('artwork', '')
+                if art.startswith('/albumart'):
+                    _album_art(art.partition('?')[2])
+        except Exception as exc:
+            log.warning("Prefetch for a track change failed: %s", type(exc).__name__)
+            _record_metric('prefetch_failures')
+            with _prefetch_lock:
+                if _prefetched_uri == uri:
+                    _prefetched_uri = None
+            return
+        _record_metric('prefetches')
+
     @cherrypy.expose
     def stream(self):
         """Server-sent events for the browser: told, rather than asking.
@@ -1758,33 +4727,17 @@ class DJServer:
         URL is rebuilt from the origin last seen in a Sonos artwork field, so
         the worst a caller can do is ask the speaker for a different image.
         """
-        with _art_lock:
-            origin = _art_origin
-        if not origin:
-            raise cherrypy.HTTPError(404, "no artwork source known yet")
-
-        url = f"{origin}/getaa"
-        if cherrypy.request.query_string:
-            url += f"?{cherrypy.request.query_string}"
-
-        try:
-            response = requests.get(url, timeout=SONOS_TIMEOUT)
-        except requests.exceptions.RequestException as exc:
-            raise cherrypy.HTTPError(502, f"could not fetch artwork: {exc.__class__.__name__}")
-        if response.status_code != 200:
-            raise cherrypy.HTTPError(502, f"artwork returned HTTP {response.status_code}")
-
-        cherrypy.response.headers['Content-Type'] = \
-            response.headers.get('Content-Type', 'image/jpeg')
+        content_type, content = _album_art(cherrypy.request.query_string)
+        cherrypy.response.headers['Content-Type'] = content_type
         # The URL carries the track, so it changes when the track does. A year
         # is safe and means the browser asks once per track rather than on
         # every push -- and pushes now arrive on every volume nudge.
         cherrypy.response.headers['Cache-Control'] = 'private, max-age=31536000'
-        return response.content
+        return content
 
     @cherrypy.expose
-    @cherrypy.tools.json_out()
-    def metrics(self):
+    @cherrypy.tools.json_out(handler=_json_or_text_handler)
+    def metrics(self, view=None, format=None, minutes=None, step=None):
         """Counters since process start.
 
         Separate from /health on purpose: /health is polled by the watchdog and
@@ -1795,9 +4748,51 @@ class DJServer:
         Averages are computed here rather than stored so the stored numbers
         stay addable; transport and content are kept apart because one 46s
         playlist would otherwise swallow the transport average whole.
+
+        Spotify is counted per client method, which is what ties a 429 to
+        the UI flow that spent the rate limit.
+
+        ?format=prometheus renders the same counters and histograms in the
+        Prometheus text exposition format, for a scraper.
+
+        /metrics/history is the same few numbers per minute over the last
+        week, for sparklines: the last ?minutes (a day by default) in buckets
+        of ?step minutes (1 by default). Timestamps are epoch seconds.
         """
+        if view == 'history':
+            minutes = _validate_int(minutes if minutes not in (None, '') else 24 * 60,
+                                    "minutes", 1, METRICS_HISTORY_MINUTES)
+            step = _validate_int(step if step not in (None, '') else 1,
+                                 "step", 1, minutes)
+            end = int(_clock.time() // 60)
+            with _history_lock:
+                return _metric_history.window(end, minutes, step)
+        if view is not None:
+            raise cherrypy.HTTPError(404, f"no metrics view {view!r}")
+        if format not in (None, '', 'json', 'prometheus'):
+            _bad_request("format must be json or prometheus")
         with _metrics_lock:
             snapshot = dict(_metrics)
+            sonos = {k: h.copy() for k, h in _sonos_latency.items()}
+            endpoints = {k: h.copy() for k, h in _endpoint_latency.items()}
+            pool_wait = _pool_wait.copy()
+            spotify = {k: h.copy() for k, h in _spotify_latency.items()}
+            statuses = dict(_spotify_statuses)
+            rate_limits = dict(_spotify_rate_limits)
+            retry_after = _spotify_retry_after.copy()
+            refreshes = list(_token_refreshes)
+            refresh_latency = _token_refresh_latency.copy()
+            token_expires_at = _token_expires_at
+            claude_usage = _claude_usage_locked()
+            claude_latency = _claude_latency.copy()
+            queue_wait = {k: h.copy() for k, h in _spotify_queue_wait.items()}
+        snapshot.update(_pool_snapshot())
+        snapshot.update({f'spotify_governor_{k}': v for k, v in _spotify_governor.snapshot().items()})
+        snapshot.update({f'spotify_cache_{k}': v for k, v in _spotify_cache.snapshot().items()})
+        snapshot.update({f'search_cache_{k}': v for k, v in _search_cache.snapshot().items()})
+        snapshot['pool_max'] = SERVER_THREAD_POOL
+        if token_expires_at is not None:
+            snapshot['spotify_token_expires_in_seconds'] = round(token_expires_at - _clock.time())
         with _watchdog_lock:
             watchdog = dict(_watchdog)
 
@@ -1808,11 +4803,100 @@ class DJServer:
         snapshot['sonos_seconds_total'] = round(snapshot['sonos_seconds_total'], 3)
         snapshot['sonos_seconds_max'] = round(snapshot['sonos_seconds_max'], 3)
         snapshot['content_seconds_max'] = round(snapshot['content_seconds_max'], 3)
+        samples = snapshot['schedule_lateness_samples']
+        snapshot['schedule_lateness_seconds_avg'] = round(
+            snapshot['schedule_lateness_seconds_total'] / samples, 3
+        ) if samples else 0.0
+        snapshot['schedule_lateness_seconds_total'] = round(
+            snapshot['schedule_lateness_seconds_total'], 3)
+        snapshot['schedule_lateness_seconds_max'] = round(
+            snapshot['schedule_lateness_seconds_max'], 3)
         snapshot['uptime_seconds'] = round(time.monotonic() - SERVER_START)
         snapshot['sonos_ready'] = watchdog['ok']
         snapshot['sonos_outages'] = watchdog['outages']
+        with _timings_lock:
+            routines = {k: h.copy() for k, h in _routine_latency.items()}
+
+        if format == 'prometheus':
+            cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+            for status, count in statuses.items():
+                snapshot[f'spotify_responses_{status}'] = count
+            totals = {name for name in _metrics if name not in _METRIC_LEVELS}
+            totals.update(f'spotify_responses_{status}' for status in statuses)
+            totals.update(f'{prefix}_{stat}'
+                          for prefix, cache in (('spotify_cache', _spotify_cache),
+                                                ('search_cache', _search_cache))
+                          for stat in cache.stats)
+            totals.add('sonos_outages')
+            return _prometheus_exposition(snapshot, {
+                'dj_sonos_request_seconds': ('action', sonos),
+                'dj_http_request_seconds': ('endpoint', endpoints),
+                'dj_routine_lateness_seconds': ('routine', routines),
+                'dj_pool_queue_wait_seconds': ('pool', {'http': pool_wait}),
+                'dj_spotify_request_seconds': ('method', spotify),
+                'dj_spotify_retry_after_seconds': ('api', {'spotify': retry_after}),
+                'dj_spotify_queue_wait_seconds': ('priority', queue_wait),
+                'dj_spotify_token_refresh_seconds': ('api', {'spotify': refresh_latency}),
+                'dj_claude_request_seconds': ('model', {CLAUDE_MODEL: claude_latency}),
+            }, totals)
+        snapshot['spotify_latency'] = {k: h.snapshot() for k, h in spotify.items()}
+        snapshot['spotify_statuses'] = {str(k): v for k, v in sorted(statuses.items())}
+        snapshot['spotify_rate_limited_by_method'] = rate_limits
+        snapshot['spotify_retry_after'] = retry_after.snapshot()
+        snapshot['spotify_token_refreshes_recent'] = refreshes
+        snapshot['spotify_token_refresh_latency'] = refresh_latency.snapshot()
+        snapshot['spotify_queue_wait'] = {k: h.snapshot() for k, h in queue_wait.items()}
+        snapshot['claude'] = claude_usage
+        snapshot['sonos_latency'] = {k: h.snapshot() for k, h in sonos.items()}
+        snapshot['endpoint_latency'] = {k: h.snapshot() for k, h in endpoints.items()}
+        snapshot['schedule_latency'] = {k: h.snapshot() for k, h in routines.items()}
+        snapshot['pool_queue_wait'] = pool_wait.snapshot()
         return snapshot
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out(handler=_json_or_text_handler)
+    def debug(self, view=None, seconds=None, top=None, stop=None):
+        """Diagnostics that are too detailed for /metrics.
+
+        /debug/slow lists the slowest requests since start, slowest first,
+        each with the spans it spent its time in: auth, each Spotify and
+        Sonos call, Claude, and serialising the reply.
+
+        /debug/profile?seconds=N samples every thread for N seconds (5 by
+        default) and answers with collapsed stacks, as text, for a
+        flamegraph. /debug/threads is what every thread is doing right now.
+
+        /debug/locks ranks the shared-state locks by time spent waiting on
+        them, with wait and hold percentiles. Empty unless instrument_locks
+        is set.
+
+        /debug/memory sizes the capped in-memory structures and reports the
+        top ?top allocation sites, starting tracemalloc on the first call;
+        each later call also says what grew since the one before. ?stop
+        ends tracing.
+        """
+        if view == 'slow':
+            return {"kept": SLOW_TRACES_KEPT, "traces": _slowest_traces()}
+        if view == 'threads':
+            return _thread_report()
+        if view == 'locks':
+            return _lock_report()
+        if view == 'memory':
+            top = _validate_int(top if top not in (None, '') else MEMORY_TOP_SITES,
+                                "top", 1, 100)
+            with _memory_lock:
+                return _memory_report(top, stop=_truthy(stop))
+        if view == 'profile':
+            seconds = _validate_int(seconds if seconds not in (None, '') else 5,
+                                    "seconds", 1, PROFILE_MAX_SECONDS)
+            if not _profile_lock.acquire(blocking=False):
+                raise cherrypy.HTTPError(409, "a profile is already running")
+            try:
+                return _sample_profile(seconds)
+            finally:
+                _profile_lock.release()
+        raise cherrypy.HTTPError(404, f"no debug view {view!r}")
+
     # ==================== QUEUE EDITING ====================
 
     @cherrypy.expose
@@ -1882,8 +4966,19 @@ class DJServer:
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
-    def schedules(self):
-        """List schedules, newest state included."""
+    def schedules(self, view=None, days=None):
+        """List schedules, newest state included.
+
+        /schedules/timeline lists every step fire over the next `days` days
+        (7 by default) across all routines, soonest first, for a page that
+        wants to show what is coming rather than what is configured.
+        """
+        if view == 'timeline':
+            days = _validate_int(days if days not in (None, '') else 7,
+                                 "days", 1, TIMELINE_MAX_DAYS)
+            return {"days": days, "fires": _schedule_timeline(days)}
+        if view is not None:
+            raise cherrypy.HTTPError(404, f"no schedules view {view!r}")
         with _schedules_lock:
             return {
                 "schedules": [_annotate_schedule(e) for e in _schedules],
@@ -1953,6 +5048,7 @@ class DJServer:
                 verb = "updated"
             _save_schedules_locked()
             result = _annotate_schedule(entry)
+        _wake_scheduler()
 
         log.info("Schedule %s: %s %s (%d step(s))",
                  verb, entry['time'], entry.get('label', ''), len(entry['steps']))
@@ -1971,6 +5067,7 @@ class DJServer:
             if len(_schedules) == before:
                 _bad_request(f"no schedule with id {id!r}")
             _save_schedules_locked()
+        _wake_scheduler()
         log.info("Schedule deleted: %s", id)
         return {"status": "deleted", "id": id}
 
@@ -1983,6 +5080,7 @@ class DJServer:
                 if entry.get('id') == id:
                     entry['enabled'] = not entry.get('enabled', True)
                     _save_schedules_locked()
+                    _wake_scheduler()
                     log.info("Schedule %s %s", id,
                              "enabled" if entry['enabled'] else "disabled")
                     return {"status": "ok", "schedule": dict(entry)}
@@ -2065,6 +5163,7 @@ class DJServer:
             _bad_request(
                 f"Message too long -- keep it under {MAX_CHAT_MESSAGE_CHARS} characters")
         _check_chat_rate(session_id)
+        _check_chat_budget()
         _record_metric('chat_calls')
 
         # Get Claude's interpretation
@@ -2175,7 +5274,8 @@ class DJServer:
         worth counting from -- see _record_sonos_call.
         """
         started = time.monotonic()
-        result = self._sonos_fetch(endpoint, timeout)
+        with _Span(f"sonos {_sonos_action(endpoint)}"):
+            result = self._sonos_fetch(endpoint, timeout)
         _record_sonos_call(endpoint, time.monotonic() - started, "error" not in result)
         return result
 
@@ -2254,56 +5354,90 @@ class DJServer:
 
     @_handles_spotify_errors
     def _do_search(self, q, type="track", limit=None, session_id='global'):
-        if limit is None:
-            limit = SEARCH_LIMIT
+        """Search Spotify and number the results for this session.
+
+        type may name several kinds, comma-separated (album,track), and limit
+        may then be one number for all of them or one per kind (5,12). They
+        go to Spotify as one request -- it takes a single limit, applied to
+        each kind, so it is asked for the largest and every group is cut back
+        to its own. Results are numbered straight through in the order the
+        kinds were given, so each of them can be played by number, and come
+        back under `groups` as well; a single kind is answered as before.
+        """
         # A NUL or other control character reached Spotify and came back as a
         # 502; it is the caller's mistake, not the upstream's.
         q = _validate_text(q, "q", 200)
-        results = sp.search(q=q, type=type, limit=_validate_int(limit, "limit", 1, 50))
+        types = str(type).split(',')
+        if '' in types or len(set(types)) != len(types):
+            _bad_request(f"type must be distinct kinds separated by commas, got {type!r}")
+        if not set(types) <= set(SEARCH_KINDS):
+            _bad_request(f"type must be among {', '.join(SEARCH_KINDS)}, got {type!r}")
+        limits = str(SEARCH_LIMIT if limit is None else limit).split(',')
+        if len(limits) == 1:
+            limits *= len(types)
+        if len(limits) != len(types):
+            _bad_request(f"limit must be one number or one per type, got {limit!r}")
+        limits = [_validate_int(n, "limit", 1, 50) for n in limits]
+
+        # Sorted, so album,track and track,album share one cache entry; the
+        # response is keyed by kind either way, and the numbering below
+        # still follows the order the caller gave.
+        results = _search_cache.get('search', q=q, type=','.join(sorted(types)),
+                                    limit=max(limits))
         output = []
+        groups = {}
+        for kind, count in zip(types, limits):
+            groups[kind] = [{"num": len(output) + i, **row}
+                            for i, row in enumerate(self._search_rows(kind, results)[:count], 1)]
+            output.extend(groups[kind])
 
-        if type == "track":
-            for i, track in enumerate(results['tracks']['items'], 1):
-                item = {
-                    "num": i,
-                    "name": track['name'],
-                    "artist": track['artists'][0]['name'],
-                    "album": track['album']['name'],
-                    "uri": track['uri']
-                }
-                output.append(item)
+        set_results(output, session_id)
+        if len(types) == 1:
+            return {"query": q, "type": type, "results": output}
+        return {"query": q, "type": ','.join(types), "results": output, "groups": groups}
 
-        elif type == "album":
-            for i, album in enumerate(results['albums']['items'], 1):
-                output.append({
-                    "num": i,
-                    "name": album['name'],
-                    "artist": album['artists'][0]['name'] if album.get('artists') else '',
-                    "tracks": album.get('total_tracks', 0),
-                    "year": (album.get('release_date') or '')[:4],
-                    "artwork": album['images'][0]['url'] if album.get('images') else None,
-                    "uri": album['uri'],
-                })
-
-        elif type == "playlist":
-            # Spotify can return null entries here; skip rather than crash.
-            for i, pl in enumerate(
-                    [p for p in results['playlists']['items'] if p], 1):
-                output.append({
-                    "num": i,
-                    "name": pl['name'],
-                    "artist": (pl.get('owner') or {}).get('display_name', ''),
-                    "tracks": (pl.get('tracks') or {}).get('total', 0),
-                    "uri": pl['uri'],
-                })
+    @staticmethod
+    def _search_rows(kind, results):
+        """One kind's items from a search response, as unnumbered rows.
+        _do_search only asks for SEARCH_KINDS, each of which has a shape here."""
+        items = (results.get(kind + 's') or {}).get('items') or []
+        if kind == "track":
+            return [{
+                "name": track['name'],
+                "artist": track['artists'][0]['name'],
+                "album": track['album']['name'],
+                "uri": track['uri']
+            } for track in items]
+
+        if kind == "album":
+            return [{
+                "name": album['name'],
+                "artist": album['artists'][0]['name'] if album.get('artists') else '',
+                "tracks": album.get('total_tracks', 0),
+                "year": (album.get('release_date') or '')[:4],
+                "artwork": album['images'][0]['url'] if album.get('images') else None,
+                "uri": album['uri'],
+            } for album in items]
 
-        set_results(output, session_id)
-        return {"query": q, "type": type, "results": output}
+        if kind == "playlist":
+            # Spotify can return null entries here; skip rather than crash.
+            return [{
+                "name": pl['name'],
+                "artist": (pl.get('owner') or {}).get('display_name', ''),
+                "tracks": (pl.get('tracks') or {}).get('total', 0),
+                "uri": pl['uri'],
+            } for pl in items if pl]
+        return []
 
-    def _content_load(self, action, uri, force=False):
+    def _content_load(self, action, uri, force=False, volume=None, clear=False):
         """Issue spotify/{now,queue,next}, collapsing a repeat of the same
         container into the load already in flight or just completed.
 
+        clear=True sends the scheduler's composite instead -- volume, clear
+        and load in one request, see _load_for_routine -- for which action
+        may also be 'cue', a load left paused. It dedupes exactly as the
+        plain load of the same action would.
+
         Only containers are deduplicated. A track add returns in about 50ms
         and never times out, so it is never retried -- refusing a deliberate
         second copy of the same song would cost something and prevent nothing.
@@ -2315,13 +5449,17 @@ class DJServer:
         not remembered, or the scheduler's retry would have nothing to retry.
         """
         validated = _validate_uri(uri)
-        endpoint = f"spotify/{action}/{validated}"
+        if clear:
+            level = '-' if volume is None else _validate_int(volume, "volume", 0, 100)
+            endpoint = f"routineload/{action}/{level}/{validated}"
+        else:
+            endpoint = f"spotify/{action}/{validated}"
 
         if force or not _is_container_uri(uri):
             return self._sonos_request(endpoint, timeout=SONOS_CONTENT_TIMEOUT)
 
         key = (action, validated)
-        now = time.monotonic()
+        now = _clock.monotonic()
         with _content_lock:
             for stale, entry in [(k, v) for k, v in _content_loads.items()
                                  if now - v['at'] > CONTENT_DEDUP_SECONDS]:
@@ -2357,7 +5495,8 @@ class DJServer:
             else:
                 entry = _content_loads.get(key)
                 if entry is not None:
-                    entry.update(at=time.monotonic(), finished=time.monotonic(),
+                    finished = _clock.monotonic()
+                    entry.update(at=finished, finished=finished,
                                  result=result, ambiguous=timed_out)
         return result
 
@@ -2510,9 +5649,11 @@ class DJServer:
                 "volume": 0,
                 "shuffle": False,
                 "playbackState": "unknown",
+                "next": {"uri": "", "artwork": ""},
                 "error": result["error"]
             }
         track = result.get('currentTrack', {})
+        upcoming = result.get('nextTrack') or {}
         return {
             "title": track.get('title', 'Nothing playing'),
             "artist": track.get('artist', ''),
@@ -2530,7 +5671,11 @@ class DJServer:
             "duration": track.get('duration', 0),
             "volume": result.get('volume', 0),
             "shuffle": bool(result.get('playMode', {}).get('shuffle')),
-            "playbackState": result.get('playbackState', 'unknown')
+            "playbackState": result.get('playbackState', 'unknown'),
+            # What the track-change prefetch warms, carried here so the
+            # webhook's one state call is all it takes -- see _prefetch.
+            "next": {"uri": upcoming.get('uri', ''),
+                     "artwork": _proxied_art(upcoming.get('absoluteAlbumArtUri', ''))},
         }
 
     def _do_getqueue(self):
@@ -2571,6 +5716,36 @@ class DJServer:
             _bad_request("No query provided. Use /search?q=your+search+terms")
         return self._do_search(q=q, type=type, limit=limit)
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @_handles_spotify_errors
+    def suggest(self, q=None, seq=None, session_id='global'):
+        """Track suggestions for a half-typed query. Never touches the
+        session's numbered results, so "play 3" still means the last search."""
+        seq = _validate_int(seq, "seq", 0, 2 ** 53)
+        query = _search_arg(_validate_text(q or '', "q", 200))
+        if not _claim_suggest_seq(session_id, seq):
+            return {"seq": seq, "superseded": True}
+        if len(query) < SUGGEST_MIN_CHARS:
+            return {"seq": seq, "query": query, "suggestions": [], "source": None}
+
+        with _suggest_lock:
+            rows, source = _suggest_cache.lookup(query, SUGGEST_LIMIT)
+        if rows is not None:
+            return {"seq": seq, "query": query, "suggestions": rows, "source": source}
+
+        _clock.sleep(SUGGEST_DEBOUNCE_SECONDS)
+        if not _suggest_is_current(session_id, seq):
+            return {"seq": seq, "superseded": True}
+        results = _search_cache.get('search', q=query, type='track', limit=SUGGEST_LIMIT)
+        rows = self._search_rows('track', results)
+        with _suggest_lock:
+            _suggest_cache.store(query, rows)
+        # The answer is kept either way; only the caller has moved on.
+        if not _suggest_is_current(session_id, seq):
+            return {"seq": seq, "superseded": True}
+        return {"seq": seq, "query": query, "suggestions": rows, "source": "spotify"}
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     def play(self, num=None, uri=None, force=None):
@@ -2799,12 +5974,12 @@ class DJServer:
         if not track_id:
             return {"error": "Current track is not from Spotify"}
 
-        track = sp.track(track_id)
+        track = _spotify_cache.get('track', track_id)
         artist_id = track['artists'][0]['id']
         artist_name = track['artists'][0]['name']
         
         # Get artist's top tracks
-        top = sp.artist_top_tracks(artist_id)
+        top = _spotify_cache.get('artist_top_tracks', artist_id)
         
         output = []
         for i, t in enumerate(top['tracks'][:_validate_int(limit, "limit", 1, 50)], 1):
@@ -2832,14 +6007,8 @@ class DJServer:
         """
         if uri:
             album_id = _validate_uri(uri).split(':')[-1]
-            album = sp.album(album_id)
-            output = [{
-                "num": i,
-                "name": t['name'],
-                "artist": t['artists'][0]['name'] if t.get('artists') else '',
-                "uri": t['uri'],
-                "duration_ms": t.get('duration_ms'),
-            } for i, t in enumerate(album['tracks']['items'], 1)]
+            album = _spotify_cache.get('album', album_id)
+            output = self._album_rows(album_id, album)
             # Deliberately NOT stored as the numbered results: expanding an
             # album in the UI should not silently change what "play number 3"
             # means for a CLI session running alongside it.
@@ -2865,22 +6034,11 @@ class DJServer:
         if not track_id:
             return {"error": "Current track is not from Spotify"}
 
-        track = sp.track(track_id)
+        track = _spotify_cache.get('track', track_id)
         
         album_id = track['album']['id']
-        album = sp.album(album_id)
-        
-        output = []
-        for i, t in enumerate(album['tracks']['items'], 1):
-            item = {
-                "num": i,
-                "name": t['name'],
-                "artist": t['artists'][0]['name'],
-                "uri": t['uri'],
-                "duration_ms": t['duration_ms']
-            }
-            output.append(item)
-        
+        album = _spotify_cache.get('album', album_id)
+        output = self._album_rows(album_id, album)
         set_results(output)
         return {
             "album": album['name'],
@@ -2890,6 +6048,69 @@ class DJServer:
             "tracks": output
         }
 
+    @staticmethod
+    def _album_rows(album_id, album):
+        """Every track of the album, numbered -- not just the first page of
+        50 that comes with the album, which cut box sets short."""
+        _, pages, _ = _container_listing('album', album_id, album)
+        return [{"num": i, **row}
+                for i, row in enumerate(itertools.chain.from_iterable(pages), 1)]
+
+    @cherrypy.expose
+    @_handles_spotify_errors
+    def container_tracks(self, uri=None, format=None, stream=None):
+        """Every track of an album or playlist (`uri=spotify:playlist:...`).
+
+        `format=compact` sends each track as a list in the order of `fields`
+        instead of an object, about half the bytes for a big playlist.
+        `stream=1` sends NDJSON: the head on the first line, then a line per
+        track as its page arrives, so a 5,000-track playlist starts showing
+        at once. Like album expansion, this never replaces the numbered
+        results.
+        """
+        kind = _validate_uri(uri).split(':')[1]
+        if kind not in CONTAINER_PAGE_SIZE:
+            _bad_request("uri must be a spotify:album: or spotify:playlist: URI")
+        if format not in (None, '', 'full', 'compact'):
+            _bad_request(f"format must be full or compact, got {format!r}")
+        compact = format == 'compact'
+        # Spotify errors up to here become the usual JSON error; after the
+        # first streamed byte they can only be reported in the body.
+        head, pages, cached = _container_listing(kind, uri.split(':')[-1])
+        head = {"uri": uri, **head, "cached": cached}
+        if compact:
+            head['fields'] = list(CONTAINER_COMPACT_FIELDS)
+
+        def shape(row):
+            return [row[f] for f in CONTAINER_COMPACT_FIELDS] if compact else row
+
+        if not _truthy(stream):
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            head['tracks'] = [shape(row) for page in pages for row in page]
+            return json.dumps(head, separators=(',', ':') if compact else None).encode()
+
+        cherrypy.response.headers['Content-Type'] = 'application/x-ndjson'
+        cherrypy.response.headers['X-Accel-Buffering'] = 'no'
+
+        def lines():
+            sent = 0
+            yield (json.dumps(head) + '\n').encode()
+            try:
+                for page in pages:
+                    sent += len(page)
+                    yield ''.join(json.dumps(shape(row), separators=(',', ':')) + '\n'
+                                  for row in page).encode()
+            except Exception as exc:
+                log.warning("Listing %s stopped after %d tracks: %s",
+                            uri, sent, type(exc).__name__)
+                yield (json.dumps({"error": f"Spotify stopped answering after {sent} "
+                                            f"of {head['total']} tracks"}) + '\n').encode()
+            finally:
+                pages.close()
+
+        return lines()
+    container_tracks._cp_config = {'response.stream': True}
+
 if __name__ == '__main__':
     # One line stating what this process actually believes, so a misconfigured
     # restart is visible in the log instead of being inferred from behaviour.
@@ -2919,7 +6140,7 @@ if __name__ == '__main__':
         # body was accepted, buffered and parsed.
         # SSE holds a worker per connected browser; the default of 10
         # would be exhausted by a few open tabs and stall every request.
-        'server.thread_pool': _setting('server_thread_pool'),
+        'server.thread_pool': SERVER_THREAD_POOL,
         'server.max_request_body_size': MAX_REQUEST_BODY_BYTES,
         # Without this CherryPy also writes both logs to stdout, which the
         # plist sends to the crash log -- every line stored twice, and the
@@ -2927,17 +6148,13 @@ if __name__ == '__main__':
         'log.screen': False,
     })
     _route_cherrypy_logs_to_file()
+    # After the HTTP server (priority 75), which is what creates the pool.
+    cherrypy.engine.subscribe('start', _instrument_thread_pool, priority=80)
 
     dj_server = DJServer()
 
-    # A CherryPy Monitor rather than a bare thread: it starts and stops with
-    # the engine, so a restart cannot leave an orphaned ticker behind.
-    cherrypy.process.plugins.Monitor(
-        cherrypy.engine,
-        lambda: run_due_schedules(dj_server),
-        frequency=SCHEDULE_TICK_SECONDS,
-        name='dj_scheduler',
-    ).subscribe()
+    # Sleeps until the next step is due rather than polling; see _Scheduler.
+    _Scheduler(cherrypy.engine, dj_server).subscribe()
 
     cherrypy.process.plugins.Monitor(
         cherrypy.engine,
@@ -2946,4 +6163,21 @@ if __name__ == '__main__':
         name='dj_watchdog',
     ).subscribe()
 
+    _load_metrics_history()
+    cherrypy.process.plugins.Monitor(
+        cherrypy.engine,
+        sample_metrics_history,
+        frequency=METRICS_HISTORY_SAMPLE_SECONDS,
+        name='dj_metrics_history',
+    ).subscribe()
+    cherrypy.process.plugins.Monitor(
+        cherrypy.engine,
+        refresh_spotify_token,
+        frequency=SPOTIFY_TOKEN_CHECK_SECONDS,
+        name='dj_spotify_token',
+    ).subscribe()
+    # After the Monitors have stopped (priority 50), so no sample can land
+    # once the snapshot has been taken.
+    cherrypy.engine.subscribe('stop', save_metrics_history, priority=60)
+
     cherrypy.quickstart(dj_server)
\ No newline at end of file
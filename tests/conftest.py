@@ -1,8 +1,13 @@
 """Conftest: patches module-level Spotify/config so server.py can be imported in tests."""
 import builtins
+import collections
+import concurrent.futures
+import datetime
 import io
 import sys
 import json
+import threading
+import time
 from unittest.mock import patch, MagicMock
 
 import cherrypy
@@ -82,6 +87,63 @@ def server_mod():
     return server_module
 
 
+class FakeClock:
+    """server._clock, wound by hand.
+
+    `at` is epoch seconds, and wall time, monotonic time and local time are
+    all read from it, so moving it moves every one of them. sleep() winds it
+    forward and then runs `during_sleep`, once, if a test has set it.
+    """
+
+    def __init__(self, at):
+        self.at = at
+        self.during_sleep = None
+
+    def time(self):
+        return self.at
+
+    def monotonic(self):
+        return self.at
+
+    def localtime(self):
+        return time.localtime(self.at)
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self.at)
+
+    def sleep(self, seconds):
+        self.at += seconds
+        if self.during_sleep:
+            hook, self.during_sleep = self.during_sleep, None
+            hook()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A FakeClock in place of server._clock, at 00:00 on Monday 2026-08-03
+    local time. A module that needs another start overrides this fixture and
+    sets `at`."""
+    clock = FakeClock(datetime.datetime(2026, 8, 3).timestamp())
+    monkeypatch.setattr(server_module, "_clock", clock)
+    return clock
+
+
+class _InlineExecutor:
+    """An executor that runs the job before submit returns."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+@pytest.fixture
+def inline():
+    """An executor for code under test that would otherwise hand work to a
+    pool thread the test cannot wait on."""
+    return _InlineExecutor()
+
+
 @pytest.fixture(autouse=True)
 def _never_touch_real_data(monkeypatch, tmp_path):
     """Point the persisted-state paths at a temp dir for every test.
@@ -94,14 +156,24 @@ def _never_touch_real_data(monkeypatch, tmp_path):
     """
     monkeypatch.setattr(server_module, "SCHEDULES_PATH",
                         str(tmp_path / "schedules.json"))
+    monkeypatch.setattr(server_module, "SCHEDULE_STATE_PATH",
+                        str(tmp_path / "schedules-state.jsonl"))
     monkeypatch.setattr(server_module, "STATIONS_PATH",
                         str(tmp_path / "stations.json"))
+    monkeypatch.setattr(server_module, "METRICS_HISTORY_PATH",
+                        str(tmp_path / "metrics-history.json"))
     monkeypatch.setattr(server_module, "_schedules", [])
     monkeypatch.setattr(server_module, "_stations", [])
     # In-flight claims key off (entry id, step index), and the helpers default
     # to id "sch_test" -- so without this a claim left by one test blocks the
     # identically-named step in the next one.
     monkeypatch.setattr(server_module, "_steps_in_flight", set())
+    monkeypatch.setattr(server_module, "_step_lanes", {})
+    monkeypatch.setattr(server_module, "_routine_latency", {})
+    monkeypatch.setattr(server_module, "_step_history", {})
+    # Keyed on a version only a save bumps, so a routine appended directly by
+    # one test would otherwise be served the previous test's timeline.
+    monkeypatch.setattr(server_module, "_timeline_cache", {})
     # Same reasoning: the watchdog latches on transitions, so a test that left
     # it "down" would suppress the alert the next test is asserting on.
     monkeypatch.setattr(server_module, "_watchdog", {
@@ -113,13 +185,73 @@ def _never_touch_real_data(monkeypatch, tmp_path):
         'sonos_seconds_total': 0.0, 'sonos_seconds_max': 0.0,
         'content_loads': 0, 'content_seconds_max': 0.0,
         'events_received': 0, 'stream_clients_peak': 0,
-        'schedule_fires': 0, 'schedule_failures': 0, 'chat_calls': 0,
+        'schedule_fires': 0, 'schedule_failures': 0,
+        'schedule_lateness_samples': 0, 'schedule_lateness_seconds_total': 0.0,
+        'schedule_lateness_seconds_max': 0.0, 'chat_calls': 0,
+        'pool_busy_peak': 0, 'pool_rejected': 0,
+        'spotify_calls': 0, 'spotify_failures': 0, 'spotify_rate_limited': 0,
+        'spotify_token_refreshes': 0, 'spotify_token_refresh_failures': 0,
+        'spotify_governor_rejections': 0, 'spotify_token_refreshes_background': 0,
+        'prefetches': 0, 'prefetch_failures': 0,
+        'container_cache_hits': 0, 'container_cache_misses': 0,
+        'claude_calls': 0, 'claude_failures': 0, 'claude_input_tokens': 0,
+        'claude_output_tokens': 0, 'chat_budget_rejections': 0,
     })
+    monkeypatch.setattr(server_module, "_pool_wait",
+                        server_module._Histogram(server_module.LATENCY_BUCKETS_SECONDS))
+    monkeypatch.setattr(server_module, "_sonos_latency", {})
+    monkeypatch.setattr(server_module, "_endpoint_latency", {})
+    monkeypatch.setattr(server_module, "_spotify_latency", {})
+    monkeypatch.setattr(server_module, "_spotify_statuses", collections.Counter())
+    monkeypatch.setattr(server_module, "_spotify_rate_limits", collections.Counter())
+    monkeypatch.setattr(server_module, "_spotify_retry_after",
+                        server_module._Histogram(server_module.RETRY_AFTER_BUCKETS_SECONDS))
+    monkeypatch.setattr(server_module, "_token_refreshes", collections.deque(
+        maxlen=server_module.SPOTIFY_REFRESHES_KEPT))
+    monkeypatch.setattr(server_module, "_token_refresh_latency",
+                        server_module._Histogram(server_module.LATENCY_BUCKETS_SECONDS))
+    monkeypatch.setattr(server_module, "_token_expires_at", None)
+    monkeypatch.setattr(server_module, "_claude_latency",
+                        server_module._Histogram(server_module.LATENCY_BUCKETS_SECONDS))
+    monkeypatch.setattr(server_module, "_claude_stop_reasons", collections.Counter())
+    monkeypatch.setattr(server_module, "_claude_outcomes", collections.Counter())
+    monkeypatch.setattr(server_module, "_claude_hours", {})
+    monkeypatch.setattr(server_module, "_claude_sessions", {})
+    monkeypatch.setattr(server_module, "_claude_day", {"date": None, "tokens": 0})
+    monkeypatch.setattr(server_module, "_slow_traces", [])
+    monkeypatch.setattr(server_module, "_trace_local", threading.local())
     # Otherwise a load recorded by one test suppresses the identical load the
     # next test is trying to make.
     monkeypatch.setattr(server_module, "_content_loads", {})
     monkeypatch.setattr(server_module, "_stream_clients", [])
     monkeypatch.setattr(server_module, "_art_origin", None)
+    monkeypatch.setattr(server_module, "_art_cache", collections.OrderedDict())
+    # A webhook in one test would otherwise prefetch on a background thread
+    # into whichever test's caches are current when it runs.
+    monkeypatch.setattr(server_module, "PREFETCH_ON_TRACK_CHANGE", False)
+    monkeypatch.setattr(server_module, "_prefetched_uri", None)
+    monkeypatch.setattr(server_module, "_prefetch_pending", None)
+    monkeypatch.setattr(server_module, "_container_cache", collections.OrderedDict())
+    monkeypatch.setattr(server_module, "_lock_stats", {})
+    monkeypatch.setattr(server_module, "_metric_history", server_module._MetricHistory())
+    monkeypatch.setattr(server_module, "_memory_previous", None)
+    # A response cached by one test would otherwise answer the next test's
+    # freshly mocked sp.
+    monkeypatch.setattr(server_module, "_spotify_cache", server_module._MetadataCache(
+        server_module.SPOTIFY_CACHE_TTL_SECONDS, server_module.SPOTIFY_CACHE_ENTRIES,
+        server_module._cache_refresh_executor))
+    monkeypatch.setattr(server_module, "_search_cache", server_module._MetadataCache(
+        {"search": server_module.SEARCH_CACHE_TTL_SECONDS}, server_module.SEARCH_CACHE_ENTRIES,
+        server_module._cache_refresh_executor,
+        empty_ttls={"search": server_module.SEARCH_CACHE_EMPTY_TTL_SECONDS},
+        normalise=server_module._search_arg, name="search_cache"))
+    monkeypatch.setattr(server_module, "_spotify_queue_wait", {})
+    monkeypatch.setattr(server_module, "_spotify_governor", server_module._SpotifyGovernor(
+        server_module.SPOTIFY_RATE_PER_SECOND, server_module.SPOTIFY_BURST))
+    monkeypatch.setattr(server_module, "_suggest_latest", {})
+    monkeypatch.setattr(server_module, "_suggest_cache", server_module._PrefixCache(
+        server_module.SUGGEST_CACHE_ENTRIES, server_module.SEARCH_CACHE_TTL_SECONDS,
+        server_module.SEARCH_CACHE_EMPTY_TTL_SECONDS))
     yield
 
 
@@ -94,6 +94,73 @@ class TestAlbumSearch:
         assert item["album"] == "Rumours"
 
 
+def _track(n):
+    return {"name": f"T{n}", "uri": f"spotify:track:{n}",
+            "artists": [{"name": "Fleetwood Mac"}], "album": {"name": "Rumours"}}
+
+
+class TestSeveralKindsAtOnce:
+    """The page used to send an album and a track search for every query,
+    and each became its own Spotify call."""
+
+    COMBINED = {"albums": ALBUM_SEARCH["albums"],
+                "tracks": {"items": [_track(n) for n in range(12)]}}
+
+    def test_one_spotify_call_at_the_largest_limit(self, dj, server_mod):
+        with patch.object(server_mod, "sp") as sp:
+            sp.search.return_value = self.COMBINED
+            dj._do_search(q="Rumours", type="album,track", limit="5,12")
+        sp.search.assert_called_once_with(q="Rumours", type="album,track", limit=12)
+
+    def test_each_kind_is_cut_to_its_own_limit(self, dj, server_mod):
+        with patch.object(server_mod, "sp") as sp:
+            sp.search.return_value = self.COMBINED
+            result = dj._do_search(q="Rumours", type="album,track", limit="1,3")
+        assert [len(result["groups"][k]) for k in ("album", "track")] == [1, 3]
+
+    def test_numbers_run_straight_through(self, dj, server_mod):
+        """So "play 2" means the first track, not whichever of two
+        separate searches happened to be stored last."""
+        with patch.object(server_mod, "sp") as sp:
+            sp.search.return_value = self.COMBINED
+            result = dj._do_search(q="Rumours", type="album,track", limit="1,3")
+        assert [r["num"] for r in result["results"]] == [1, 2, 3, 4]
+        assert result["groups"]["track"][0]["num"] == 2
+        assert server_mod.get_results() == result["results"]
+
+    def test_one_limit_applies_to_every_kind(self, dj, server_mod):
+        with patch.object(server_mod, "sp") as sp:
+            sp.search.return_value = self.COMBINED
+            result = dj._do_search(q="Rumours", type="track,album", limit=2)
+        assert list(result["groups"]) == ["track", "album"]
+        assert len(result["groups"]["track"]) == 2
+
+    def test_a_single_kind_has_no_groups(self, dj, server_mod):
+        with patch.object(server_mod, "sp") as sp:
+            sp.search.return_value = self.COMBINED
+            assert "groups" not in dj._do_search(q="Rumours", type="track")
+
+    def test_the_order_of_kinds_shares_one_cache_entry(self, dj, server_mod):
+        """track,album numbers tracks first but asks Spotify the same thing."""
+        with patch.object(server_mod, "sp") as sp:
+            sp.search.return_value = self.COMBINED
+            dj._do_search(q="Rumours", type="album,track", limit="5,12")
+            result = dj._do_search(q="Rumours", type="track,album", limit="12,5")
+        sp.search.assert_called_once()
+        assert result["results"][0]["uri"] == "spotify:track:0"
+
+    @pytest.mark.parametrize("kinds,limit", [
+        ("album,,track", None), ("track,track", None), ("album,track", "5,12,3"),
+        ("album,track", "5,x"), ("foo", None), ("album,artist", None),
+    ])
+    def test_malformed_kinds_or_limits_are_a_400(self, dj, server_mod, kinds, limit):
+        with patch.object(server_mod, "sp") as sp:
+            with pytest.raises(server_mod.cherrypy.HTTPError) as exc:
+                dj._do_search(q="Rumours", type=kinds, limit=limit)
+        assert exc.value.status == 400
+        sp.search.assert_not_called()
+
+
 class TestAlbumExpansion:
     def test_lists_tracks_for_an_explicit_album(self, dj, server_mod):
         with patch.object(server_mod, "sp") as sp:
@@ -130,10 +197,16 @@ class TestAlbumExpansion:
 
 
 class TestUi:
-    def test_one_query_runs_both_searches(self, markup):
+    def test_one_query_runs_both_searches_in_one_request(self, markup):
         body = markup.split("function doSearch(", 1)[1].split("\n  }", 1)[0]
-        assert "type=album" in body
-        assert "type=track" in body
+        assert "type=album,track" in body
+        assert body.count("fetch(") == 1
+
+    def test_album_rows_show_their_number(self, markup):
+        """Tracks are numbered on from the albums, so the albums' numbers
+        have to be on screen too or the track list seems to start at 6."""
+        body = markup.split("function renderAlbumRow(", 1)[1].split("\n  }", 1)[0]
+        assert "a.num" in body
 
     def test_no_type_selector_was_added(self, markup):
         """The field filters keep working; a selector would be in the way."""
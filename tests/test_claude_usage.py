@@ -0,0 +1,152 @@
+"""Tests for Claude usage accounting and the daily token budget.
+
+call_claude is the only thing here that costs money, and all /metrics knew
+of it was a call count. Every call now records its tokens, latency, stop
+reason and outcome, per session and per hour. A daily budget stops spending
+once it is used up. What has to hold: every path out of call_claude is
+recorded, failures included; tokens are charged to the right session, hour
+and day; the tables stay bounded; and an exhausted budget refuses before
+Claude is called, until the next local midnight.
+"""
+import datetime
+import types
+from unittest.mock import patch
+
+import anthropic
+import cherrypy
+import httpx
+import pytest
+
+
+def _response(text='{"action": "pause", "message": "Paused"}', stop_reason="end_turn",
+              input_tokens=300, output_tokens=20, cached=0):
+    return types.SimpleNamespace(
+        content=[types.SimpleNamespace(type="text", text=text)],
+        stop_reason=stop_reason,
+        usage=types.SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens,
+                                    cache_creation_input_tokens=None,
+                                    cache_read_input_tokens=cached),
+    )
+
+
+@pytest.fixture
+def clock(clock):
+    clock.at = datetime.datetime(2026, 8, 3, 21, 30).timestamp()
+    return clock
+
+
+@pytest.fixture
+def claude(server_mod):
+    with patch.object(server_mod, "claude") as mock:
+        yield mock.messages.create
+
+
+class TestRecording:
+    def test_a_call_is_recorded(self, server_mod, claude, clock):
+        claude.return_value = _response(cached=100)
+        server_mod.call_claude("pause it", "guest")
+        usage = server_mod._claude_usage_locked()
+        assert server_mod._metrics["claude_input_tokens"] == 400
+        assert server_mod._metrics["claude_output_tokens"] == 20
+        assert usage["outcomes"] == {"pause": 1}
+        assert usage["stop_reasons"] == {"end_turn": 1}
+        assert usage["latency"]["samples"] == 1
+        assert usage["sessions"]["guest"]["input_tokens"] == 400
+        assert usage["hours"][0]["hour"] == int(clock.time() // 3600) * 3600
+        assert usage["today"] == {"date": "2026-08-03", "tokens": 420,
+                                  "budget": server_mod.CHAT_DAILY_TOKEN_BUDGET}
+
+    @pytest.mark.parametrize("reply,outcome", [
+        (_response(stop_reason="refusal"), "refusal"),
+        (_response(text=""), "empty"),
+        (_response(text="{not json"), "unparseable"),
+        (_response(text='{"action": "dance", "message": "x"}'), "other"),
+    ])
+    def test_a_reply_that_is_not_a_command_is_a_failure(self, server_mod, claude, reply, outcome):
+        claude.return_value = reply
+        server_mod.call_claude("hello")
+        assert server_mod._claude_usage_locked()["outcomes"] == {outcome: 1}
+        assert server_mod._metrics["claude_failures"] == (outcome != "other")
+        assert server_mod._metrics["claude_input_tokens"] == 300
+
+    def test_a_failed_call_is_recorded_without_tokens(self, server_mod, claude):
+        request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+        claude.side_effect = anthropic.APIConnectionError(request=request)
+        server_mod.call_claude("hello")
+        assert server_mod._claude_usage_locked()["outcomes"] == {"unreachable": 1}
+        assert server_mod._metrics["claude_failures"] == 1
+        assert server_mod._metrics["claude_input_tokens"] == 0
+
+    def test_a_response_without_usage_still_counts(self, server_mod, claude):
+        claude.return_value = types.SimpleNamespace(
+            content=[types.SimpleNamespace(type="text", text='{"action": "skip", "message": "x"}')],
+            stop_reason="end_turn")
+        server_mod.call_claude("skip")
+        assert server_mod._metrics["claude_calls"] == 1
+
+
+class TestBounds:
+    def test_old_hours_are_dropped(self, server_mod, claude, clock):
+        claude.return_value = _response()
+        for _ in range(server_mod.CLAUDE_USAGE_HOURS_KEPT + 5):
+            server_mod.call_claude("pause")
+            clock.at += 3600
+        assert len(server_mod._claude_hours) == server_mod.CLAUDE_USAGE_HOURS_KEPT
+
+    def test_sessions_are_capped(self, server_mod, claude, clock, monkeypatch):
+        monkeypatch.setattr(server_mod, "MAX_CHAT_SESSIONS", 3)
+        claude.return_value = _response()
+        for i in range(5):
+            server_mod.call_claude("pause", f"s{i}")
+            clock.at += 1
+        assert set(server_mod._claude_sessions) == {"s2", "s3", "s4"}
+
+
+class TestBudget:
+    @pytest.fixture(autouse=True)
+    def _clear(self, server_mod, monkeypatch):
+        monkeypatch.setattr(server_mod, "_chat_calls", {})
+        monkeypatch.setattr(server_mod, "CHAT_DAILY_TOKEN_BUDGET", 1000)
+
+    CHAT = '{"action": "chat", "message": "Hi"}'
+
+    def test_spending_it_refuses_before_claude_is_called(self, dj, server_mod, claude, clock):
+        claude.return_value = _response(self.CHAT, input_tokens=900, output_tokens=200)
+        dj.chat(message="pause")
+        with pytest.raises(cherrypy.HTTPError) as exc:
+            dj.chat(message="pause")
+        assert exc.value.status == 429
+        assert claude.call_count == 1
+        assert server_mod._metrics["chat_budget_rejections"] == 1
+        # 21:30, so two and a half hours to midnight.
+        assert cherrypy.response.headers["Retry-After"] == str(int(2.5 * 3600))
+
+    def test_it_comes_back_at_midnight(self, dj, server_mod, claude, clock):
+        claude.return_value = _response(self.CHAT, input_tokens=900, output_tokens=200)
+        dj.chat(message="pause")
+        clock.at = datetime.datetime(2026, 8, 4, 0, 0, 1).timestamp()
+        dj.chat(message="pause")
+        assert claude.call_count == 2
+
+    def test_zero_is_no_budget(self, dj, server_mod, claude, clock, monkeypatch):
+        monkeypatch.setattr(server_mod, "CHAT_DAILY_TOKEN_BUDGET", 0)
+        claude.return_value = _response(self.CHAT, input_tokens=10 ** 7)
+        dj.chat(message="pause")
+        dj.chat(message="pause")
+        assert claude.call_count == 2
+
+
+class TestInMetrics:
+    def test_json(self, dj, server_mod, claude):
+        claude.return_value = _response()
+        server_mod.call_claude("pause", "guest")
+        result = dj.metrics()
+        assert result["claude_calls"] == 1
+        assert result["claude"]["sessions"]["guest"]["calls"] == 1
+
+    def test_prometheus(self, dj, server_mod, claude):
+        claude.return_value = _response()
+        server_mod.call_claude("pause")
+        text = dj.metrics(format="prometheus")
+        assert "dj_claude_input_tokens_total 300" in text
+        assert "# TYPE dj_claude_request_seconds histogram" in text
@@ -267,11 +267,12 @@ class TestParseTrackId:
         is not a bare base62 id must not get through."""
         assert dj._parse_track_id(bad) is None
 
-    def test_the_three_callers_use_the_helper(self):
-        """like(), recommend() and album_tracks() each had their own copy."""
+    def test_the_callers_use_the_helper(self):
+        """like(), recommend() and album_tracks() each had their own copy.
+        The track-change prefetch parses two URIs through it as well."""
         with open(os.path.join(HERE, 'server.py')) as f:
             source = f.read()
-        assert source.count("_parse_track_id(") == 4  # 1 definition + 3 callers
+        assert source.count("_parse_track_id(") == 6  # 1 definition + 5 callers
         assert source.count("split('track:')") == 1   # only inside the helper
 
 
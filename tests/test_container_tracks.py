@@ -0,0 +1,167 @@
+"""Tests for /container_tracks and whole-album listings.
+
+album_tracks read the first page that comes with the album, so a box set
+stopped at track 50, and nothing listed a playlist at all. What has to hold:
+every page is read, in order, and the pages after the first are requested
+a few at a time rather than one after another or all at once, each a span
+on the request's trace; a playlist is served from the cache
+until its snapshot_id changes; the compact and streamed forms carry the
+same tracks; a stream that fails part-way says so and caches nothing; and
+the cache stays bounded by tracks held.
+"""
+import concurrent.futures
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import cherrypy
+import pytest
+
+
+def _track(n):
+    return {"name": f"Song {n}", "artists": [{"name": "Band"}],
+            "uri": f"spotify:track:t{n}", "duration_ms": n}
+
+
+def _playlist_items(total):
+    def page(playlist_id, limit, offset, fields, additional_types):
+        return {"items": [{"track": _track(n)} for n in range(offset, min(offset + limit, total))]}
+    return page
+
+
+@pytest.fixture
+def sp(server_mod):
+    with patch.object(server_mod, "sp") as sp:
+        sp.playlist.return_value = {"name": "Party", "snapshot_id": "s1",
+                                    "tracks": {"total": 250}}
+        sp.playlist_items.side_effect = _playlist_items(250)
+        yield sp
+
+
+def _listing(dj, **params):
+    return json.loads(dj.container_tracks(uri="spotify:playlist:p1", **params))
+
+
+class TestPaging:
+    def test_every_page_arrives_in_order(self, dj, sp):
+        result = _listing(dj)
+        assert result["total"] == 250 and result["name"] == "Party"
+        assert [t["uri"] for t in result["tracks"]] == [f"spotify:track:t{n}" for n in range(250)]
+        assert sorted(c.kwargs["offset"] for c in sp.playlist_items.call_args_list) == [0, 100, 200]
+
+    def test_the_pages_are_requested_together(self, dj, sp):
+        together = threading.Barrier(3, timeout=5)
+        page = _playlist_items(250)
+
+        def concurrent(*args, **kwargs):
+            together.wait()
+            return page(*args, **kwargs)
+        sp.playlist_items.side_effect = concurrent
+        assert len(_listing(dj)["tracks"]) == 250
+
+    def test_only_a_window_of_pages_is_in_flight(self, server_mod, sp, monkeypatch):
+        """So one huge playlist cannot queue all its pages on the shared
+        pool ahead of everyone else's."""
+        submitted = []
+
+        class Recording:
+            def submit(self, fn, offset):
+                submitted.append(offset)
+                future = concurrent.futures.Future()
+                future.set_result(fn(offset))
+                return future
+        monkeypatch.setattr(server_mod, "_page_executor", Recording())
+        sp.playlist_items.side_effect = _playlist_items(1000)
+        pages = server_mod._container_pages("playlist", "p1", 0, 1000)
+        next(pages)
+        assert submitted == [0, 100, 200, 300, 400]
+        assert len(list(pages)) == 9 and len(submitted) == 10
+
+    def test_every_page_is_a_span_on_the_request(self, dj, server_mod, sp):
+        """The pages run on the pool's threads; without the request's trace
+        there, a slow listing looked like one cheap head call."""
+        trace = {"t0": time.monotonic(), "at": time.time(), "spans": []}
+        server_mod._trace_local.trace = trace
+        with patch.object(server_mod, "sp", server_mod._TracedSpotify(sp)):
+            _listing(dj)
+        names = sorted(span["name"] for span in trace["spans"])
+        assert names == ["spotify playlist"] + ["spotify playlist_items"] * 3
+
+    def test_a_removed_track_is_skipped(self, dj, sp):
+        sp.playlist.return_value["tracks"]["total"] = 2
+        sp.playlist_items.side_effect = None
+        sp.playlist_items.return_value = {"items": [{"track": None}, {"track": _track(1)}]}
+        assert [t["name"] for t in _listing(dj)["tracks"]] == ["Song 1"]
+
+    def test_a_box_set_is_not_cut_at_fifty(self, dj, sp):
+        sp.album.return_value = {
+            "name": "Box", "uri": "spotify:album:b1", "artists": [{"name": "Band"}],
+            "images": [], "release_date": "1990",
+            "tracks": {"total": 120, "items": [_track(n) for n in range(50)]}}
+        sp.album_tracks.side_effect = lambda album_id, limit, offset: {
+            "items": [_track(n) for n in range(offset, min(offset + limit, 120))]}
+        tracks = dj.album_tracks(uri="spotify:album:b1")["tracks"]
+        assert [t["num"] for t in tracks] == list(range(1, 121))
+        assert tracks[-1]["name"] == "Song 119"
+        assert sorted(c.kwargs["offset"] for c in sp.album_tracks.call_args_list) == [50, 100]
+
+
+class TestTheCache:
+    def test_an_unchanged_playlist_is_served_whole(self, dj, server_mod, sp):
+        _listing(dj)
+        result = _listing(dj)
+        assert result["cached"] is True and len(result["tracks"]) == 250
+        assert sp.playlist_items.call_count == 3
+        assert server_mod._metrics["container_cache_hits"] == 1
+
+    def test_an_edit_is_seen_at_once(self, dj, sp):
+        _listing(dj)
+        sp.playlist.return_value = {"name": "Party", "snapshot_id": "s2",
+                                    "tracks": {"total": 251}}
+        sp.playlist_items.side_effect = _playlist_items(251)
+        result = _listing(dj)
+        assert result["cached"] is False and len(result["tracks"]) == 251
+
+    def test_it_is_bounded_by_tracks(self, dj, server_mod, sp, monkeypatch):
+        monkeypatch.setattr(server_mod, "CONTAINER_CACHE_TRACKS", 500)
+        for n in range(3):
+            dj.container_tracks(uri=f"spotify:playlist:p{n}")
+        assert list(server_mod._container_cache) == [("playlist", "p1"), ("playlist", "p2")]
+
+
+class TestTheFormats:
+    def test_compact_is_the_same_tracks_as_lists(self, dj, sp):
+        full = _listing(dj)
+        compact = _listing(dj, format="compact")
+        fields = compact["fields"]
+        assert [dict(zip(fields, row)) for row in compact["tracks"]] == full["tracks"]
+
+    def test_a_stream_is_the_head_then_a_line_per_track(self, dj, sp):
+        body = b"".join(dj.container_tracks(uri="spotify:playlist:p1", stream="1"))
+        head, *tracks = [json.loads(line) for line in body.decode().splitlines()]
+        assert head["total"] == 250 and "tracks" not in head
+        assert [t["name"] for t in tracks] == [f"Song {n}" for n in range(250)]
+        assert cherrypy.response.headers["Content-Type"] == "application/x-ndjson"
+
+    def test_a_stream_that_fails_says_so_and_caches_nothing(self, dj, server_mod, sp):
+        page = _playlist_items(250)
+
+        def failing(*args, **kwargs):
+            if kwargs["offset"] == 200:
+                raise RuntimeError("gone")
+            return page(*args, **kwargs)
+        sp.playlist_items.side_effect = failing
+        body = b"".join(dj.container_tracks(uri="spotify:playlist:p1", stream="1"))
+        last = json.loads(body.decode().splitlines()[-1])
+        assert last["error"].startswith("Spotify stopped answering after 200 of 250")
+        assert server_mod._container_cache == {}
+
+
+@pytest.mark.parametrize("params", [
+    {"uri": "spotify:track:t1"}, {"uri": "spotify:playlist:p1", "format": "xml"}, {},
+])
+def test_a_bad_request_is_a_400(dj, sp, params):
+    with pytest.raises(cherrypy.HTTPError) as exc:
+        dj.container_tracks(**params)
+    assert exc.value.status == 400
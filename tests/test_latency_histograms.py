@@ -0,0 +1,149 @@
+"""Tests for the latency histograms in /metrics.
+
+A total, a max and a count say nothing about the tail, and one 46-second
+load swallows the rest. Calls are now also kept as log-bucketed histograms,
+one per Sonos action and one per HTTP endpoint. What has to hold: the series
+are keyed by action or handler, never by URI or path, so their number cannot
+grow with traffic; the percentiles land in the right bucket; and the
+Prometheus exposition is well formed and cumulative.
+"""
+from unittest.mock import MagicMock, patch
+
+import cherrypy
+import pytest
+
+
+def _ok():
+    response = MagicMock(status_code=200)
+    response.json.return_value = {"ok": True}
+    return response
+
+
+class TestSonosActions:
+    @pytest.mark.parametrize("endpoint,action", [
+        ("state", "state"),
+        ("volume/20", "volume"),
+        ("queuemove/3/5", "queuemove"),
+        ("spotify/now/spotify:track:abc", "spotify/now"),
+        ("spotify/queue/spotify:playlist:def", "spotify/queue"),
+        ("routineload/cue/12/spotify:playlist:def", "routineload/cue"),
+    ])
+    def test_the_uri_is_never_part_of_the_key(self, server_mod, endpoint, action):
+        assert server_mod._sonos_action(endpoint) == action
+
+    def test_every_call_lands_in_its_action(self, dj, server_mod):
+        with patch.object(server_mod.requests, "get", return_value=_ok()):
+            dj._sonos_request("volume/20")
+            dj._sonos_request("volume/30")
+            dj._sonos_request("state")
+        result = dj.metrics()["sonos_latency"]
+        assert result["volume"]["samples"] == 2
+        assert result["state"]["samples"] == 1
+
+
+class TestEndpoints:
+    @pytest.fixture
+    def request_at(self, monkeypatch):
+        def make(path):
+            monkeypatch.setattr(cherrypy.request, "path_info", path)
+            monkeypatch.setattr(cherrypy.request, "hooks",
+                                cherrypy._cprequest.HookMap(["on_end_request"]))
+        return make
+
+    def test_a_request_is_timed_to_its_end(self, server_mod, request_at):
+        request_at("/schedules/timeline")
+        server_mod._start_request_timer()
+        cherrypy.request.hooks.run("on_end_request")
+        assert server_mod._endpoint_latency["schedules"].snapshot()["samples"] == 1
+
+    @pytest.mark.parametrize("path,name", [
+        ("/", "index"),
+        ("/search", "search"),
+        ("/metrics/", "metrics"),
+        ("/wp-admin/setup.php", "unknown"),
+        ("/_sonos_request", "unknown"),
+    ])
+    def test_made_up_paths_share_one_series(self, server_mod, path, name):
+        assert server_mod._endpoint_name(path) == name
+
+    def test_the_tool_is_on_for_every_handler(self, server_mod):
+        assert server_mod.DJServer._cp_config["tools.djtiming.on"] is True
+
+
+class TestPercentiles:
+    def test_they_fall_in_the_right_bucket(self, server_mod):
+        histogram = server_mod._Histogram(server_mod.LATENCY_BUCKETS_SECONDS)
+        for _ in range(98):
+            histogram.observe(0.010)
+        histogram.observe(2.0)
+        histogram.observe(46.0)
+        snap = histogram.snapshot()
+        # 10ms sits in the 8-16ms bucket.
+        assert 0.008 <= snap["p50"] <= 0.016
+        assert 0.008 <= snap["p95"] <= 0.016
+        assert 1.024 <= snap["p99"] <= 2.048
+        assert snap["seconds_max"] == 46.0
+
+    def test_no_samples_is_zero(self, server_mod):
+        assert server_mod._Histogram((1,)).snapshot()["p99"] == 0.0
+
+    def test_never_above_the_max(self, server_mod):
+        histogram = server_mod._Histogram((1, 100))
+        histogram.observe(3)
+        assert histogram.quantile(0.99) <= 3
+
+
+class TestPrometheus:
+    def test_the_exposition(self, dj, server_mod):
+        with patch.object(server_mod.requests, "get", return_value=_ok()):
+            dj._sonos_request("volume/20")
+        text = dj.metrics(format="prometheus")
+        assert isinstance(text, str)
+        assert cherrypy.response.headers["Content-Type"] == "text/plain; version=0.0.4"
+        assert "# TYPE dj_sonos_calls_total counter\ndj_sonos_calls_total 1\n" in text
+        assert "# TYPE dj_sonos_request_seconds histogram" in text
+        assert 'dj_sonos_request_seconds_bucket{action="volume",le="+Inf"} 1' in text
+        assert 'dj_sonos_request_seconds_count{action="volume"} 1' in text
+
+    def test_running_totals_are_counters_and_levels_are_gauges(self, dj, server_mod):
+        """A gauge cannot be rate()d, and a high-water mark is not a total."""
+        server_mod._metrics["schedule_fires"] = 3
+        server_mod._metrics["pool_busy_peak"] = 2
+        text = dj.metrics(format="prometheus")
+        assert "# TYPE dj_schedule_fires_total counter\ndj_schedule_fires_total 3\n" in text
+        assert "# TYPE dj_sonos_seconds_total counter\n" in text
+        assert "# TYPE dj_spotify_cache_hits_total counter\n" in text
+        assert "# TYPE dj_pool_busy_peak gauge\ndj_pool_busy_peak 2\n" in text
+        assert "# TYPE dj_sonos_seconds_max gauge\n" in text
+        assert "# TYPE dj_spotify_cache_entries gauge\n" in text
+        assert "dj_schedule_fires " not in text
+
+    def test_buckets_are_cumulative(self, server_mod):
+        histogram = server_mod._Histogram((1, 10))
+        for value in (0.5, 5, 50):
+            histogram.observe(value)
+        text = server_mod._prometheus_exposition({}, {"m": ("k", {"a": histogram})})
+        assert 'm_bucket{k="a",le="1"} 1' in text
+        assert 'm_bucket{k="a",le="10"} 2' in text
+        assert 'm_bucket{k="a",le="+Inf"} 3' in text
+
+    def test_labels_are_escaped(self, server_mod):
+        histogram = server_mod._Histogram((1,))
+        text = server_mod._prometheus_exposition({}, {"m": ("k", {'a"b': histogram})})
+        assert 'k="a\\"b"' in text
+
+    def test_it_is_served_as_text(self, server_mod, monkeypatch):
+        monkeypatch.setattr(cherrypy.serving.request, "_json_inner_handler",
+                            lambda: "dj_up 1\n", raising=False)
+        assert server_mod._json_or_text_handler() == b"dj_up 1\n"
+        assert cherrypy.serving.response.headers["Content-Type"].startswith("text/plain")
+
+    def test_json_is_still_json(self, server_mod, monkeypatch):
+        monkeypatch.setattr(cherrypy.serving.request, "_json_inner_handler",
+                            lambda: {"a": 1}, raising=False)
+        assert server_mod._json_or_text_handler() == b'{"a": 1}'
+
+    def test_an_unknown_format_is_a_400(self, dj, server_mod):
+        with pytest.raises(cherrypy.HTTPError) as exc:
+            dj.metrics(format="xml")
+        assert exc.value.status == 400
@@ -0,0 +1,195 @@
+"""Tests for the instrumented locks and a stress run over all of them.
+
+The shared-state locks are taken from request threads, the scheduler, the
+step pool and the watchdog, and _schedules_lock is held across file writes,
+so a stall could be any of them. With instrument_locks on, each records how
+long every acquire waited and every hold lasted. What has to hold: the
+wrapper behaves as a Lock; waits and holds are attributed to the right name;
+/debug/locks puts the worst first; and driving every lock at once from many
+threads, with the interpreter switching threads as often as it can, neither
+deadlocks nor corrupts what they guard.
+
+The stress run is bounded in iterations rather than time. For a longer one:
+
+    DJ_LOCK_STRESS_ROUNDS=2000 python -m pytest -q tests/test_lock_stress.py
+"""
+import os
+import queue
+import sys
+import threading
+import time
+
+import cherrypy
+import pytest
+
+
+STRESS_ROUNDS = int(os.environ.get("DJ_LOCK_STRESS_ROUNDS", "150"))
+LOCKS = ("results", "stream", "content", "lanes", "schedules", "journal",
+         "metrics", "chat", "stations")
+
+
+@pytest.fixture
+def instrumented(server_mod, monkeypatch):
+    """Every named lock swapped for an instrumented one, as at startup."""
+    monkeypatch.setattr(server_mod, "INSTRUMENT_LOCKS", True)
+    monkeypatch.setattr(server_mod, "_named_locks", {})
+    for name in LOCKS:
+        monkeypatch.setattr(server_mod, f"_{name}_lock", server_mod._named_lock(name))
+    return server_mod
+
+
+class TestTheWrapper:
+    def test_off_by_default_it_is_a_plain_lock(self, server_mod):
+        assert not server_mod.DEFAULTS["instrument_locks"]
+        assert isinstance(server_mod._named_lock("x"), type(threading.Lock()))
+
+    def test_it_behaves_as_a_lock(self, server_mod):
+        lock = server_mod._InstrumentedLock("x")
+        with lock:
+            assert lock.locked()
+            assert not lock.acquire(blocking=False)
+            assert not lock.acquire(timeout=0.01)
+        assert not lock.locked()
+
+    def test_a_hold_is_timed(self, server_mod):
+        lock = server_mod._InstrumentedLock("x")
+        with lock:
+            time.sleep(0.02)
+        stats = server_mod._lock_report()["locks"][0]
+        assert stats["name"] == "x" and stats["acquisitions"] == 1
+        assert stats["hold"]["seconds_max"] >= 0.02
+        assert stats["contended"] == 0
+
+    def test_a_wait_is_timed(self, server_mod):
+        lock = server_mod._InstrumentedLock("x")
+        lock.acquire()
+        holder_done = threading.Timer(0.05, lock.release)
+        holder_done.start()
+        with lock:
+            pass
+        holder_done.join()
+        stats = server_mod._lock_report()["locks"][0]
+        assert stats["contended"] == 1
+        assert stats["wait"]["seconds_max"] >= 0.04
+
+    def test_a_failed_try_is_not_an_acquisition(self, server_mod):
+        lock = server_mod._InstrumentedLock("x")
+        with lock:
+            lock.acquire(blocking=False)
+        assert server_mod._lock_report()["locks"][0]["acquisitions"] == 1
+
+    def test_the_holder_is_named(self, instrumented):
+        with instrumented._metrics_lock:
+            pass
+        with instrumented._metrics_lock:
+            [row] = instrumented._lock_report()["locks"]
+            assert row["held_by"] == threading.current_thread().name
+
+
+class TestTheEndpoint:
+    def test_the_worst_come_first(self, dj, server_mod):
+        server_mod._record_lock_timing("quiet", "wait", 0.001)
+        server_mod._record_lock_timing("busy", "wait", 0.5)
+        server_mod._record_lock_timing("busy", "hold", 0.2)
+        result = dj.debug("locks")
+        assert [r["name"] for r in result["locks"]] == ["busy", "quiet"]
+        assert result["locks"][0]["wait_seconds_total"] == 0.5
+        assert result["locks"][0]["hold"]["samples"] == 1
+
+    def test_it_says_when_it_is_off(self, dj):
+        assert dj.debug("locks") == {"enabled": False, "locks": []}
+
+    def test_the_module_locks_are_all_named(self, server_mod):
+        from paths import SERVER_PY, read
+        source = read(SERVER_PY)
+        for name in LOCKS:
+            assert f"_{name}_lock = _named_lock('{name}')" in source
+
+
+def test_every_lock_at_once(instrumented, dj, monkeypatch):
+    server_mod = instrumented
+    monkeypatch.setattr(server_mod, "_chat_calls", {})
+    monkeypatch.setattr(server_mod, "search_results", {})
+    monkeypatch.setattr(dj, "_sonos_request", lambda endpoint, timeout=None: {"status": "success"})
+    # Each content load must be new, or it is answered from the dedupe table
+    # without the second trip through the lock.
+    monkeypatch.setattr(server_mod, "CONTENT_DEDUP_SECONDS", 0)
+    server_mod._schedules[:] = [
+        {"id": "wake", "time": "07:00", "days": [], "label": "wake", "enabled": True,
+         "steps": [{"offset": 0, "action": "pause", "last_fired": None}]},
+    ]
+
+    def results(i):
+        session = f"s{i % 7}"
+        server_mod.set_results([{"num": 1, "uri": f"spotify:track:{i}"}], session)
+        assert server_mod.get_results(session)[0]["num"] == 1
+
+    def metrics(i):
+        server_mod._record_metric("sonos_calls")
+
+    def schedules(i):
+        # The same work the scheduler and a save do, file writes included.
+        with server_mod._schedules_lock:
+            server_mod._save_schedules_locked()
+        server_mod._due_steps()
+
+    def chat(i):
+        try:
+            server_mod._check_chat_rate(f"c{i % 5}")
+        except cherrypy.HTTPError:
+            pass
+
+    def content(i):
+        dj._content_load("queue", f"spotify:playlist:stress{i}")
+
+    def stream(i):
+        client = queue.Queue(maxsize=4)
+        with server_mod._stream_lock:
+            server_mod._stream_clients.append(client)
+        server_mod._broadcast({"type": "stress", "n": i})
+        with server_mod._stream_lock:
+            server_mod._stream_clients.remove(client)
+
+    def stations(i):
+        with server_mod._stations_lock:
+            server_mod._save_stations_locked()
+
+    def lanes(i):
+        with server_mod._lanes_lock:
+            server_mod._step_lanes[f"lane{i % 3}"] = i
+            server_mod._step_lanes.pop(f"lane{i % 3}")
+
+    work = [results, metrics, schedules, chat, content, stream, stations, lanes]
+    errors = []
+
+    def drive(job):
+        try:
+            for i in range(STRESS_ROUNDS):
+                job(i)
+        except Exception as exc:  # surfaced below, with the job that raised it
+            errors.append((job.__name__, exc))
+
+    threads = [threading.Thread(target=drive, args=(job,), name=f"stress-{job.__name__}-{n}")
+               for job in work for n in range(2)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=120)
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert not [t.name for t in threads if t.is_alive()], "a lock deadlocked"
+    assert errors == []
+    assert server_mod._stream_clients == [] and server_mod._step_lanes == {}
+    assert server_mod._metrics["sonos_calls"] == 2 * STRESS_ROUNDS
+
+    report = server_mod._lock_report()
+    seen = {row["name"]: row for row in report["locks"]}
+    assert set(LOCKS) <= set(seen)
+    assert all(row["held_by"] is None for row in report["locks"])
+    assert seen["metrics"]["acquisitions"] >= 2 * STRESS_ROUNDS
+    waits = [row["wait_seconds_total"] for row in report["locks"]]
+    assert waits == sorted(waits, reverse=True)
@@ -0,0 +1,130 @@
+"""Tests for /debug/memory.
+
+The long-lived structures are capped by count, not by bytes, so a slow leak
+could sit inside any of them without tripping a cap. /debug/memory sizes
+each by name and runs tracemalloc on demand. What has to hold: tracing is
+off until asked for and off again after ?stop; the first call starts it and
+later ones report growth since the call before; an allocation made between
+two calls shows up as growth at its own line; and each structure's size
+moves with its contents.
+"""
+import queue
+import tracemalloc
+from unittest.mock import patch
+
+import cherrypy
+import pytest
+
+
+@pytest.fixture
+def traced(server_mod):
+    """Leave tracing as it was found, whatever the test did."""
+    was = tracemalloc.is_tracing()
+    yield
+    if tracemalloc.is_tracing() and not was:
+        tracemalloc.stop()
+
+
+_kept = []
+
+
+def _allocate():
+    _kept.append([bytearray(1000) for _ in range(500)])
+
+
+class TestTracing:
+    def test_off_until_asked_for(self, server_mod):
+        assert not tracemalloc.is_tracing()
+
+    def test_the_first_call_starts_it(self, dj, traced):
+        result = dj.debug("memory")
+        assert result["tracing"] and result["started"]
+        assert "growth" not in result
+        assert tracemalloc.is_tracing()
+
+    def test_growth_is_attributed_to_its_line(self, dj, traced):
+        dj.debug("memory")
+        _allocate()
+        try:
+            result = dj.debug("memory")
+        finally:
+            _kept.clear()
+        assert not result["started"]
+        grew = result["growth"][0]
+        assert grew["site"].startswith("test_memory.py:")
+        assert grew["bytes_diff"] >= 500 * 1000
+        assert result["growth_since_seconds"] >= 0
+        assert any(site["site"] == grew["site"] for site in result["top"])
+
+    def test_growth_is_since_the_previous_call(self, dj, traced):
+        dj.debug("memory")
+        _allocate()
+        try:
+            dj.debug("memory")
+            result = dj.debug("memory")
+        finally:
+            _kept.clear()
+        assert all(site["bytes_diff"] < 500 * 1000 for site in result["growth"])
+
+    def test_stop_turns_it_off(self, dj, traced):
+        dj.debug("memory")
+        result = dj.debug("memory", stop="")
+        assert result["tracing"] is False and "top" not in result
+        assert not tracemalloc.is_tracing()
+        assert dj.debug("memory")["started"]
+
+    def test_top_is_bounded(self, dj, traced):
+        assert len(dj.debug("memory", top="3")["top"]) <= 3
+        with pytest.raises(cherrypy.HTTPError) as exc:
+            dj.debug("memory", top="0")
+        assert exc.value.status == 400
+
+
+class TestStructures:
+    def test_every_capped_structure_is_named(self, dj, traced):
+        sizes = dj.debug("memory", stop="")["structures"]
+        assert {"sessions", "search_results", "chat_calls", "content_loads",
+                "stream_clients", "claude_sessions", "claude_hours",
+                "spotify_cache", "search_cache", "suggest_cache", "suggest_sessions",
+                "art_cache", "container_cache"} <= set(sizes)
+
+    def test_the_caches_are_measured(self, dj, server_mod, traced):
+        server_mod._art_cache[("http://192.168.8.134:1400", "u=1")] = ("image/jpeg", b"\xff" * 20000)
+        server_mod._container_cache[("playlist", "p1")] = {
+            "snapshot_id": "s1", "expires": 0,
+            "rows": [{"name": "x" * 100, "uri": f"spotify:track:{i}"} for i in range(30)]}
+        with server_mod._suggest_lock:
+            server_mod._suggest_cache.store("beatles", [{"name": "y" * 500}])
+        sizes = dj.debug("memory", stop="")["structures"]
+        assert sizes["art_cache"]["bytes"] >= 20000
+        assert sizes["container_cache"]["tracks"] == 30
+        assert sizes["container_cache"]["bytes"] >= 30 * 100
+        assert sizes["suggest_cache"] == {"entries": 1, "bytes": sizes["suggest_cache"]["bytes"]}
+        assert sizes["suggest_cache"]["bytes"] >= 500
+
+    def test_a_metadata_cache_is_measured(self, dj, server_mod, traced):
+        with patch.object(server_mod, "sp") as sp:
+            sp.album.return_value = {"name": "z" * 5000}
+            server_mod._spotify_cache.get("album", "al1")
+        sizes = dj.debug("memory", stop="")["structures"]["spotify_cache"]
+        assert sizes["entries"] == 1 and sizes["bytes"] >= 5000
+
+    def test_sizes_follow_contents(self, dj, server_mod, traced):
+        before = dj.debug("memory", stop="")["structures"]["search_results"]
+        server_mod.set_results([{"num": i, "name": "x" * 200, "uri": f"spotify:track:{i}"}
+                                for i in range(50)], "guest")
+        after = dj.debug("memory", stop="")["structures"]["search_results"]
+        assert after["entries"] == before["entries"] + 1
+        assert after["bytes"] - before["bytes"] >= 50 * 200
+
+    def test_queued_events_are_counted(self, dj, server_mod, traced):
+        client = queue.Queue()
+        server_mod._stream_clients.append(client)
+        server_mod._broadcast({"type": "state", "title": "y" * 1000})
+        sizes = dj.debug("memory", stop="")["structures"]["stream_clients"]
+        assert sizes["entries"] == 1 and sizes["queued_events"] == 1
+        assert sizes["bytes"] >= 1000
+
+    def test_shared_objects_are_counted_once(self, server_mod):
+        shared = "z" * 10000
+        assert server_mod._approximate_size([shared, shared]) < 2 * 10000
@@ -0,0 +1,191 @@
+"""Tests for the per-minute metrics history and /metrics/history.
+
+_metrics only holds running totals since start, so "is this getting worse"
+could not be asked across time or across a restart. A sample is now taken
+every minute into week-long ring buffers and saved on shutdown. What has to
+hold: each minute records what happened in it, not the running total; the
+store never grows past a week, and an old reading never shows up as a new
+one; minutes nobody sampled are gaps, not zeros; and a restart keeps the
+week.
+"""
+import json
+
+import cherrypy
+import pytest
+
+
+@pytest.fixture
+def clock(clock):
+    # Minute 29,000,000 is in 2025; any whole minute will do.
+    clock.at = 29_000_000 * 60.0
+    return clock
+
+
+def _minute(clock):
+    return int(clock.at // 60)
+
+
+def _sonos(server_mod, calls, seconds=0.1, failures=0, content=0):
+    for i in range(calls):
+        server_mod._record_sonos_call("volume/20", seconds, i >= failures)
+    for _ in range(content):
+        server_mod._record_sonos_call("spotify/now/spotify:playlist:x", 30.0, True)
+
+
+class TestSampling:
+    def test_a_minute_holds_what_happened_in_it(self, dj, server_mod, clock):
+        _sonos(server_mod, 3, seconds=0.2, failures=1, content=1)
+        server_mod.sample_metrics_history()
+        clock.at += 60
+        _sonos(server_mod, 1, seconds=0.4)
+        server_mod._record_metric("chat_calls")
+        server_mod.sample_metrics_history()
+
+        series = dj.metrics("history", minutes=2)["series"]
+        assert series["sonos_calls"] == [3, 1]
+        assert series["sonos_failures"] == [1, 0]
+        assert series["content_loads"] == [1, 0]
+        assert series["chat_calls"] == [0, 1]
+        assert series["sonos_seconds_avg"] == [0.2, 0.4]
+
+    def test_state_is_read_as_it_is(self, dj, server_mod, clock):
+        server_mod._stream_clients.extend([object(), object()])
+        server_mod.sample_metrics_history()
+        server_mod._watchdog["ok"] = False
+        clock.at += 60
+        server_mod.sample_metrics_history()
+        series = dj.metrics("history", minutes=2)["series"]
+        assert series["stream_clients"] == [2, 2]
+        assert series["sonos_ready"] == [None, 0]
+
+    def test_two_samples_in_one_minute_add_up(self, dj, server_mod, clock):
+        _sonos(server_mod, 2)
+        server_mod.sample_metrics_history()
+        clock.at += 30
+        _sonos(server_mod, 5)
+        server_mod.sample_metrics_history()
+        assert dj.metrics("history", minutes=1)["series"]["sonos_calls"] == [7]
+
+    def test_unsampled_minutes_are_gaps(self, dj, server_mod, clock):
+        server_mod.sample_metrics_history()
+        clock.at += 3 * 60
+        server_mod.sample_metrics_history()
+        series = dj.metrics("history", minutes=4)["series"]
+        assert series["sonos_calls"] == [0, None, None, 0]
+
+    def test_a_failing_sample_does_not_raise(self, server_mod, clock, monkeypatch):
+        monkeypatch.setattr(server_mod, "_metrics", {})
+        server_mod.sample_metrics_history()
+
+
+class TestTheRing:
+    def test_a_week_ago_is_not_this_week(self, server_mod):
+        history = server_mod._MetricHistory(capacity=10)
+        totals = dict.fromkeys(server_mod._HISTORY_COUNTERS, 0)
+        totals["chat_calls"] = 4
+        history.sample(100, totals, {})
+        # Past the ten minutes the ring holds: minute 100's slot is reused.
+        history.sample(111, totals, {})
+        window = history.window(111, 12, 1)["series"]["chat_calls"]
+        assert window[:2] == [None, None]
+        assert window[-1] == 0
+        assert window.count(None) == 11
+
+    def test_it_is_a_fixed_size(self, server_mod):
+        history = server_mod._MetricHistory()
+        before = {name: len(values) for name, values in history.series.items()}
+        totals = dict.fromkeys(server_mod._HISTORY_COUNTERS, 0)
+        for minute in range(0, 3 * server_mod.METRICS_HISTORY_MINUTES, 997):
+            history.sample(minute, totals, {})
+        assert {name: len(values) for name, values in history.series.items()} == before
+        assert set(before.values()) == {server_mod.METRICS_HISTORY_MINUTES}
+
+    def test_buckets_sum_counts_and_take_the_worst_state(self, server_mod):
+        history = server_mod._MetricHistory(capacity=60)
+        totals = dict.fromkeys(server_mod._HISTORY_COUNTERS, 0)
+        for minute, ready in zip(range(10, 16), (1, 1, 0, 1, 1, 1)):
+            totals["chat_calls"] += 2
+            history.sample(minute, totals, {"sonos_ready": ready,
+                                            "stream_clients": minute - 10})
+        window = history.window(15, 6, 3)
+        assert window["points"] == 2
+        assert window["series"]["chat_calls"] == [6, 6]
+        assert window["series"]["sonos_ready"] == [0, 1]
+        assert window["series"]["stream_clients"] == [2, 5]
+
+    def test_a_reset_total_is_not_negative(self, server_mod):
+        history = server_mod._MetricHistory(capacity=10)
+        totals = dict.fromkeys(server_mod._HISTORY_COUNTERS, 0)
+        history.sample(1, {**totals, "chat_calls": 9}, {})
+        history.sample(2, {**totals, "chat_calls": 2}, {})
+        assert history.window(2, 2, 1)["series"]["chat_calls"] == [9, 2]
+
+
+class TestTheEndpoint:
+    def test_the_default_is_a_day_by_the_minute(self, dj, server_mod, clock):
+        result = dj.metrics("history")
+        assert result["points"] == 24 * 60 and result["step_minutes"] == 1
+        assert result["start"] == (_minute(clock) - 24 * 60 + 1) * 60
+
+    @pytest.mark.parametrize("args", [
+        {"minutes": "0"}, {"minutes": "20000"}, {"minutes": "x"},
+        {"minutes": "10", "step": "11"},
+    ])
+    def test_bad_ranges_are_a_400(self, dj, clock, args):
+        with pytest.raises(cherrypy.HTTPError) as exc:
+            dj.metrics("history", **args)
+        assert exc.value.status == 400
+
+    def test_an_unknown_view_is_a_404(self, dj):
+        with pytest.raises(cherrypy.HTTPError) as exc:
+            dj.metrics("nonsense")
+        assert exc.value.status == 404
+
+    def test_plain_metrics_still_work(self, dj):
+        assert "sonos_calls" in dj.metrics()
+
+
+class TestSnapshots:
+    def test_a_restart_keeps_the_week(self, dj, server_mod, clock):
+        _sonos(server_mod, 4, seconds=0.25)
+        server_mod.sample_metrics_history()
+        before = dj.metrics("history", minutes=60)
+        server_mod.save_metrics_history()
+
+        server_mod._metric_history = server_mod._MetricHistory()
+        server_mod._load_metrics_history()
+        assert dj.metrics("history", minutes=60) == before
+
+    def test_after_a_restart_counting_starts_from_zero(self, dj, server_mod, clock):
+        _sonos(server_mod, 4)
+        server_mod.sample_metrics_history()
+        server_mod.save_metrics_history()
+        server_mod._metric_history = server_mod._MetricHistory()
+        server_mod._load_metrics_history()
+
+        server_mod._metrics["sonos_calls"] = 1
+        clock.at += 60
+        server_mod.sample_metrics_history()
+        assert dj.metrics("history", minutes=2)["series"]["sonos_calls"] == [4, 1]
+
+    def test_no_snapshot_is_an_empty_history(self, server_mod):
+        server_mod._load_metrics_history()
+        assert server_mod._metric_history.latest is None
+
+    @pytest.mark.parametrize("content", [
+        "not json", '{"latest": "x", "series": {}}', '{"series": {}}',
+        '{"latest": 5, "series": {"chat_calls": [-1]}}',
+    ])
+    def test_a_damaged_snapshot_is_ignored(self, server_mod, content):
+        with open(server_mod.METRICS_HISTORY_PATH, "w") as f:
+            f.write(content)
+        server_mod._load_metrics_history()
+        assert server_mod._metric_history.latest is None
+
+    def test_it_is_written_compactly(self, server_mod, clock):
+        server_mod.sample_metrics_history()
+        server_mod.save_metrics_history()
+        with open(server_mod.METRICS_HISTORY_PATH) as f:
+            text = f.read()
+        assert ", " not in text
+        assert json.loads(text)["latest"] == _minute(clock)
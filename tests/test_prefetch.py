@@ -0,0 +1,203 @@
+"""Tests for the track-change prefetch.
+
+After a track change the next taps are usually "album" or "more by this
+artist", and each paid for sp.track plus sp.album or sp.artist_top_tracks on
+the click. A webhook with a new URI now warms those in the background, along
+with the next track's metadata and artwork. What has to hold: only a new URI
+prefetches, not every volume nudge; the next track comes from the state the
+webhook already read, not a second call to the speaker; the views it warms
+then make no call; its Spotify calls are background priority; artwork is
+cached per speaker; a newer track drops a prefetch still waiting its turn;
+and a failure, even to queue, stays in the background and is tried again on
+the next event.
+"""
+import concurrent.futures
+import io
+import json
+from unittest.mock import MagicMock, patch
+
+import cherrypy
+import pytest
+
+
+CURRENT = "x-sonos-spotify:spotify%3atrack%3acur1?sid=9"
+NEXT = "x-sonos-spotify:spotify%3atrack%3anext1?sid=9"
+NEXT_ART = "http://192.168.8.134:1400/getaa?s=1&u=next"
+STATE = {"currentTrack": {"uri": CURRENT},
+         "nextTrack": {"uri": NEXT, "absoluteAlbumArtUri": NEXT_ART}}
+TRACK = {"artists": [{"id": "ar1", "name": "Fleetwood Mac"}], "album": {"id": "al1"}}
+ALBUM = {"name": "Rumours", "uri": "spotify:album:al1", "release_date": "1977",
+         "artists": [{"name": "Fleetwood Mac"}], "images": [],
+         "tracks": {"items": [{"name": "Dreams", "uri": "spotify:track:2",
+                               "artists": [{"name": "Fleetwood Mac"}], "duration_ms": 1}]}}
+
+
+def _image():
+    response = MagicMock(status_code=200, content=b"\xff\xd8next")
+    response.headers = {"Content-Type": "image/jpeg"}
+    return response
+
+
+@pytest.fixture
+def prefetching(server_mod, monkeypatch, inline):
+    monkeypatch.setattr(server_mod, "PREFETCH_ON_TRACK_CHANGE", True)
+    monkeypatch.setattr(server_mod, "_prefetch_executor", inline)
+
+
+@pytest.fixture
+def sp(server_mod):
+    with patch.object(server_mod, "sp") as sp:
+        sp.track.return_value = TRACK
+        sp.album.return_value = ALBUM
+        sp.artist_top_tracks.return_value = {"tracks": []}
+        yield sp
+
+
+@pytest.fixture
+def sonos(dj):
+    with patch.object(dj, "_sonos_request", return_value=STATE) as sonos:
+        yield sonos
+
+
+@pytest.fixture
+def post_event(dj, sonos, monkeypatch):
+    """Deliver a webhook; the speaker answers `state` from the sonos fixture."""
+    def _post(kind="transport-state"):
+        monkeypatch.setattr(cherrypy.request, "body",
+                            io.BytesIO(json.dumps({"type": kind}).encode()), raising=False)
+        return dj.sonos_event()
+    return _post
+
+
+class TestWhenItRuns:
+    def test_a_new_track_warms_album_artist_and_next(self, dj, server_mod, sp,
+                                                      prefetching, post_event):
+        with patch.object(server_mod.requests, "get", return_value=_image()):
+            post_event()
+        sp.track.assert_any_call("cur1")
+        sp.track.assert_any_call("next1")
+        sp.album.assert_called_once_with("al1")
+        sp.artist_top_tracks.assert_called_once_with("ar1")
+        assert server_mod._art_cache[("http://192.168.8.134:1400", "s=1&u=next")] == (
+            "image/jpeg", b"\xff\xd8next")
+        assert server_mod._metrics["prefetches"] == 1
+
+    def test_the_speaker_is_asked_once(self, dj, server_mod, sp, sonos, prefetching,
+                                       post_event):
+        """The webhook has just read the state; the prefetch uses that."""
+        with patch.object(server_mod.requests, "get", return_value=_image()):
+            post_event()
+        sonos.assert_called_once_with("state")
+
+    def test_the_same_track_does_not_prefetch_again(self, dj, server_mod, sp,
+                                                    prefetching, post_event):
+        with patch.object(server_mod.requests, "get", return_value=_image()):
+            post_event()
+            post_event(kind="volume-change")
+        assert sp.album.call_count == 1
+        assert server_mod._metrics["prefetches"] == 1
+
+    def test_it_can_be_turned_off(self, dj, server_mod, sp, post_event):
+        post_event()
+        sp.track.assert_not_called()
+
+    def test_its_calls_are_background(self, dj, server_mod, sp, sonos, prefetching,
+                                      post_event):
+        seen = []
+        sp.track.side_effect = lambda track_id: seen.append(
+            getattr(server_mod._spotify_local, "priority", "interactive")) or TRACK
+        sonos.return_value = {"currentTrack": {"uri": CURRENT}}
+        post_event()
+        assert seen == ["background"]
+
+
+class TestTheQueue:
+    class Held:
+        """A worker that never gets round to anything."""
+        def __init__(self):
+            self.jobs = []
+
+        def submit(self, fn, *args):
+            future = concurrent.futures.Future()
+            self.jobs.append((args[0], future))
+            return future
+
+    def test_a_newer_track_drops_the_one_still_waiting(self, dj, server_mod, sp, sonos,
+                                                       post_event, monkeypatch):
+        """A run of skips would otherwise queue a prefetch per track."""
+        held = self.Held()
+        monkeypatch.setattr(server_mod, "PREFETCH_ON_TRACK_CHANGE", True)
+        monkeypatch.setattr(server_mod, "_prefetch_executor", held)
+        post_event()
+        sonos.return_value = {"currentTrack": {"uri": NEXT}}
+        post_event()
+        (first, stale), (second, current) = held.jobs
+        assert (first, second) == (CURRENT, NEXT)
+        assert stale.cancelled() and not current.cancelled()
+
+    def test_a_refused_submit_does_not_fail_the_webhook(self, dj, server_mod, sp,
+                                                        post_event, monkeypatch):
+        """After shutdown the executor raises; the broadcast has gone out and
+        node-sonos-http-api must not see a 500 for a best-effort prefetch."""
+        refusing = MagicMock()
+        refusing.submit.side_effect = RuntimeError("cannot schedule new futures")
+        monkeypatch.setattr(server_mod, "PREFETCH_ON_TRACK_CHANGE", True)
+        monkeypatch.setattr(server_mod, "_prefetch_executor", refusing)
+        assert post_event()["status"] == "broadcast"
+        assert server_mod._prefetched_uri is None
+
+
+class TestWhatItSaves:
+    def test_the_views_then_make_no_call(self, dj, server_mod, sp, prefetching, post_event):
+        with patch.object(server_mod.requests, "get", return_value=_image()):
+            post_event()
+        calls = (sp.track.call_count, sp.album.call_count, sp.artist_top_tracks.call_count)
+        dj.album_tracks(based_on="nowplaying")
+        dj.recommend(based_on="nowplaying")
+        assert (sp.track.call_count, sp.album.call_count,
+                sp.artist_top_tracks.call_count) == calls
+
+    def test_the_next_artwork_is_served_without_the_speaker(
+            self, dj, server_mod, sp, prefetching, post_event, monkeypatch):
+        with patch.object(server_mod.requests, "get", return_value=_image()):
+            post_event()
+        monkeypatch.setattr(cherrypy.request, "query_string", "s=1&u=next", raising=False)
+        with patch.object(server_mod.requests, "get") as get:
+            assert dj.albumart() == b"\xff\xd8next"
+        get.assert_not_called()
+
+    def test_another_speakers_artwork_is_not_served_from_the_cache(self, server_mod):
+        """Its getaa takes the same query strings for different images."""
+        server_mod._proxied_art(NEXT_ART)
+        with patch.object(server_mod.requests, "get", return_value=_image()):
+            server_mod._album_art("s=1&u=next")
+        server_mod._proxied_art("http://192.168.8.200:1400/getaa?s=1&u=next")
+        with patch.object(server_mod.requests, "get", return_value=_image()) as get:
+            server_mod._album_art("s=1&u=next")
+        get.assert_called_once_with("http://192.168.8.200:1400/getaa?s=1&u=next",
+                                    timeout=server_mod.SONOS_TIMEOUT)
+
+    def test_the_artwork_cache_is_bounded(self, server_mod, monkeypatch):
+        server_mod._proxied_art(NEXT_ART)
+        with patch.object(server_mod.requests, "get", return_value=_image()):
+            for n in range(server_mod.ART_CACHE_ENTRIES + 3):
+                server_mod._album_art(f"u={n}")
+        assert len(server_mod._art_cache) == server_mod.ART_CACHE_ENTRIES
+        assert ("http://192.168.8.134:1400", "u=0") not in server_mod._art_cache
+
+
+def test_a_failure_stays_in_the_background(dj, server_mod, sp, prefetching, post_event):
+    sp.track.side_effect = RuntimeError("boom")
+    assert post_event()["status"] == "broadcast"
+    assert server_mod._metrics["prefetch_failures"] == 1
+
+
+def test_a_failure_is_tried_again_on_the_next_event(dj, server_mod, sp, prefetching,
+                                                     post_event):
+    """Otherwise one Spotify hiccup leaves the whole track unwarmed."""
+    sp.track.side_effect = [RuntimeError("boom"), TRACK, TRACK]
+    with patch.object(server_mod.requests, "get", return_value=_image()):
+        post_event()
+        post_event(kind="volume-change")
+    assert server_mod._metrics["prefetch_failures"] == 1
+    assert server_mod._metrics["prefetches"] == 1
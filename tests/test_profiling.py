@@ -0,0 +1,107 @@
+"""Tests for /debug/profile and /debug/threads.
+
+The server runs under launchd, where no profiler can be attached, so it
+samples its own threads on request. What has to hold: the profile is in the
+collapsed-stack format a flamegraph tool reads, with the pool's workers
+folded into one root; only one runs at a time; and the thread view tells an
+idle worker from one held by a stream or stuck in a request.
+"""
+import threading
+import traceback
+from unittest.mock import patch
+
+import cherrypy
+import pytest
+
+
+@pytest.fixture
+def parked():
+    """A thread blocked in a recognisable function until the test ends."""
+    release = threading.Event()
+
+    def parked_in_a_test():
+        release.wait(10)
+
+    thread = threading.Thread(target=parked_in_a_test, name="CP Server Thread-7")
+    thread.start()
+    yield thread
+    release.set()
+    thread.join(5)
+
+
+class TestTheProfile:
+    def test_collapsed_stacks_root_first_with_counts(self, server_mod, parked):
+        lines = server_mod._sample_profile(0.1).splitlines()
+        ours = [line for line in lines if "parked_in_a_test" in line]
+        assert ours, lines
+        stack, count = ours[0].rsplit(" ", 1)
+        assert int(count) >= 1
+        frames = stack.split(";")
+        assert frames[0] == "CP Server Thread"
+        assert "parked_in_a_test (test_profiling.py)" in frames
+
+    def test_the_sampling_thread_leaves_itself_out(self, server_mod):
+        assert "_sample_profile" not in server_mod._sample_profile(0.05)
+
+    @pytest.mark.parametrize("name,group", [
+        ("CP Server Thread-12", "CP Server Thread"),
+        ("dj_step_3", "dj_step"),
+        ("dj_scheduler", "dj_scheduler"),
+        ("MainThread", "MainThread"),
+    ])
+    def test_workers_fold_into_one_root(self, server_mod, name, group):
+        assert server_mod._thread_group(name) == group
+
+    def test_the_endpoint_answers_in_text(self, dj, server_mod):
+        with patch.object(server_mod, "_sample_profile", return_value="a;b 3\n") as sample:
+            assert dj.debug("profile", seconds="2") == "a;b 3\n"
+        sample.assert_called_once_with(2)
+
+    @pytest.mark.parametrize("seconds", ["0", "31", "forever"])
+    def test_seconds_is_bounded(self, dj, seconds):
+        with pytest.raises(cherrypy.HTTPError) as exc:
+            dj.debug("profile", seconds=seconds)
+        assert exc.value.status == 400
+
+    def test_only_one_runs_at_a_time(self, dj, server_mod):
+        with server_mod._profile_lock:
+            with pytest.raises(cherrypy.HTTPError) as exc:
+                dj.debug("profile", seconds="1")
+        assert exc.value.status == 409
+
+    def test_a_failed_profile_frees_the_slot(self, dj, server_mod):
+        with patch.object(server_mod, "_sample_profile", side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                dj.debug("profile", seconds="1")
+        assert not server_mod._profile_lock.locked()
+
+
+def _stack(*names, filename="x.py"):
+    return [traceback.FrameSummary(filename, 1, name) for name in names]
+
+
+class TestTheThreads:
+    def test_every_thread_is_listed_with_where_it_waits(self, dj, parked):
+        report = dj.debug("threads")
+        thread = next(t for t in report["threads"] if t["name"] == "CP Server Thread-7")
+        assert "wait" in thread["waiting_in"]
+        assert any("parked_in_a_test" in frame for frame in thread["stack"])
+        assert sum(report["states"].values()) == len(report["threads"])
+
+    def test_an_idle_worker(self, server_mod):
+        stack = _stack("run", "_process_connections_until_interrupted", "get", "wait")
+        assert server_mod._thread_state(stack) == "idle"
+
+    def test_a_busy_worker(self, server_mod):
+        stack = _stack("run", "_process_connections_until_interrupted", "communicate",
+                       "respond", "search")
+        assert server_mod._thread_state(stack) == "busy"
+
+    def test_a_worker_held_by_a_stream(self, server_mod):
+        stack = (_stack("run", "_process_connections_until_interrupted", "communicate")
+                 + _stack("events", filename=server_mod.__file__)
+                 + _stack("get", "wait"))
+        assert server_mod._thread_state(stack) == "stream"
+
+    def test_not_a_worker(self, server_mod):
+        assert server_mod._thread_state(_stack("run", "_run_lane")) == "background"
@@ -0,0 +1,173 @@
+"""Tests for the step-state journal.
+
+Every claim and every outcome used to re-serialise every routine into
+schedules.json while holding _schedules_lock -- twice per fired step. Step
+state now goes to an append-only journal, written after the lock is
+released, and schedules.json holds definitions only. What has to hold: a
+claim touches only the journal; a restart replays it to the same state;
+replay is order-independent and survives a torn line; a record never lands
+on a step an edit has moved; and compaction keeps the file bounded.
+"""
+import datetime
+import json
+import os
+from unittest.mock import patch
+
+
+def _tm(hour, minute):
+    return datetime.datetime(2026, 8, 3, hour, minute).timetuple()
+
+
+def _add(server_mod, steps=None, id="wake"):
+    server_mod._schedules.append({
+        "id": id, "time": "07:00", "days": [], "label": id, "enabled": True,
+        "steps": steps or [{"offset": 0, "action": "pause", "last_fired": None}],
+    })
+
+
+def _journal(server_mod):
+    with open(server_mod.SCHEDULE_STATE_PATH) as f:
+        return [json.loads(line) for line in f]
+
+
+def _restart(server_mod):
+    server_mod._schedules[:] = server_mod._load_schedules()
+    return server_mod._schedules
+
+
+class TestTheHotPath:
+    def test_a_claim_appends_and_leaves_the_definitions_alone(self, server_mod):
+        _add(server_mod)
+        with server_mod._schedules_lock:
+            server_mod._save_schedules_locked()
+        before = os.stat(server_mod.SCHEDULES_PATH).st_mtime_ns
+        lines = len(_journal(server_mod))
+
+        server_mod._due_steps(_tm(7, 0))
+        assert os.stat(server_mod.SCHEDULES_PATH).st_mtime_ns == before
+        assert len(_journal(server_mod)) == lines + 1
+
+    def test_the_write_happens_outside_the_schedules_lock(self, server_mod):
+        _add(server_mod)
+        held = []
+        real = server_mod._journal_append
+
+        def append(records):
+            held.append(server_mod._schedules_lock.locked())
+            return real(records)
+
+        with patch.object(server_mod, "_journal_append", side_effect=append):
+            claimed = server_mod._due_steps(_tm(7, 0))
+            server_mod._record_step_outcome(claimed[0], True, None)
+        assert held == [False, False]
+
+    def test_a_failed_write_is_logged_not_raised(self, server_mod, monkeypatch, caplog):
+        import logging
+        monkeypatch.setattr(server_mod, "SCHEDULE_STATE_PATH",
+                            os.path.join(os.path.dirname(server_mod.SCHEDULES_PATH),
+                                         "missing", "state.jsonl"))
+        _add(server_mod)
+        with caplog.at_level(logging.ERROR, logger="dj"):
+            assert len(server_mod._due_steps(_tm(7, 0))) == 1
+        assert "Could not write" in caplog.text
+
+
+class TestReplay:
+    def test_a_restart_keeps_the_state(self, server_mod):
+        _add(server_mod)
+        with server_mod._schedules_lock:
+            server_mod._save_schedules_locked()
+        claimed = server_mod._due_steps(_tm(7, 0))
+        server_mod._record_step_outcome(claimed[0], False, "Sonos request timed out")
+
+        step = _restart(server_mod)[0]["steps"][0]
+        assert step["attempts"] == 1
+        assert step["last_attempt"] == "2026-08-03"
+        assert step["last_fired"] is None
+        assert step["last_error"]["message"] == "Sonos request timed out"
+
+    def test_a_fired_step_does_not_refire_after_a_restart(self, server_mod):
+        _add(server_mod)
+        with server_mod._schedules_lock:
+            server_mod._save_schedules_locked()
+        for step in server_mod._due_steps(_tm(7, 0)):
+            server_mod._record_step_outcome(step, True, None)
+        _restart(server_mod)
+        assert server_mod._due_steps(_tm(7, 0)) == []
+
+    def test_the_highest_sequence_wins_whatever_the_file_order(self, server_mod):
+        """Two threads can append in the opposite order to the one they
+        changed the step in."""
+        _add(server_mod)
+        with server_mod._schedules_lock:
+            server_mod._save_schedules_locked()
+        identity = [0, "pause", None, None]
+        with open(server_mod.SCHEDULE_STATE_PATH, "w") as f:
+            f.write(json.dumps({"seq": 9, "id": "wake", "index": 0, "step": identity,
+                                "state": {"last_fired": "2026-08-03"}}) + "\n")
+            f.write(json.dumps({"seq": 8, "id": "wake", "index": 0, "step": identity,
+                                "state": {"attempts": 1, "last_attempt": "2026-08-03"}}) + "\n")
+        assert _restart(server_mod)[0]["steps"][0]["last_fired"] == "2026-08-03"
+
+    def test_a_torn_last_line_is_skipped(self, server_mod):
+        _add(server_mod)
+        with server_mod._schedules_lock:
+            server_mod._save_schedules_locked()
+        claimed = server_mod._due_steps(_tm(7, 0))
+        server_mod._record_step_outcome(claimed[0], True, None)
+        with open(server_mod.SCHEDULE_STATE_PATH, "a") as f:
+            f.write('{"seq": 99, "id": "wa')
+        assert _restart(server_mod)[0]["steps"][0]["last_fired"] == "2026-08-03"
+
+    def test_a_record_for_a_step_that_moved_is_not_applied(self, server_mod):
+        _add(server_mod, steps=[{"offset": 0, "action": "pause", "last_fired": None}])
+        with server_mod._schedules_lock:
+            server_mod._save_schedules_locked()
+        with open(server_mod.SCHEDULE_STATE_PATH, "a") as f:
+            f.write(json.dumps({"seq": 50, "id": "wake", "index": 0,
+                                "step": [0, "skip", None, None],
+                                "state": {"last_fired": "2026-08-03"}}) + "\n")
+        assert _restart(server_mod)[0]["steps"][0]["last_fired"] is None
+
+    def test_state_written_inline_before_the_journal_is_kept(self, server_mod):
+        with open(server_mod.SCHEDULES_PATH, "w") as f:
+            json.dump([{"id": "wake", "time": "07:00", "days": [], "enabled": True,
+                        "steps": [{"offset": 0, "action": "pause",
+                                   "last_fired": "2026-08-03"}]}], f)
+        assert _restart(server_mod)[0]["steps"][0]["last_fired"] == "2026-08-03"
+
+
+class TestCompaction:
+    def test_the_definitions_file_carries_no_state(self, server_mod):
+        _add(server_mod)
+        server_mod._due_steps(_tm(7, 0))
+        with server_mod._schedules_lock:
+            server_mod._save_schedules_locked()
+        with open(server_mod.SCHEDULES_PATH) as f:
+            step = json.load(f)[0]["steps"][0]
+        assert "last_attempt" not in step and "attempts" not in step
+
+    def test_an_edit_rewrites_the_journal_one_record_per_step(self, server_mod):
+        _add(server_mod, steps=[
+            {"offset": 0, "action": "pause", "last_fired": None},
+            {"offset": 5, "action": "skip", "last_fired": None},
+        ])
+        server_mod._due_steps(_tm(7, 0))
+        server_mod._due_steps(_tm(7, 5))
+        with server_mod._schedules_lock:
+            server_mod._save_schedules_locked()
+        assert [(r["id"], r["index"]) for r in _journal(server_mod)] == [
+            ("wake", 0), ("wake", 1)]
+
+    def test_the_journal_is_compacted_past_the_threshold(self, server_mod, monkeypatch):
+        monkeypatch.setattr(server_mod, "SCHEDULE_JOURNAL_COMPACT_RECORDS", 4)
+        monkeypatch.setattr(server_mod, "_journal_records", 0)
+        _add(server_mod)
+        with server_mod._schedules_lock:
+            server_mod._save_schedules_locked()
+        for day in range(3, 8):
+            when = datetime.datetime(2026, 8, day, 7, 0).timetuple()
+            for step in server_mod._due_steps(when):
+                server_mod._record_step_outcome(step, True, None)
+        assert len(_journal(server_mod)) < 4
+        assert _restart(server_mod)[0]["steps"][0]["last_fired"] == "2026-08-07"
@@ -0,0 +1,211 @@
+"""Tests for loading scheduled content ahead of its minute.
+
+A scheduled play of a big playlist used to start its ~46-second expansion at
+07:00 and so start playing at about 07:00:46. The load now runs inside a lead
+window before the minute, paused, and only `play` is sent on the minute. What
+has to hold: only content loads are preloaded; the preload sets the volume,
+clears and cues in that order; the play is sent by the ordinary claim on the
+minute, not by a pool worker waiting for it, and only after the step's own
+cue for that run; and a preload that fails costs no attempt and leaves the
+step to load the ordinary way on its minute.
+"""
+import datetime
+import time
+from unittest.mock import patch
+
+import pytest
+
+
+PLAYLIST = "spotify:playlist:37i9dQZF1DXcBWIGoYBM5M"
+
+
+def _dt(hour, minute, second=0, day=3):
+    # 2026-08-03 is a Monday.
+    return datetime.datetime(2026, 8, day, hour, minute, second)
+
+
+def _add(server_mod, steps, time_="07:00"):
+    server_mod._schedules.append({
+        "id": "wake", "time": time_, "days": [], "label": "wake", "enabled": True,
+        "steps": [{"last_fired": None, **s} for s in steps],
+    })
+
+
+def _complete(server_mod, claimed, ok=True):
+    for step in claimed:
+        server_mod._record_step_outcome(step, ok, None if ok else "boom")
+    return claimed
+
+
+class TestWhatIsPreloaded:
+    def test_a_playlist_is_claimed_inside_the_lead_window(self, server_mod):
+        _add(server_mod, [{"offset": 0, "action": "play", "uri": PLAYLIST}])
+        assert server_mod._due_steps(_dt(6, 58, 59).timetuple()) == []
+        claimed = server_mod._due_steps(_dt(6, 59, 0).timetuple())
+        assert len(claimed) == 1 and claimed[0]["_preload"]
+        assert claimed[0]["_due_at"] == "2026-08-03T07:00"
+
+    @pytest.mark.parametrize("step", [
+        {"offset": 0, "action": "play", "uri": "spotify:track:4uLU6hMCjMI75M1A2tKUQC"},
+        {"offset": 0, "action": "volume", "volume": 20},
+        {"offset": 0, "action": "pause"},
+    ])
+    def test_nothing_else_is(self, server_mod, step):
+        _add(server_mod, [step])
+        assert server_mod._due_steps(_dt(6, 59, 30).timetuple()) == []
+        claimed = server_mod._due_steps(_dt(7, 0).timetuple())
+        assert len(claimed) == 1 and not claimed[0].get("_preload")
+
+    def test_a_zero_lead_loads_on_the_minute(self, server_mod, monkeypatch):
+        monkeypatch.setattr(server_mod, "SCHEDULE_PRELOAD_SECONDS", 0)
+        _add(server_mod, [{"offset": 0, "action": "play", "uri": PLAYLIST}])
+        assert server_mod._due_steps(_dt(6, 59, 30).timetuple()) == []
+        assert not server_mod._due_steps(_dt(7, 0).timetuple())[0].get("_preload")
+
+    def test_the_window_crosses_midnight(self, server_mod):
+        _add(server_mod, [{"offset": 0, "action": "play", "uri": PLAYLIST}], "00:00")
+        claimed = server_mod._due_steps(_dt(23, 59, 30, day=2).timetuple())
+        assert claimed[0]["_trigger_date"] == "2026-08-03"
+
+    def test_a_preload_is_not_counted_as_lateness(self, server_mod):
+        _add(server_mod, [{"offset": 0, "action": "play", "uri": PLAYLIST}])
+        server_mod._due_steps(_dt(6, 59, 0).timetuple())
+        assert server_mod._metrics["schedule_lateness_samples"] == 0
+
+    def test_the_volume_step_ahead_of_it_is_carried(self, server_mod):
+        """Otherwise it would run behind the play in the routine's lane,
+        and the alarm would start at last night's volume."""
+        _add(server_mod, [
+            {"offset": 0, "action": "volume", "volume": 12},
+            {"offset": 0, "action": "play", "uri": PLAYLIST},
+        ])
+        claimed = server_mod._due_steps(_dt(6, 59, 0).timetuple())
+        assert claimed[0]["_preload_volume"] == 12
+
+
+class TestTheWake:
+    def test_it_wakes_when_the_window_opens(self, server_mod):
+        _add(server_mod, [{"offset": 0, "action": "play", "uri": PLAYLIST}])
+        lead = server_mod.SCHEDULE_PRELOAD_SECONDS
+        assert server_mod._seconds_until_next_fire(_dt(6, 57)) == 180 - lead
+
+    def test_a_failed_preload_wakes_it_for_the_minute(self, server_mod):
+        _add(server_mod, [{"offset": 0, "action": "play", "uri": PLAYLIST}])
+        [preload] = server_mod._due_steps(_dt(6, 59, 0).timetuple())
+        server_mod._record_preload_outcome(preload, False)
+        assert server_mod._seconds_until_next_fire(_dt(6, 59, 10)) == 50
+        assert server_mod._due_steps(_dt(6, 59, 30).timetuple()) == []
+
+        claimed = server_mod._due_steps(_dt(7, 0).timetuple())
+        assert len(claimed) == 1 and not claimed[0].get("_preload")
+        assert claimed[0]["attempts"] == 1
+
+    def test_a_failed_preload_uses_no_attempt(self, server_mod):
+        _add(server_mod, [{"offset": 0, "action": "play", "uri": PLAYLIST}])
+        [preload] = server_mod._due_steps(_dt(6, 59, 0).timetuple())
+        server_mod._record_preload_outcome(preload, False)
+        step = server_mod._schedules[0]["steps"][0]
+        assert "attempts" not in step and "last_error" not in step
+        assert server_mod._metrics["schedule_failures"] == 0
+
+    def test_a_successful_preload_is_started_on_its_minute(self, server_mod):
+        _add(server_mod, [{"offset": 0, "action": "play", "uri": PLAYLIST}])
+        [preload] = server_mod._due_steps(_dt(6, 59, 0).timetuple())
+        server_mod._record_preload_outcome(preload, True)
+        assert server_mod._seconds_until_next_fire(_dt(6, 59, 10)) == 50
+        [claimed] = server_mod._due_steps(_dt(7, 0).timetuple())
+        assert not claimed.get("_preload")
+        assert claimed["preload"] == {"date": "2026-08-03", "cued": True}
+        _complete(server_mod, [claimed])
+        assert server_mod._seconds_until_next_fire(_dt(7, 0, 1)) > 60
+
+
+class TestFiringAPreload:
+    @pytest.fixture
+    def claim(self, server_mod):
+        def make(**kw):
+            return {"action": "play", "uri": PLAYLIST, "label": "wake",
+                    "_preload": True, "_preload_volume": 12,
+                    "_due_at": "2026-08-03T07:00", **kw}
+        return make
+
+    def test_volume_clear_and_cue_then_play_on_the_minute(self, dj, server_mod, claim):
+        calls = []
+
+        def sonos(endpoint, **kw):
+            calls.append(endpoint)
+            return {"status": "success"}
+
+        with patch.object(server_mod, "_sonos_readiness", return_value=(True, "ok")), \
+                patch.object(dj, "_sonos_request", side_effect=sonos), \
+                patch.object(server_mod._clock, "sleep") as sleep:
+            assert server_mod._fire_schedule(dj, claim()) == (True, None)
+            # Volume, clear and the paused load are the one routineload
+            # request, and nothing waits for the minute.
+            assert calls == [f"routineload/cue/12/{PLAYLIST}"]
+            sleep.assert_not_called()
+
+            on_the_minute = {"action": "play", "uri": PLAYLIST, "label": "wake",
+                             "_trigger_date": "2026-08-03",
+                             "preload": {"date": "2026-08-03", "cued": True}}
+            assert server_mod._fire_schedule(dj, on_the_minute) == (True, None)
+        assert calls[1:] == ["play"]
+
+    def test_sonos_not_ready_costs_no_attempt(self, dj, server_mod):
+        _add(server_mod, [{"offset": 0, "action": "play", "uri": PLAYLIST}])
+        [preload] = server_mod._due_steps(_dt(6, 59, 0).timetuple())
+        with patch.object(server_mod, "_sonos_readiness", return_value=(False, "asleep")):
+            server_mod._run_step(dj, preload)
+        assert server_mod._steps_in_flight == set()
+        assert server_mod._metrics["schedule_failures"] == 0
+        assert "last_error" not in server_mod._schedules[0]["steps"][0]
+
+    def test_sonos_not_ready_fails_before_loading(self, dj, server_mod, claim):
+        with patch.object(server_mod, "_sonos_readiness",
+                          return_value=(False, "error: no zones discovered")), \
+                patch.object(dj, "_sonos_request") as sonos:
+            ok, error = server_mod._fire_schedule(dj, claim())
+        assert not ok and "no zones" in error
+        sonos.assert_not_called()
+
+    def test_a_failed_cue_does_not_play(self, dj, server_mod, claim):
+        with patch.object(server_mod, "_sonos_readiness", return_value=(True, "ok")), \
+                patch.object(dj, "_sonos_request",
+                             return_value={"error": "Cannot reach Sonos"}), \
+                patch.object(dj, "_do_resume") as resume:
+            ok, _ = server_mod._fire_schedule(dj, claim())
+        assert not ok
+        resume.assert_not_called()
+
+    @pytest.mark.parametrize("marker", [
+        None,
+        {"date": "2026-08-02", "cued": True},
+    ])
+    def test_only_its_own_cue_turns_the_play_into_a_resume(self, dj, server_mod, marker):
+        """Another routine cued the same playlist a minute ago, or this
+        step's preload was yesterday's: what is on the speaker is not this
+        run's, so the step loads with its own volume and clear."""
+        server_mod._content_loads[("cue", PLAYLIST)] = {
+            "at": time.monotonic(), "finished": time.monotonic(),
+            "result": {"status": "success"}, "ambiguous": False}
+        step = {"action": "play", "uri": PLAYLIST, "label": "wake", "volume": 20,
+                "_trigger_date": "2026-08-03", "preload": marker}
+        with patch.object(dj, "_sonos_request",
+                          return_value={"status": "playing"}) as sonos, \
+                patch.object(dj, "_do_resume") as resume:
+            ok, _ = server_mod._fire_schedule(dj, step)
+        assert ok
+        resume.assert_not_called()
+        sonos.assert_called_once_with(f"routineload/now/20/{PLAYLIST}",
+                                      timeout=server_mod.SONOS_CONTENT_TIMEOUT)
+
+    def test_a_cue_counts_as_a_content_load(self, server_mod):
+        assert server_mod._is_content_endpoint(f"routineload/cue/-/{PLAYLIST}")
+
+
+def test_the_routineload_action_ships_with_the_others(server_mod):
+    import os
+    action = os.path.join(os.path.dirname(server_mod.__file__),
+                          "sonos-actions", "routineload.js")
+    with open(action) as f:
+        assert "registerAction('routineload'" in f.read()
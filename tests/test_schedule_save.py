@@ -106,7 +106,9 @@ class TestFiredStampSurvivesAnEdit:
         """The end-to-end version of the above, through _due_steps."""
         now = datetime.datetime(2026, 8, 3, 6, 0)  # a Monday
         saved = save_schedule(**WAKE)["schedule"]
-        assert len(server_mod._due_steps(now.timetuple())) == 1
+        # The +0 step on its minute, and the +1 playlist preloading ahead of its.
+        claimed = server_mod._due_steps(now.timetuple())
+        assert [bool(s.get("_preload")) for s in claimed] == [False, True]
 
         save_schedule(**{**WAKE, "id": saved["id"], "label": "renamed mid-fire"})
         assert server_mod._due_steps(now.timetuple()) == []
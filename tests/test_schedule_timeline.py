@@ -0,0 +1,163 @@
+"""Tests for /schedules/timeline.
+
+The page only had each routine's next_run, so there was no way to see the
+coming week of fires across all routines. The timeline is built in bulk from
+the same rules _due_steps uses, and cached until a routine changes. What has
+to hold: it agrees with what actually gets claimed, minute for minute; it
+handles the midnight wrap and the DST gap the same way; and it is not
+rebuilt on every request.
+"""
+import datetime
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+
+
+def _dt(hour, minute, day=3, month=8):
+    # 2026-08-03 is a Monday.
+    return datetime.datetime(2026, month, day, hour, minute)
+
+
+def _add(server_mod, id="wake", time_="07:00", days=None, offsets=(0,), enabled=True):
+    server_mod._schedules.append({
+        "id": id, "time": time_, "days": days or [], "label": id, "enabled": enabled,
+        "steps": [{"offset": o, "action": "pause", "last_fired": None} for o in offsets],
+    })
+
+
+class TestWhatItLists:
+    def test_every_step_on_every_day_in_order(self, server_mod):
+        _add(server_mod, offsets=(0, 30))
+        fires = server_mod._schedule_timeline(2, now=_dt(0, 0))
+        assert [f["at"] for f in fires] == [
+            "2026-08-03T07:00", "2026-08-03T07:30",
+            "2026-08-04T07:00", "2026-08-04T07:30",
+        ]
+        assert fires[1]["offset"] == 30 and fires[1]["action"] == "pause"
+
+    def test_what_has_already_happened_today_is_left_out(self, server_mod):
+        _add(server_mod, offsets=(0, 30))
+        fires = server_mod._schedule_timeline(1, now=_dt(7, 10))
+        assert [f["at"] for f in fires] == ["2026-08-03T07:30"]
+
+    def test_the_minute_in_progress_is_still_listed(self, server_mod):
+        _add(server_mod)
+        now = _dt(7, 0).replace(second=30)
+        assert server_mod._schedule_timeline(1, now=now)[0]["at"] == "2026-08-03T07:00"
+
+    def test_disabled_routines_are_left_out(self, server_mod):
+        _add(server_mod, enabled=False)
+        assert server_mod._schedule_timeline(7, now=_dt(0, 0)) == []
+
+    def test_a_wrapped_step_belongs_to_its_trigger_day(self, server_mod):
+        """A Friday-only 23:50 with a +30m step fires at 00:20 on Saturday,
+        and a window starting on Saturday still has to show it."""
+        _add(server_mod, time_="23:50", days=[4], offsets=(0, 30))
+        fires = server_mod._schedule_timeline(2, now=_dt(0, 0, day=8))
+        assert [(f["at"], f["trigger_date"]) for f in fires] == [
+            ("2026-08-08T00:20", "2026-08-07")]
+
+
+class TestItAgreesWithTheClaim:
+    def test_minute_for_minute_over_two_days(self, server_mod):
+        _add(server_mod, "a", offsets=(0, 45, 1000))
+        _add(server_mod, "b", time_="23:30", days=[0, 2], offsets=(0, 40))
+        _add(server_mod, "c", time_="12:00", days=[1], offsets=(5,))
+        start = _dt(0, 0)
+        listed = {(f["at"], f["id"], f["index"])
+                  for f in server_mod._schedule_timeline(2, now=start)}
+
+        claimed = set()
+        for minute in range(2 * 1440):
+            now = start + datetime.timedelta(minutes=minute)
+            for step in server_mod._due_steps(now.timetuple()):
+                server_mod._record_step_outcome(step, True, None)
+                claimed.add((now.isoformat(timespec="minutes"),
+                             step["_entry_id"], step["_step_index"]))
+        # Monday's 23:30 +40 lands on Tuesday, still inside the window.
+        assert listed == claimed
+
+
+class TestDaylightSaving:
+    @pytest.fixture
+    def london(self):
+        previous = os.environ.get("TZ")
+        os.environ["TZ"] = "Europe/London"
+        time.tzset()
+        yield
+        if previous is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = previous
+        time.tzset()
+
+    def test_a_time_inside_the_spring_gap_is_not_listed(self, server_mod, london):
+        """01:30 does not exist on 2026-03-29 in London, so _due_steps can
+        never match it."""
+        _add(server_mod, time_="01:30")
+        fires = server_mod._schedule_timeline(
+            2, now=datetime.datetime(2026, 3, 29, 0, 0))
+        assert [f["at"] for f in fires] == ["2026-03-30T01:30"]
+
+
+class TestCaching:
+    def test_a_second_request_is_not_rebuilt(self, server_mod):
+        _add(server_mod)
+        with patch.object(server_mod, "_build_timeline_locked",
+                          wraps=server_mod._build_timeline_locked) as build:
+            server_mod._schedule_timeline(7, now=_dt(6, 0))
+            server_mod._schedule_timeline(7, now=_dt(6, 30))
+        assert build.call_count == 1
+
+    def test_two_window_sizes_do_not_evict_each_other(self, server_mod):
+        """The page asks for a week and a widget for a day; alternating
+        used to rebuild on every request."""
+        _add(server_mod)
+        with patch.object(server_mod, "_build_timeline_locked",
+                          wraps=server_mod._build_timeline_locked) as build:
+            for _ in range(3):
+                server_mod._schedule_timeline(7, now=_dt(6, 0))
+                server_mod._schedule_timeline(1, now=_dt(6, 0))
+        assert build.call_count == 2
+
+    def test_a_save_invalidates_it(self, server_mod, save_schedule):
+        save_schedule(time="07:00", days=[], label="x",
+                      steps=[{"offset": 0, "action": "pause"}])
+        assert len(server_mod._schedule_timeline(1, now=_dt(0, 0))) == 1
+        save_schedule(time="08:00", days=[], label="y",
+                      steps=[{"offset": 0, "action": "pause"}])
+        assert len(server_mod._schedule_timeline(1, now=_dt(0, 0))) == 2
+
+    def test_a_new_day_rebuilds_it(self, server_mod):
+        _add(server_mod)
+        first = server_mod._schedule_timeline(1, now=_dt(0, 0))
+        second = server_mod._schedule_timeline(1, now=_dt(0, 0, day=4))
+        assert first[0]["at"] != second[0]["at"]
+
+
+class TestTheEndpoint:
+    def test_it_is_a_view_of_schedules(self, dj, server_mod):
+        _add(server_mod)
+        result = dj.schedules("timeline", days="3")
+        assert result["days"] == 3
+        assert all(f["id"] == "wake" for f in result["fires"])
+
+    def test_days_defaults_to_a_week(self, dj, server_mod):
+        assert dj.schedules("timeline")["days"] == 7
+
+    @pytest.mark.parametrize("days", ["0", "32", "soon"])
+    def test_days_is_bounded(self, dj, server_mod, days):
+        with pytest.raises(server_mod.cherrypy.HTTPError) as exc:
+            dj.schedules("timeline", days=days)
+        assert exc.value.status == 400
+
+    def test_an_unknown_view_is_a_404(self, dj, server_mod):
+        with pytest.raises(server_mod.cherrypy.HTTPError) as exc:
+            dj.schedules("nonsense")
+        assert exc.value.status == 404
+
+    def test_the_plain_list_is_unchanged(self, dj, server_mod):
+        _add(server_mod)
+        assert dj.schedules()["schedules"][0]["id"] == "wake"
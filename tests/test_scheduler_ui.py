@@ -378,6 +378,20 @@ class TestNextRunIsAlwaysVisible:
         body = re.search(r"function nextRunPreview\(time, days\) \{.*?\n  \}", js, re.S).group(0)
         assert "if (when > now) return when;" in body
 
+    def test_what_fires_next_comes_from_the_server_timeline(self, js, markup):
+        """Not recomputed here: the weekday and wrap rules live server-side."""
+        body = re.search(r"function loadComingUp\(\) \{.*?\n  \}", js, re.S).group(0)
+        assert "/schedules/timeline" in body
+        assert "(at.getDay() + 6) % 7" in body
+        assert 'id="sched-next"' in markup
+        assert "loadComingUp();" in js
+
+    def test_coming_up_does_not_build_script_from_an_id(self, js):
+        """A routine id inside an onclick string could close the string."""
+        body = re.search(r"function loadComingUp\(\) \{.*?\n  \}", js, re.S).group(0)
+        assert "+ f.id +" not in body
+        assert "escapeHtml(f.id)" in body and "this.dataset.id" in body
+
     def test_empty_days_previews_as_every_day(self, js):
         body = re.search(r"function nextRunPreview\(time, days\) \{.*?\n  \}", js, re.S).group(0)
         assert "[0, 1, 2, 3, 4, 5, 6]" in body
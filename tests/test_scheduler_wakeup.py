@@ -0,0 +1,225 @@
+"""Tests for the sleep-until-due scheduler.
+
+The scheduler used to poll every 20 seconds, which made a 07:00 alarm up to
+20 seconds late and woke the process thousands of times a day for nothing.
+It now sleeps until the next fire time. What has to hold: it wakes at the
+minute a step is due, never later; it never sleeps past a step that
+_due_steps would claim; it does not spin on a step already claimed; and a
+routine saved while it sleeps cuts the sleep short.
+"""
+import datetime
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+
+def _dt(hour, minute, second=0, day=3):
+    # 2026-08-03 is a Monday.
+    return datetime.datetime(2026, 8, day, hour, minute, second)
+
+
+def _tm(moment):
+    return moment.timetuple()
+
+
+def _add(server_mod, steps=None, **kw):
+    entry = {
+        "id": kw.get("id", "sch_test"),
+        "time": kw.get("time", "07:00"),
+        "days": kw.get("days", []),
+        "label": "test",
+        "enabled": kw.get("enabled", True),
+        "steps": steps or [{"offset": 0, "action": "pause", "last_fired": None}],
+    }
+    server_mod._schedules.append(entry)
+    return entry
+
+
+def _complete(server_mod, claimed, ok=True):
+    for step in claimed:
+        server_mod._record_step_outcome(step, ok, None if ok else "Sonos request timed out")
+    return claimed
+
+
+class TestSleepLength:
+    def test_it_sleeps_until_the_trigger_minute(self, server_mod):
+        _add(server_mod, time="07:00")
+        assert server_mod._seconds_until_next_fire(_dt(6, 58, 30)) == 90
+
+    def test_nothing_armed_sleeps_the_maximum(self, server_mod):
+        assert (server_mod._seconds_until_next_fire(_dt(6, 0))
+                == server_mod.SCHEDULE_MAX_SLEEP_SECONDS)
+
+    def test_a_distant_step_is_capped(self, server_mod):
+        """A clock jump is only noticed on waking, so no sleep is unbounded."""
+        _add(server_mod, time="07:00")
+        assert (server_mod._seconds_until_next_fire(_dt(1, 0))
+                == server_mod.SCHEDULE_MAX_SLEEP_SECONDS)
+
+    def test_disabled_routines_do_not_wake_it(self, server_mod):
+        _add(server_mod, time="07:00", enabled=False)
+        assert (server_mod._seconds_until_next_fire(_dt(6, 59))
+                == server_mod.SCHEDULE_MAX_SLEEP_SECONDS)
+
+    def test_a_later_step_is_the_next_wake_once_the_first_is_claimed(self, server_mod):
+        _add(server_mod, time="07:00", steps=[
+            {"offset": 0, "action": "pause", "last_fired": None},
+            {"offset": 3, "action": "skip", "last_fired": None},
+        ])
+        _complete(server_mod, server_mod._due_steps(_tm(_dt(7, 0))))
+        assert server_mod._seconds_until_next_fire(_dt(7, 0, 1)) == 179
+
+    def test_a_routine_saved_mid_minute_is_due_now(self, server_mod):
+        """The poll would have caught it on its next tick inside the minute,
+        so sleeping until tomorrow would be a regression."""
+        _add(server_mod, time="07:00")
+        assert server_mod._seconds_until_next_fire(_dt(7, 0, 30)) < 0.1
+
+    def test_a_claimed_step_does_not_keep_it_awake(self, server_mod):
+        """Without the claim check the step's own minute would read as due
+        for the rest of that minute, and the thread would spin."""
+        _add(server_mod, time="07:00")
+        _complete(server_mod, server_mod._due_steps(_tm(_dt(7, 0))))
+        assert server_mod._seconds_until_next_fire(_dt(7, 0, 1)) > 60
+
+    def test_an_open_retry_window_is_rechecked_at_the_tick(self, server_mod):
+        _add(server_mod, time="07:00")
+        _complete(server_mod, server_mod._due_steps(_tm(_dt(7, 0))), ok=False)
+        assert (server_mod._seconds_until_next_fire(_dt(7, 0, 5))
+                == server_mod.SCHEDULE_TICK_SECONDS)
+
+    def test_an_in_flight_step_is_rechecked_at_the_tick(self, server_mod):
+        """It may fail into its retry window, and nothing else would wake
+        the thread in time to retry it."""
+        _add(server_mod, time="07:00")
+        server_mod._due_steps(_tm(_dt(7, 0)))        # claimed, never reported
+        assert (server_mod._seconds_until_next_fire(_dt(7, 0, 5))
+                == server_mod.SCHEDULE_TICK_SECONDS)
+
+
+class TestItAgreesWithTheClaim:
+    """The sleep is computed separately from the claim, so the property worth
+    checking is that they agree: waking when told always finds the step."""
+
+    @pytest.mark.parametrize("trigger,days,steps", [
+        ("07:00", [], [0, 0, 10, 60]),
+        ("23:50", [4], [0, 30]),                 # Friday only, wraps midnight
+        ("06:30", [0, 1, 2, 3, 4], [0, 45]),     # weekdays, from a Saturday
+        ("00:00", [6], [0, 720]),
+    ])
+    def test_every_wake_claims_something(self, server_mod, trigger, days, steps):
+        _add(server_mod, time=trigger, days=days, steps=[
+            {"offset": o, "action": "pause", "last_fired": None} for o in steps])
+        now = _dt(12, 0, day=1)                  # Saturday noon
+        end = now + datetime.timedelta(days=8)
+        claimed = 0
+        while now < end:
+            sleep = server_mod._seconds_until_next_fire(now)
+            now += datetime.timedelta(seconds=sleep)
+            due = _complete(server_mod, server_mod._due_steps(_tm(now)))
+            claimed += len(due)
+            if sleep < server_mod.SCHEDULE_MAX_SLEEP_SECONDS:
+                # Only a capped sleep may wake to nothing.
+                assert due, f"woke at {now} and found nothing due"
+        # Every step of at least one run, whichever routine it is.
+        assert claimed >= len(steps)
+
+
+class TestLateness:
+    def test_a_first_attempt_records_its_lateness(self, server_mod):
+        _add(server_mod, time="07:00")
+        server_mod._due_steps(_tm(_dt(7, 0, 12)))
+        assert server_mod._metrics["schedule_lateness_samples"] == 1
+        assert server_mod._metrics["schedule_lateness_seconds_max"] == 12
+
+    def test_a_retry_is_not_counted_as_lateness(self, server_mod):
+        """A retry two minutes on is the retry window working, not the
+        scheduler waking late."""
+        _add(server_mod, time="07:00")
+        _complete(server_mod, server_mod._due_steps(_tm(_dt(7, 0))), ok=False)
+        assert len(server_mod._due_steps(_tm(_dt(7, 2)))) == 1
+        assert server_mod._metrics["schedule_lateness_samples"] == 1
+        assert server_mod._metrics["schedule_lateness_seconds_max"] == 0
+
+    def test_the_claim_carries_its_due_time(self, server_mod):
+        _add(server_mod, time="23:50", steps=[
+            {"offset": 30, "action": "pause", "last_fired": None}])
+        due = server_mod._due_steps(_tm(_dt(0, 20, day=4)))
+        assert due[0]["_due_at"] == "2026-08-04T00:20"
+
+    def test_metrics_reports_the_average(self, dj, server_mod):
+        server_mod._metrics.update({
+            "schedule_lateness_samples": 4,
+            "schedule_lateness_seconds_total": 2.0,
+            "schedule_lateness_seconds_max": 1.5,
+        })
+        result = dj.metrics()
+        assert result["schedule_lateness_seconds_avg"] == 0.5
+        assert result["schedule_lateness_seconds_max"] == 1.5
+
+
+class TestWakingEarly:
+    @pytest.fixture
+    def saved(self, save_schedule):
+        return lambda: save_schedule(time="07:00", days=[], label="x",
+                                     steps=[{"offset": 0, "action": "pause"}])
+
+    def test_saving_a_routine_wakes_the_scheduler(self, server_mod, saved):
+        server_mod._schedules_changed.clear()
+        saved()
+        assert server_mod._schedules_changed.is_set()
+
+    def test_deleting_and_toggling_wake_it_too(self, dj, server_mod, saved):
+        sid = saved()["schedule"]["id"]
+        server_mod._schedules_changed.clear()
+        dj.schedule_toggle(id=sid)
+        assert server_mod._schedules_changed.is_set()
+        server_mod._schedules_changed.clear()
+        dj.schedule_delete(id=sid)
+        assert server_mod._schedules_changed.is_set()
+
+
+class TestThePlugin:
+    def test_a_wake_cuts_the_sleep_short_and_stop_ends_it(self, dj, server_mod):
+        ticks = []
+        second_tick = threading.Event()
+
+        def tick(_):
+            ticks.append(time.monotonic())
+            if len(ticks) >= 2:
+                second_tick.set()
+
+        plugin = server_mod._Scheduler(MagicMock(), dj)
+        with patch.object(server_mod, "run_due_schedules", side_effect=tick), \
+                patch.object(server_mod, "_seconds_until_next_fire", return_value=3600):
+            plugin.start()
+            try:
+                deadline = time.monotonic() + 5
+                while not ticks and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                server_mod._wake_scheduler()
+                assert second_tick.wait(5), "a save did not wake the scheduler"
+            finally:
+                plugin.stop()
+        assert plugin.thread is None
+
+    def test_a_failing_wake_computation_does_not_kill_the_thread(self, dj, server_mod, caplog):
+        import logging
+        ran = threading.Event()
+        plugin = server_mod._Scheduler(MagicMock(), dj)
+        with caplog.at_level(logging.ERROR, logger="dj"), \
+                patch.object(server_mod, "run_due_schedules", side_effect=lambda _: ran.set()), \
+                patch.object(server_mod, "_seconds_until_next_fire",
+                             side_effect=RuntimeError("boom")):
+            plugin.start()
+            try:
+                assert ran.wait(5)
+                deadline = time.monotonic() + 5
+                while "boom" not in caplog.text and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                assert plugin.thread.is_alive()
+            finally:
+                plugin.stop()
+        assert "boom" in caplog.text
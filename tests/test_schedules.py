@@ -4,6 +4,7 @@ The failure modes that matter for something firing unattended at 07:00:
 firing twice, firing on the wrong day, firing hours late after a restart, one
 bad entry stopping every other alarm, and the whole ticker dying silently.
 """
+import concurrent.futures
 import datetime
 import json
 import os
@@ -122,70 +123,84 @@ class TestDays:
 
 
 class TestFiring:
-    def test_play_sets_volume_before_playing(self, dj, server_mod):
+    def test_play_is_one_request_with_the_volume_first(self, dj, server_mod):
         """A morning alarm must not blast at whatever level last night ended
-        on, so volume has to be set first."""
-        calls = []
-        with patch.object(dj, "_do_volume", side_effect=lambda **k: calls.append("volume")):
-            with patch.object(dj, "_do_play", side_effect=lambda **k: calls.append("play")):
-                server_mod._fire_schedule(dj, {
-                    "action": "play", "uri": "spotify:playlist:abc",
-                    "volume": 25, "label": "morning",
-                })
-        assert calls == ["volume", "play"]
+        on, so the volume travels with the load and routineload applies it
+        first. One request rather than three: each could fail on its own."""
+        with patch.object(dj, "_sonos_request", return_value={"status": "playing"}) as sonos:
+            server_mod._fire_schedule(dj, {
+                "action": "play", "uri": "spotify:playlist:abc",
+                "volume": 25, "label": "morning",
+            })
+        assert [c.args[0] for c in sonos.call_args_list] == [
+            "routineload/now/25/spotify:playlist:abc"]
 
     def test_play_without_volume_does_not_touch_it(self, dj, server_mod):
-        with patch.object(dj, "_do_volume") as vol:
-            with patch.object(dj, "_do_play"):
-                server_mod._fire_schedule(dj, {
-                    "action": "play", "uri": "spotify:playlist:abc", "label": "x",
-                })
-        vol.assert_not_called()
-
-    def test_play_clears_the_queue_first(self, dj, server_mod):
-        """spotify/now inserts rather than replaces, so without the clear
-        every routine piled onto the previous event's queue."""
-        calls = []
-        with patch.object(dj, "_do_volume", side_effect=lambda **k: calls.append("volume")):
-            with patch.object(dj, "_do_clearqueue", side_effect=lambda: calls.append("clear")):
-                with patch.object(dj, "_do_play", side_effect=lambda **k: calls.append("play")):
-                    server_mod._fire_schedule(dj, {
-                        "action": "play", "uri": "spotify:playlist:abc",
-                        "volume": 25, "label": "morning",
-                    })
-        assert calls == ["volume", "clear", "play"]
+        with patch.object(dj, "_sonos_request", return_value={"status": "playing"}) as sonos:
+            server_mod._fire_schedule(dj, {
+                "action": "play", "uri": "spotify:playlist:abc", "label": "x",
+            })
+        assert sonos.call_args.args[0] == "routineload/now/-/spotify:playlist:abc"
 
     def test_a_failed_clear_does_not_block_the_alarm(self, dj, server_mod, caplog):
-        """The alarm going off matters more than the queue being tidy."""
+        """The alarm going off matters more than the queue being tidy. The
+        action reports the failed clear alongside the load that went ahead."""
         import logging
         with caplog.at_level(logging.WARNING, logger="dj"):
-            with patch.object(dj, "_do_clearqueue", return_value={"error": "boom"}):
-                with patch.object(dj, "_do_play", return_value={"status": "playing"}) as play:
-                    ok, error = server_mod._fire_schedule(dj, {
-                        "action": "play", "uri": "spotify:playlist:abc", "label": "morning",
-                    })
-        play.assert_called_once()
+            with patch.object(dj, "_sonos_request",
+                              return_value={"status": "playing", "clearError": "boom"}):
+                ok, error = server_mod._fire_schedule(dj, {
+                    "action": "play", "uri": "spotify:playlist:abc", "label": "morning",
+                })
         assert ok and error is None
-        assert "clearqueue" in caplog.text
+        assert "clearqueue" in caplog.text and "boom" in caplog.text
+
+    def test_a_failed_volume_does_not_block_the_alarm(self, dj, server_mod, caplog):
+        import logging
+        with caplog.at_level(logging.WARNING, logger="dj"):
+            with patch.object(dj, "_sonos_request",
+                              return_value={"status": "playing", "volumeError": "fixed"}):
+                ok, _ = server_mod._fire_schedule(dj, {
+                    "action": "play", "uri": "spotify:playlist:abc",
+                    "volume": 25, "label": "morning",
+                })
+        assert ok
+        assert "volume" in caplog.text
+
+    def test_a_failed_load_fails_the_step(self, dj, server_mod):
+        with patch.object(dj, "_sonos_request",
+                          return_value={"error": "Cannot reach Sonos API"}):
+            ok, error = server_mod._fire_schedule(dj, {
+                "action": "play", "uri": "spotify:playlist:abc", "label": "x"})
+        assert not ok and error == "Cannot reach Sonos API"
 
     def test_the_clear_is_skipped_while_an_identical_load_is_unsettled(self, dj, server_mod):
         """A retry after a timed-out load must not wipe the queue: the load
         may still land on the speaker, and _content_load's dedupe will refuse
         to send it again -- clearing here would turn a late success into
-        silence."""
+        silence. The volume still goes out on its own."""
         uri = "spotify:playlist:abc"
         server_mod._content_loads[("now", uri)] = {
             "at": time.monotonic(), "finished": None,
             "result": None, "ambiguous": False,
         }
-        try:
-            with patch.object(dj, "_do_clearqueue") as clear:
-                with patch.object(dj, "_do_play"):
-                    server_mod._fire_schedule(
-                        dj, {"action": "play", "uri": uri, "label": "x"})
-            clear.assert_not_called()
-        finally:
-            server_mod._content_loads.pop(("now", uri), None)
+        with patch.object(dj, "_sonos_request", return_value={"ok": True}) as sonos:
+            server_mod._fire_schedule(
+                dj, {"action": "play", "uri": uri, "volume": 25, "label": "x"})
+        assert [c.args[0] for c in sonos.call_args_list] == ["volume/25"]
+
+    @pytest.mark.parametrize("mode", ["now", "cue"])
+    def test_an_entry_that_ages_out_mid_step_still_sends_a_routine_load(
+            self, dj, server_mod, mode):
+        """Deduped when checked, gone by the time the load is made: what goes
+        out must be the composite -- spotify/cue is not a route, and a plain
+        spotify/now would queue behind what is there."""
+        uri = "spotify:playlist:abc"
+        with patch.object(server_mod, "_load_is_deduped", return_value=True), \
+                patch.object(dj, "_sonos_request", return_value={"status": "ok"}) as sonos:
+            server_mod._load_for_routine(dj, mode, uri, 25, "x")
+        assert [c.args[0] for c in sonos.call_args_list] == [
+            "volume/25", f"routineload/{mode}/25/{uri}"]
 
     def test_a_stale_dedupe_entry_does_not_suppress_the_clear(self, dj, server_mod):
         """Yesterday's load of the same playlist is long settled; only a
@@ -195,14 +210,20 @@ class TestFiring:
             "at": time.monotonic() - server_mod.CONTENT_DEDUP_SECONDS - 1,
             "finished": None, "result": None, "ambiguous": True,
         }
-        try:
-            with patch.object(dj, "_do_clearqueue") as clear:
-                with patch.object(dj, "_do_play"):
-                    server_mod._fire_schedule(
-                        dj, {"action": "play", "uri": uri, "label": "x"})
-            clear.assert_called_once()
-        finally:
-            server_mod._content_loads.pop(("now", uri), None)
+        with patch.object(dj, "_sonos_request", return_value={"status": "playing"}) as sonos:
+            server_mod._fire_schedule(
+                dj, {"action": "play", "uri": uri, "label": "x"})
+        assert sonos.call_args.args[0] == f"routineload/now/-/{uri}"
+
+    def test_the_composite_load_is_deduped_like_a_plain_one(self, dj, server_mod):
+        """A scheduled retry of a load that timed out must not queue the
+        playlist a second time."""
+        uri = "spotify:playlist:abc"
+        with patch.object(dj, "_sonos_request",
+                          return_value={"error": server_mod.SONOS_TIMEOUT_ERROR}) as sonos:
+            server_mod._fire_schedule(dj, {"action": "play", "uri": uri, "label": "x"})
+            server_mod._fire_schedule(dj, {"action": "play", "uri": uri, "label": "x"})
+        assert sonos.call_count == 1
 
     @pytest.mark.parametrize("action,method", [
         ("pause", "_do_pause"), ("resume", "_do_resume"),
@@ -227,13 +248,14 @@ class TestFiring:
         """One malformed schedule must not take the whole ticker down.
 
         run_due_schedules reads the real clock, so the time is pinned to the
-        minute both entries are set for.
+        minute both entries are set for. Steps run on the step pool, so the
+        tick's futures are waited on before the patches come off.
         """
         _add(server_mod, id="bad", time="07:00", action="nonsense")
         _add(server_mod, id="good", time="07:00", action="pause")
         with patch.object(server_mod.time, "localtime", return_value=_tm(7, 0)):
             with patch.object(dj, "_do_pause") as ok:
-                server_mod.run_due_schedules(dj)
+                concurrent.futures.wait(server_mod.run_due_schedules(dj), timeout=10)
         ok.assert_called_once()
 
     def test_broken_entry_first_still_lets_later_ones_run(self, dj, server_mod):
@@ -242,7 +264,7 @@ class TestFiring:
         _add(server_mod, id="good", time="07:00", action="skip")
         with patch.object(server_mod.time, "localtime", return_value=_tm(7, 0)):
             with patch.object(dj, "_do_skip") as ok:
-                server_mod.run_due_schedules(dj)
+                concurrent.futures.wait(server_mod.run_due_schedules(dj), timeout=10)
         ok.assert_called_once()
 
     def test_tick_survives_an_unexpected_error(self, dj, server_mod, caplog):
@@ -251,7 +273,7 @@ class TestFiring:
         import logging
         with patch.object(server_mod, "_due_steps", side_effect=RuntimeError("boom")):
             with caplog.at_level(logging.INFO, logger="dj"):
-                server_mod.run_due_schedules(dj)   # must not raise
+                assert server_mod.run_due_schedules(dj) == []   # must not raise
         assert "boom" in caplog.text
 
 
@@ -0,0 +1,104 @@
+"""Tests for the search response cache.
+
+Every guest who typed "beatles" cost a Spotify search, though the answer is
+the same for all of them for minutes at a time. Raw responses are now shared
+across sessions, keyed by the normalised query, the type and the limit. What
+has to hold: spellings that Spotify treats alike share an entry and nothing
+else does; a search that found nothing is kept, but for less time; an error
+is never kept; and each session still numbers its own results.
+"""
+from unittest.mock import patch
+
+import pytest
+from spotipy.exceptions import SpotifyException
+
+
+def _tracks(*names):
+    return {"tracks": {"items": [
+        {"name": name, "artists": [{"name": "The Beatles"}],
+         "album": {"name": "Abbey Road"}, "uri": f"spotify:track:{name}"}
+        for name in names]}}
+
+
+@pytest.fixture
+def sp(server_mod, inline):
+    server_mod._search_cache.executor = inline
+    with patch.object(server_mod, "sp") as sp:
+        yield sp
+
+
+class TestSharing:
+    def test_sessions_share_the_response_but_not_the_results(self, dj, server_mod, sp, clock):
+        sp.search.return_value = _tracks("Something")
+        dj._do_search(q="Beatles", session_id="a")
+        dj._do_search(q="  beatles ", session_id="b")
+        assert sp.search.call_count == 1
+        assert server_mod.get_results("a") == server_mod.get_results("b")
+        assert server_mod.get_results("a") is not server_mod.get_results("b")
+
+    @pytest.mark.parametrize("second", [
+        {"q": "beatles", "type": "album"},
+        {"q": "beatles", "limit": 7},
+        {"q": "beatle"},
+    ])
+    def test_a_different_search_is_its_own_entry(self, dj, sp, clock, second):
+        sp.search.side_effect = lambda q, type, limit: \
+            _tracks("Something") if type == "track" else {"albums": {"items": []}}
+        dj._do_search(q="beatles")
+        dj._do_search(**second)
+        assert sp.search.call_count == 2
+
+    def test_a_uri_shaped_query_is_not_cut_down(self, server_mod):
+        assert server_mod._search_arg("spotify:track:ABC") == "spotify:track:abc"
+
+    def test_a_fresh_response_makes_no_call(self, dj, sp, clock):
+        sp.search.return_value = _tracks("Something")
+        dj._do_search(q="beatles")
+        clock.at += 299
+        dj._do_search(q="beatles")
+        assert sp.search.call_count == 1
+
+
+class TestNegativeCaching:
+    def test_nothing_found_is_kept_for_less(self, dj, server_mod, sp, clock):
+        sp.search.return_value = _tracks()
+        dj._do_search(q="beatels")
+        clock.at += server_mod.SEARCH_CACHE_EMPTY_TTL_SECONDS - 1
+        assert dj._do_search(q="beatels")["results"] == []
+        assert sp.search.call_count == 1
+        assert server_mod._search_cache.stats["empty_hits"] == 1
+
+        clock.at += 2
+        sp.search.return_value = _tracks("Something")
+        dj._do_search(q="beatels")
+        assert sp.search.call_count == 2
+        assert dj._do_search(q="beatels")["results"][0]["name"] == "Something"
+
+    @pytest.mark.parametrize("response,empty", [
+        ({"tracks": {"items": []}}, True),
+        ({"playlists": {"items": [None, None]}}, True),
+        ({"tracks": {"items": []}, "albums": {"items": [{"name": "x"}]}}, False),
+        ({"tracks": {"items": [{"name": "x"}]}}, False),
+        ({}, False),
+    ])
+    def test_what_counts_as_empty(self, server_mod, response, empty):
+        assert server_mod._is_empty_response(response) is empty
+
+    def test_an_error_is_not_kept(self, dj, sp, clock):
+        sp.search.side_effect = SpotifyException(429, -1, "slow down")
+        with pytest.raises(Exception):
+            dj._do_search(q="beatles")
+        sp.search.side_effect = None
+        sp.search.return_value = _tracks("Something")
+        assert dj._do_search(q="beatles")["results"][0]["name"] == "Something"
+        assert sp.search.call_count == 2
+
+
+def test_the_hit_ratio_is_in_metrics(dj, server_mod, sp):
+    sp.search.return_value = _tracks("Something")
+    dj._do_search(q="beatles")
+    dj._do_search(q="BEATLES")
+    result = dj.metrics()
+    assert result["search_cache_entries"] == 1
+    assert result["search_cache_hit_ratio"] == 0.5
+    assert result["search_cache_max_entries"] == server_mod.SEARCH_CACHE_ENTRIES
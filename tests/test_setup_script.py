@@ -104,6 +104,7 @@ class TestBehaviour:
         installed = os.listdir(target / "lib" / "actions")
         assert "queueedit.js" in installed
         assert "relvolume.js" in installed
+        assert "routineload.js" in installed
 
     def test_it_writes_a_usable_webhook(self, tmp_path):
         repo, target = self._repo(tmp_path, self.VALID), self._target(tmp_path)
@@ -0,0 +1,163 @@
+"""Accelerated-clock soak test of the scheduler and the expiring caches.
+
+Months of uptime are where leaks and drift show up, and none of this can be
+waited out in real time. The scheduler, search results, the content-load
+dedupe table and the chat rate limiter all read the time through
+server._clock, so this swaps in a clock it winds forward itself and drives
+the scheduler loop the way _Scheduler.run does -- sleep until due, tick --
+with webhooks and guest traffic in between, against local stubs for Sonos.
+
+What has to hold across the whole run: every step fires exactly once per
+run and none fires twice; the per-session and per-load structures stay
+under their caps; and a tick on the last day costs what one on the first did.
+
+Three simulated days by default, which takes a second or two. For the long
+run:
+
+    DJ_SOAK_DAYS=90 python -m pytest -q tests/test_soak.py
+"""
+import concurrent.futures
+import datetime
+import json
+import os
+import statistics
+import time
+import tracemalloc
+
+import cherrypy
+import pytest
+
+
+SOAK_DAYS = int(os.environ.get("DJ_SOAK_DAYS", "3"))
+# 2026-08-03 is a Monday.
+START = datetime.datetime(2026, 8, 3, 0, 0)
+PLAYLISTS = [f"spotify:playlist:soak{i:04d}" for i in range(40)]
+
+
+def _sonos_stub(endpoint, timeout=None):
+    if endpoint == "state":
+        return {"currentTrack": {"title": "Soak", "artist": "Test", "uri": "x-sonos"},
+                "volume": 20, "playbackState": "PLAYING", "elapsedTime": 1}
+    return {"status": "success"}
+
+
+class _Body:
+    """A request body that can be read any number of times."""
+
+    def __init__(self, payload):
+        self.payload = json.dumps(payload).encode()
+
+    def read(self, limit=None):
+        return self.payload
+
+
+@pytest.fixture
+def routines(server_mod):
+    server_mod._schedules[:] = [
+        {"id": "weekday", "time": "07:00", "days": [0, 1, 2, 3, 4], "label": "wake",
+         "enabled": True, "steps": [
+             {"offset": 0, "action": "volume", "volume": 12, "last_fired": None},
+             {"offset": 0, "action": "play", "uri": PLAYLISTS[0], "last_fired": None},
+             {"offset": 10, "action": "volume", "volume": 22, "last_fired": None},
+             {"offset": 60, "action": "pause", "last_fired": None},
+         ]},
+        {"id": "nightly", "time": "23:50", "days": [], "label": "wind down",
+         "enabled": True, "steps": [
+             {"offset": 0, "action": "play", "uri": PLAYLISTS[1], "last_fired": None},
+             {"offset": 30, "action": "pause", "last_fired": None},
+         ]},
+        {"id": "weekend", "time": "09:30", "days": [5, 6], "label": "brunch",
+         "enabled": True, "steps": [
+             {"offset": 0, "action": "play",
+              "uri": "spotify:track:4uLU6hMCjMI75M1A2tKUQC", "last_fired": None},
+         ]},
+    ]
+    with server_mod._schedules_lock:
+        server_mod._save_schedules_locked()
+
+
+def _guest_traffic(server_mod, dj, clock, n):
+    """One burst of the things visitors and the speaker do between ticks."""
+    session = f"guest-{int(clock.at)}"
+    server_mod.set_results([{"num": 1, "uri": PLAYLISTS[2]}], session)
+    server_mod.get_results(session)
+    try:
+        server_mod._check_chat_rate(session)
+    except cherrypy.HTTPError:
+        pass
+    dj._content_load("queue", PLAYLISTS[n % len(PLAYLISTS)])
+    dj.sonos_event()
+
+
+def test_months_of_ticks(dj, server_mod, routines, clock, monkeypatch):
+    clock.at = START.timestamp()
+    monkeypatch.setattr(server_mod, "_chat_calls", {})
+    monkeypatch.setattr(server_mod, "search_results", {})
+    monkeypatch.setattr(cherrypy.request, "body", _Body({"type": "transport-state"}),
+                        raising=False)
+    end = START + datetime.timedelta(days=SOAK_DAYS)
+
+    fired = []
+    real_record = server_mod._record_step_outcome
+
+    def record(claimed, ok, error):
+        if ok:
+            fired.append((claimed["_entry_id"], claimed["_step_index"],
+                          claimed["_trigger_date"], claimed["_due_at"]))
+        return real_record(claimed, ok, error)
+
+    # Plain functions, not Mocks: a Mock keeps every call, which over a
+    # simulated season is a leak of the test's own making.
+    monkeypatch.setattr(dj, "_sonos_request", _sonos_stub)
+    monkeypatch.setattr(server_mod, "_sonos_readiness", lambda: (True, "ok"))
+    monkeypatch.setattr(server_mod, "_record_step_outcome", record)
+
+    first_day, last_day = [], []
+    traced = {}
+    tracemalloc.start()
+    try:
+        ticks = 0
+        while clock.now() < end:
+            started = time.perf_counter()
+            clock.at += server_mod._seconds_until_next_fire()
+            futures = server_mod.run_due_schedules(dj)
+            concurrent.futures.wait(futures, timeout=10)
+            elapsed = time.perf_counter() - started
+            day = (clock.now() - START).days
+            if day == 0:
+                first_day.append(elapsed)
+            elif day not in traced:
+                last_day = [elapsed]
+            else:
+                last_day.append(elapsed)
+
+            ticks += 1
+            _guest_traffic(server_mod, dj, clock, ticks)
+            if day not in traced:
+                traced[day] = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    # Exactly once per run: what fired is what the timeline says should have.
+    assert len(fired) == len(set(f[:3] for f in fired)), "a step fired twice"
+    with server_mod._schedules_lock:
+        expected = server_mod._build_timeline_locked(START.date(), SOAK_DAYS)
+    assert ({(f["id"], f["index"], f["trigger_date"]) for f in expected}
+            == {f[:3] for f in fired if f[3] < end.isoformat(timespec="minutes")})
+
+    # Bounded, however many guests came and went.
+    assert len(server_mod.search_results) <= server_mod.MAX_SEARCH_SESSIONS
+    assert len(server_mod._chat_calls) <= server_mod.MAX_CHAT_SESSIONS
+    assert len(server_mod._content_loads) <= len(PLAYLISTS)
+    assert server_mod._steps_in_flight == set()
+    assert server_mod._step_lanes == {}
+    assert all(len(h) <= server_mod.SCHEDULE_HISTORY_PER_STEP
+               for h in server_mod._step_history.values())
+    with open(server_mod.SCHEDULE_STATE_PATH) as f:
+        assert sum(1 for _ in f) <= server_mod.SCHEDULE_JOURNAL_COMPACT_RECORDS
+    # Generous: allocator noise, not growth proportional to days run.
+    last = max(traced)
+    assert traced[last] - traced[min(traced)] < 2 * 1024 * 1024
+
+    # Flat: the last day's typical tick costs about what the first day's did.
+    assert statistics.median(last_day) <= statistics.median(first_day) * 3 + 0.002
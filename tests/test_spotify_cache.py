@@ -0,0 +1,226 @@
+"""Tests for the Spotify metadata cache.
+
+Expanding an album, listing the current album and "more by this artist"
+refetched metadata that does not change, each time spending the rate limit.
+What has to hold: a fresh entry is served without a call; an expired one is
+served at once and refreshed behind the caller's back, once, and not past a
+bound however often the refresh fails; a burst of misses for one key makes
+one call, and they all get its result or its error; the entry count is
+bounded, dropping the least recently used; and different spellings of one
+id share an entry.
+"""
+import concurrent.futures
+import threading
+from unittest.mock import patch
+
+import pytest
+from spotipy.exceptions import SpotifyException
+
+
+@pytest.fixture
+def sp(server_mod):
+    with patch.object(server_mod, "sp") as sp:
+        yield sp
+
+
+@pytest.fixture
+def make_cache(server_mod, inline):
+    def make(executor=None, max_entries=10):
+        return server_mod._MetadataCache({"album": 60, "track": 60}, max_entries,
+                                         executor or inline)
+    return make
+
+
+class TestFreshAndStale:
+    def test_a_fresh_entry_makes_no_call(self, sp, clock, make_cache):
+        cache = make_cache()
+        sp.album.return_value = {"name": "Rumours"}
+        assert cache.get("album", "abc") == {"name": "Rumours"}
+        clock.at += 59
+        assert cache.get("album", "abc") == {"name": "Rumours"}
+        assert sp.album.call_count == 1
+        assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+    def test_a_stale_entry_is_served_then_refreshed(self, sp, clock, make_cache):
+        cache = make_cache()
+        sp.album.return_value = {"name": "old"}
+        cache.get("album", "abc")
+        clock.at += 61
+        sp.album.return_value = {"name": "new"}
+        assert cache.get("album", "abc") == {"name": "old"}
+        assert cache.get("album", "abc") == {"name": "new"}
+        assert cache.stats["stale_hits"] == 1 and cache.stats["refreshes"] == 1
+
+    def test_a_stale_entry_does_not_wait_for_its_refresh(self, sp, clock, make_cache):
+        release = threading.Event()
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        cache = make_cache(executor=pool)
+        sp.album.return_value = {"name": "old"}
+        cache.get("album", "abc")
+        clock.at += 61
+
+        def slow(_):
+            release.wait(5)
+            return {"name": "new"}
+        sp.album.side_effect = slow
+        try:
+            assert cache.get("album", "abc") == {"name": "old"}
+            assert cache.get("album", "abc") == {"name": "old"}
+        finally:
+            release.set()
+            pool.shutdown(wait=True)
+        # One refresh for two stale reads.
+        assert sp.album.call_count == 2
+        assert cache.get("album", "abc") == {"name": "new"}
+
+    def test_a_failed_refresh_keeps_the_stale_entry(self, sp, clock, make_cache):
+        cache = make_cache()
+        sp.album.return_value = {"name": "old"}
+        cache.get("album", "abc")
+        clock.at += 61
+        sp.album.side_effect = SpotifyException(503, -1, "down")
+        cache.get("album", "abc")
+        assert cache.get("album", "abc") == {"name": "old"}
+        assert cache.stats["refresh_failures"] == 2
+
+    def test_a_refresh_that_404s_drops_the_entry(self, sp, clock, make_cache):
+        cache = make_cache()
+        sp.album.return_value = {"name": "old"}
+        cache.get("album", "abc")
+        clock.at += 61
+        sp.album.side_effect = SpotifyException(404, -1, "gone")
+        cache.get("album", "abc")
+        with pytest.raises(SpotifyException):
+            cache.get("album", "abc")
+
+    def test_a_refresh_that_keeps_failing_is_not_served_forever(self, sp, clock, make_cache):
+        cache = make_cache()
+        sp.album.return_value = {"name": "old"}
+        cache.get("album", "abc")
+        sp.album.side_effect = SpotifyException(503, -1, "down")
+        clock.at += 61
+        assert cache.get("album", "abc") == {"name": "old"}
+        # Stale for as long again as the TTL, then fetched inline.
+        clock.at += 60
+        with pytest.raises(SpotifyException):
+            cache.get("album", "abc")
+        assert cache.stats["too_stale"] == 1
+
+    def test_a_refused_refresh_is_tried_again(self, sp, clock, make_cache):
+        class ShutDown:
+            def submit(self, *args):
+                raise RuntimeError("cannot schedule new futures after shutdown")
+        cache = make_cache(executor=ShutDown())
+        sp.album.return_value = {"name": "old"}
+        cache.get("album", "abc")
+        clock.at += 61
+        assert cache.get("album", "abc") == {"name": "old"}
+        assert cache._refreshing == set()
+
+
+class TestSingleFlight:
+    def test_concurrent_misses_make_one_call(self, sp, clock, make_cache):
+        cache = make_cache()
+        started, release = threading.Event(), threading.Event()
+
+        def slow(_):
+            started.set()
+            release.wait(5)
+            return {"name": "Rumours"}
+        sp.album.side_effect = slow
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as pool:
+            first = pool.submit(cache.get, "album", "abc")
+            started.wait(5)
+            rest = [pool.submit(cache.get, "album", "abc") for _ in range(4)]
+            while cache.stats["joined"] < 4:
+                threading.Event().wait(0.001)
+            release.set()
+            results = [f.result(5) for f in [first, *rest]]
+        assert results == [{"name": "Rumours"}] * 5
+        assert sp.album.call_count == 1
+
+    def test_an_error_reaches_every_waiter_and_is_not_cached(self, sp, clock, make_cache):
+        cache = make_cache()
+        started, release = threading.Event(), threading.Event()
+
+        def failing(_):
+            started.set()
+            release.wait(5)
+            raise SpotifyException(429, -1, "slow down")
+        sp.album.side_effect = failing
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            first = pool.submit(cache.get, "album", "abc")
+            started.wait(5)
+            second = pool.submit(cache.get, "album", "abc")
+            while cache.stats["joined"] < 1:
+                threading.Event().wait(0.001)
+            release.set()
+            for future in (first, second):
+                with pytest.raises(SpotifyException):
+                    future.result(5)
+
+        sp.album.side_effect = None
+        sp.album.return_value = {"name": "Rumours"}
+        assert cache.get("album", "abc") == {"name": "Rumours"}
+
+
+class TestBounds:
+    def test_the_least_recently_used_goes_first(self, sp, clock, make_cache):
+        cache = make_cache(max_entries=2)
+        sp.album.side_effect = lambda album_id: {"id": album_id}
+        cache.get("album", "a")
+        cache.get("album", "b")
+        cache.get("album", "a")
+        cache.get("album", "c")
+        assert cache.snapshot()["entries"] == 2
+        assert cache.stats["evictions"] == 1
+        cache.get("album", "a")
+        assert sp.album.call_count == 3
+
+    @pytest.mark.parametrize("spelling", [
+        "spotify:album:abc", "https://open.spotify.com/album/abc?si=xyz",
+    ])
+    def test_spellings_of_one_id_share_an_entry(self, sp, clock, spelling, make_cache):
+        cache = make_cache()
+        sp.album.return_value = {"name": "Rumours"}
+        cache.get("album", "abc")
+        cache.get("album", spelling)
+        assert sp.album.call_count == 1
+
+    def test_only_listed_methods_are_cached(self, make_cache):
+        with pytest.raises(KeyError):
+            make_cache().get("search", "q")
+
+
+class TestEndpoints:
+    STATE = {"currentTrack": {"uri": "x-sonos-spotify:spotify%3atrack%3at1?sid=9"}}
+    TRACK = {"artists": [{"id": "ar1", "name": "Fleetwood Mac"}], "album": {"id": "al1"}}
+    ALBUM = {"name": "Rumours", "uri": "spotify:album:al1", "release_date": "1977",
+             "artists": [{"name": "Fleetwood Mac"}], "images": [],
+             "tracks": {"items": [{"name": "Dreams", "uri": "spotify:track:2",
+                                   "artists": [{"name": "Fleetwood Mac"}],
+                                   "duration_ms": 1}]}}
+
+    def test_album_and_recommend_share_the_track(self, dj, server_mod, sp):
+        sp.track.return_value = self.TRACK
+        sp.album.return_value = self.ALBUM
+        sp.artist_top_tracks.return_value = {"tracks": []}
+        with patch.object(dj, "_sonos_request", return_value=self.STATE):
+            dj.album_tracks(based_on="nowplaying")
+            dj.album_tracks(uri="spotify:album:al1")
+            dj.recommend(based_on="nowplaying")
+            dj.recommend(based_on="nowplaying")
+        assert sp.track.call_count == 1
+        assert sp.album.call_count == 1
+        assert sp.artist_top_tracks.call_count == 1
+
+    def test_the_hit_ratio_is_in_metrics(self, dj, server_mod, sp):
+        sp.album.return_value = self.ALBUM
+        dj.album_tracks(uri="spotify:album:al1")
+        dj.album_tracks(uri="spotify:album:al1")
+        result = dj.metrics()
+        assert result["spotify_cache_entries"] == 1
+        assert result["spotify_cache_hit_ratio"] == 0.5
+        assert result["spotify_cache_max_entries"] == server_mod.SPOTIFY_CACHE_ENTRIES
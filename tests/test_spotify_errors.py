@@ -87,8 +87,8 @@ class TestDecoratorIsApplied:
     """The mapping is worthless if a handler that calls Spotify is missed."""
 
     @pytest.mark.parametrize("name", [
-        "_do_search", "my", "like", "create_playlist",
-        "add_to_playlist", "recommend", "album_tracks",
+        "_do_search", "my", "like", "create_playlist", "add_to_playlist",
+        "recommend", "album_tracks", "suggest", "container_tracks",
     ])
     def test_spotify_touching_handlers_are_wrapped(self, server_mod, name):
         fn = getattr(server_mod.DJServer, name)
@@ -0,0 +1,130 @@
+"""Tests for the Spotify rate governor.
+
+A 429 stopped only the call that met it, background refreshes spent the
+same budget as a guest's search, and the guest got the error. Every sp.*
+call now takes a token from one bucket. What has to hold: the bucket paces
+calls past its burst; a Retry-After closes it to everyone; a waiting person
+goes ahead of waiting background work; a wait longer than the caller's limit
+is a 429 with Retry-After rather than a stuck worker; and the waits are in
+/metrics.
+"""
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import cherrypy
+import pytest
+from spotipy.exceptions import SpotifyException
+
+
+def _waiting(governor, count):
+    deadline = time.monotonic() + 5
+    while len(governor._waiting) < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+class TestTheBucket:
+    def test_a_burst_goes_straight_through_then_is_paced(self, server_mod):
+        governor = server_mod._SpotifyGovernor(rate=20, burst=3)
+        started = time.monotonic()
+        for _ in range(3):
+            governor.acquire("interactive")
+        assert time.monotonic() - started < 0.04
+        governor.acquire("interactive")
+        assert time.monotonic() - started >= 0.045
+
+    def test_a_retry_after_stops_everyone(self, server_mod):
+        server_mod._record_spotify_response(429, "0.1")
+        started = time.monotonic()
+        server_mod._spotify_governor.acquire("background")
+        assert time.monotonic() - started >= 0.09
+
+    def test_a_wait_past_the_limit_is_a_429_at_once(self, server_mod):
+        server_mod._spotify_governor.block_for(30)
+        started = time.monotonic()
+        with pytest.raises(SpotifyException) as exc:
+            server_mod._spotify_governor.acquire("interactive")
+        assert time.monotonic() - started < 1
+        assert exc.value.http_status == 429
+        assert exc.value.headers["Retry-After"] in ("30", "31")
+        assert server_mod._metrics["spotify_governor_rejections"] == 1
+
+    def test_a_person_goes_ahead_of_background_work(self, server_mod):
+        governor = server_mod._SpotifyGovernor(rate=10, burst=1)
+        governor.acquire("interactive")
+        order = []
+
+        def take(priority):
+            governor.acquire(priority)
+            order.append(priority)
+        background = threading.Thread(target=take, args=("background",))
+        background.start()
+        _waiting(governor, 1)
+        person = threading.Thread(target=take, args=("interactive",))
+        person.start()
+        _waiting(governor, 2)
+        for thread in (background, person):
+            thread.join(5)
+        assert order == ["interactive", "background"]
+
+
+class TestThroughTheClient:
+    @pytest.fixture
+    def sp(self, server_mod):
+        client = MagicMock()
+        with patch.object(server_mod, "sp", server_mod._TracedSpotify(client)):
+            yield client
+
+    def test_a_closed_bucket_reaches_the_guest_with_retry_after(self, dj, server_mod, sp):
+        server_mod._spotify_governor.block_for(30)
+        with pytest.raises(cherrypy.HTTPError) as exc:
+            dj._do_search(q="beatles")
+        assert exc.value.status == 429
+        assert cherrypy.response.headers["Retry-After"] in ("30", "31")
+        sp.search.assert_not_called()
+
+    def test_a_refused_call_is_not_a_spotify_call(self, dj, server_mod, sp):
+        """Nothing went out, so neither the call count, the failures nor the
+        method's latency may say otherwise."""
+        server_mod._spotify_governor.block_for(30)
+        with pytest.raises(cherrypy.HTTPError):
+            dj._do_search(q="beatles")
+        assert server_mod._metrics["spotify_calls"] == 0
+        assert server_mod._metrics["spotify_failures"] == 0
+        assert server_mod._spotify_latency == {}
+        assert server_mod._metrics["spotify_governor_rejections"] == 1
+
+    def test_the_queue_is_not_in_the_method_latency(self, server_mod, sp):
+        server_mod._record_spotify_response(429, "0.1")
+        server_mod.sp.album("abc")
+        assert server_mod._spotify_latency["album"].max < 0.05
+        assert server_mod._metrics["spotify_calls"] == 1
+
+    def test_a_block_of_under_a_second_is_not_retry_after_zero(self, dj, server_mod, sp):
+        """A guest told 0 comes straight back into the same refusal."""
+        sp.search.side_effect = server_mod.SpotifyException(
+            429, -1, "rate limited", headers={"Retry-After": "0.4"})
+        with pytest.raises(cherrypy.HTTPError) as exc:
+            dj._do_search(q="beatles")
+        assert exc.value.status == 429
+        assert cherrypy.response.headers["Retry-After"] == "1"
+        assert "try again in 1s" in str(exc.value)
+
+    def test_a_cache_refresh_runs_as_background(self, server_mod, sp, inline, clock):
+        seen = []
+        sp.album.side_effect = lambda album_id: seen.append(
+            getattr(server_mod._spotify_local, "priority", "interactive")) or {"id": album_id}
+        cache = server_mod._MetadataCache({"album": 60}, 10, inline)
+        cache.get("album", "abc")
+        clock.at += 61
+        cache.get("album", "abc")
+        assert seen == ["interactive", "background"]
+        assert getattr(server_mod._spotify_local, "priority", "interactive") == "interactive"
+
+    def test_the_waits_are_in_metrics(self, dj, server_mod, sp):
+        sp.search.return_value = {"tracks": {"items": []}}
+        dj._do_search(q="beatles")
+        result = dj.metrics()
+        assert result["spotify_queue_wait"]["interactive"]["samples"] == 1
+        assert result["spotify_governor_burst"] == server_mod.SPOTIFY_BURST
+        assert "dj_spotify_queue_wait_seconds_count" in dj.metrics(format="prometheus")
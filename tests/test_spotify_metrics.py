@@ -0,0 +1,172 @@
+"""Tests for the Spotify call metrics.
+
+/metrics covered Sonos and Claude but not one of the sp.* calls behind
+search, the library, albums or playlist creation, so there was no telling
+which UI flow was spending the rate limit. What has to hold: every client
+method is timed under its own name; every HTTP response is counted by
+status, including the 429s spotipy retries on its own before anything above
+it sees a result; each 429 is charged to the method that met it, with the
+Retry-After it asked for; and token refreshes are recorded whether they
+work or not.
+"""
+import http.server
+import json
+import threading
+import types
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+import spotipy
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+
+
+class _Script(http.server.BaseHTTPRequestHandler):
+    """Answers each request with the next (status, headers) in `replies`."""
+
+    replies = []
+
+    def do_GET(self):
+        status, headers = self.replies.pop(0)
+        body = json.dumps({"id": "abc"} if status == 200 else
+                          {"error": {"status": status, "message": "scripted"}}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def spotify(server_mod):
+    """A real spotipy client, instrumented as at startup, against a local
+    server that plays back whatever replies the test scripts."""
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Script)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    client = spotipy.Spotify(auth="token", requests_timeout=5, backoff_factor=0)
+    client.prefix = f"http://127.0.0.1:{httpd.server_port}/v1/"
+    server_mod._instrument_spotify(client)
+
+    def play(*replies):
+        _Script.replies = list(replies)
+        return server_mod._TracedSpotify(client)
+    yield play
+    httpd.shutdown()
+    httpd.server_close()
+
+
+RATE_LIMITED = (429, {"Retry-After": "0"})
+OK = (200, {})
+
+
+class TestResponses:
+    def test_retried_429s_are_counted_and_charged_to_the_method(self, spotify, server_mod):
+        sp = spotify(RATE_LIMITED, RATE_LIMITED, OK)
+        assert sp.track("abc") == {"id": "abc"}
+        assert dict(server_mod._spotify_statuses) == {429: 2, 200: 1}
+        assert dict(server_mod._spotify_rate_limits) == {"track": 2}
+        assert server_mod._metrics["spotify_rate_limited"] == 2
+        assert server_mod._metrics["spotify_failures"] == 0
+        assert server_mod._spotify_retry_after.snapshot()["samples"] == 2
+
+    def test_an_error_is_counted_and_still_raised(self, spotify, server_mod):
+        sp = spotify((404, {}))
+        with pytest.raises(spotipy.SpotifyException):
+            sp.album("abc")
+        assert dict(server_mod._spotify_statuses) == {404: 1}
+        assert server_mod._metrics["spotify_failures"] == 1
+
+    def test_running_out_of_retries_counts_every_429(self, spotify, server_mod):
+        sp = spotify(*[(429, {"Retry-After": "0"})] * 4)
+        with pytest.raises(spotipy.SpotifyException) as exc:
+            sp.track("abc")
+        assert exc.value.http_status == 429
+        assert server_mod._spotify_statuses[429] == 4
+        assert server_mod._spotify_rate_limits["track"] == 4
+
+    def test_retry_after_lands_in_its_bucket(self, server_mod):
+        server_mod._record_spotify_response(429, "7")
+        server_mod._record_spotify_response(429, "Wed, 21 Oct 2026 07:28:00 GMT")
+        snap = server_mod._spotify_retry_after.snapshot()
+        assert snap["samples"] == 1 and snap["buckets"] == {"le_10": 1}
+
+    def test_outside_a_method_it_is_unknown(self, server_mod):
+        server_mod._record_spotify_response(429, None)
+        assert dict(server_mod._spotify_rate_limits) == {"unknown": 1}
+
+
+class TestMethods:
+    def test_each_method_is_timed_under_its_name(self, server_mod):
+        sp = server_mod._TracedSpotify(MagicMock())
+        sp.search(q="x")
+        sp.search(q="y")
+        sp.current_user_saved_tracks()
+        assert server_mod._spotify_latency["search"].snapshot()["samples"] == 2
+        assert server_mod._spotify_latency["current_user_saved_tracks"].snapshot()["samples"] == 1
+        assert server_mod._metrics["spotify_calls"] == 3
+
+    def test_the_method_is_forgotten_after_the_call(self, server_mod):
+        client = MagicMock()
+        client.me.side_effect = ValueError("boom")
+        with pytest.raises(ValueError):
+            server_mod._TracedSpotify(client).me()
+        assert getattr(server_mod._spotify_local, "method", None) is None
+        assert server_mod._metrics["spotify_failures"] == 1
+
+
+class TestTokenRefresh:
+    def _auth(self):
+        expired = {"access_token": "old", "refresh_token": "r", "expires_at": 0,
+                   "scope": "user-library-read", "token_type": "Bearer", "expires_in": 3600}
+        return SpotifyOAuth(client_id="id", client_secret="secret",
+                            redirect_uri="http://127.0.0.1:8888/callback",
+                            scope="user-library-read",
+                            cache_handler=MemoryCacheHandler(token_info=expired))
+
+    def test_a_refresh_is_recorded(self, server_mod):
+        fresh = {"access_token": "new", "expires_at": 9e9, "scope": "user-library-read"}
+        with patch.object(SpotifyOAuth, "refresh_access_token", return_value=fresh):
+            auth = self._auth()
+            server_mod._instrument_spotify(
+                types.SimpleNamespace(_session=requests.Session(), auth_manager=auth))
+            assert auth.get_access_token(as_dict=False) == "new"
+        [event] = server_mod._token_refreshes
+        assert event["ok"] and event["error"] is None
+        assert server_mod._metrics["spotify_token_refreshes"] == 1
+
+    def test_a_failed_refresh_is_recorded(self, server_mod):
+        with patch.object(SpotifyOAuth, "refresh_access_token",
+                          side_effect=spotipy.SpotifyOauthError("invalid_grant")):
+            auth = self._auth()
+            server_mod._instrument_spotify(
+                types.SimpleNamespace(_session=requests.Session(), auth_manager=auth))
+            with pytest.raises(spotipy.SpotifyOauthError):
+                auth.get_access_token(as_dict=False)
+        assert server_mod._token_refreshes[0]["error"] == "SpotifyOauthError"
+        assert server_mod._metrics["spotify_token_refresh_failures"] == 1
+
+
+class TestInMetrics:
+    def test_json(self, dj, server_mod):
+        server_mod._TracedSpotify(MagicMock()).search(q="x")
+        server_mod._record_spotify_response(429, "3")
+        result = dj.metrics()
+        assert result["spotify_latency"]["search"]["samples"] == 1
+        assert result["spotify_statuses"] == {"429": 1}
+        assert result["spotify_rate_limited_by_method"] == {"unknown": 1}
+        assert result["spotify_retry_after"]["samples"] == 1
+        assert result["spotify_token_refreshes_recent"] == []
+
+    def test_prometheus(self, dj, server_mod):
+        server_mod._TracedSpotify(MagicMock()).album("x")
+        server_mod._record_spotify_response(200, None)
+        text = dj.metrics(format="prometheus")
+        assert 'dj_spotify_request_seconds_count{method="album"} 1' in text
+        assert "dj_spotify_responses_200_total 1" in text
@@ -0,0 +1,146 @@
+"""Tests for running due steps on the step pool.
+
+Steps used to fire one after another on the scheduler thread, so a 46-second
+playlist load in one routine delayed an unrelated volume step in another.
+What has to hold now: separate routines run side by side; a routine's own
+steps still run in offset order, including across ticks; and every claimed
+step reports its outcome, so no in-flight claim is ever leaked.
+"""
+import concurrent.futures
+import datetime
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+
+def _tm(hour, minute):
+    return datetime.datetime(2026, 8, 3, hour, minute).timetuple()
+
+
+def _add(server_mod, id, steps, time_="07:00"):
+    server_mod._schedules.append({
+        "id": id, "time": time_, "days": [], "label": id, "enabled": True,
+        "steps": [{"last_fired": None, **s} for s in steps],
+    })
+
+
+def _tick(server_mod, dj, hour=7, minute=0):
+    with patch.object(server_mod.time, "localtime", return_value=_tm(hour, minute)):
+        return server_mod.run_due_schedules(dj)
+
+
+class TestSeparateRoutines:
+    def test_a_slow_load_does_not_hold_up_another_routine(self, dj, server_mod):
+        _add(server_mod, "slow", [{"offset": 0, "action": "play",
+                                   "uri": "spotify:playlist:big"}])
+        _add(server_mod, "quick", [{"offset": 0, "action": "volume", "volume": 20}])
+        release = threading.Event()
+        volume_done = threading.Event()
+
+        def slow_fire(_, step):
+            if step["action"] == "play":
+                assert release.wait(10)
+            else:
+                volume_done.set()
+            return True, None
+
+        with patch.object(server_mod, "_fire_schedule", side_effect=slow_fire):
+            futures = _tick(server_mod, dj)
+            try:
+                assert volume_done.wait(5), "the volume step waited behind the load"
+            finally:
+                release.set()
+            concurrent.futures.wait(futures, timeout=10)
+        assert server_mod._metrics["schedule_fires"] == 2
+
+    def test_the_pool_is_bounded(self, server_mod):
+        assert server_mod._step_executor._max_workers == server_mod.SCHEDULE_WORKERS
+
+
+class TestOneRoutine:
+    def test_its_steps_run_in_offset_order(self, dj, server_mod):
+        _add(server_mod, "wake", [
+            {"offset": 0, "action": "volume", "volume": 12},
+            {"offset": 0, "action": "play", "uri": "spotify:playlist:abc"},
+            {"offset": 0, "action": "volume", "volume": 22},
+        ])
+        order = []
+
+        def fire(_, step):
+            time.sleep(0.01)
+            order.append((step["action"], step.get("volume")))
+            return True, None
+
+        with patch.object(server_mod, "_fire_schedule", side_effect=fire):
+            concurrent.futures.wait(_tick(server_mod, dj), timeout=10)
+        assert order == [("volume", 12), ("play", None), ("volume", 22)]
+
+    def test_a_later_tick_queues_behind_a_step_still_running(self, dj, server_mod):
+        """A +1m step must not overtake a +0m load that is still going."""
+        _add(server_mod, "wake", [
+            {"offset": 0, "action": "play", "uri": "spotify:playlist:abc"},
+            {"offset": 1, "action": "volume", "volume": 22},
+        ])
+        release = threading.Event()
+        order = []
+
+        def fire(_, step):
+            if step["action"] == "play":
+                assert release.wait(10)
+            order.append(step["action"])
+            return True, None
+
+        with patch.object(server_mod, "_fire_schedule", side_effect=fire):
+            first = _tick(server_mod, dj, 7, 0)
+            second = _tick(server_mod, dj, 7, 1)
+            time.sleep(0.05)
+            assert order == []
+            release.set()
+            concurrent.futures.wait(first + second, timeout=10)
+        assert order == ["play", "volume"]
+        assert server_mod._step_lanes == {}
+
+
+class TestClaimsAreNeverLeaked:
+    def test_a_raising_step_still_reports(self, dj, server_mod):
+        _add(server_mod, "r", [{"offset": 0, "action": "pause"}])
+        with patch.object(server_mod, "_fire_schedule", side_effect=RuntimeError("boom")):
+            concurrent.futures.wait(_tick(server_mod, dj), timeout=10)
+        assert server_mod._steps_in_flight == set()
+        assert server_mod._metrics["schedule_failures"] == 1
+
+    def test_a_step_that_cannot_report_does_not_strand_the_next(self, dj, server_mod, caplog):
+        import logging
+        _add(server_mod, "r", [
+            {"offset": 0, "action": "pause"},
+            {"offset": 0, "action": "skip"},
+        ])
+        real = server_mod._record_step_outcome
+        calls = []
+
+        def record(step, ok, error):
+            calls.append(step["action"])
+            if step["action"] == "pause":
+                raise OSError("disk full")
+            return real(step, ok, error)
+
+        with caplog.at_level(logging.ERROR, logger="dj"), \
+                patch.object(server_mod, "_fire_schedule", return_value=(True, None)), \
+                patch.object(server_mod, "_record_step_outcome", side_effect=record):
+            concurrent.futures.wait(_tick(server_mod, dj), timeout=10)
+        assert calls == ["pause", "skip"]
+        assert "disk full" in caplog.text
+        assert server_mod._step_lanes == {}
+
+    def test_a_refused_submit_runs_the_steps_inline(self, dj, server_mod):
+        """Once the interpreter is shutting down the pool refuses work, but
+        the steps are already claimed and must still report."""
+        _add(server_mod, "r", [{"offset": 0, "action": "pause"}])
+        with patch.object(server_mod._step_executor, "submit",
+                          side_effect=RuntimeError("shutdown")), \
+                patch.object(server_mod, "_fire_schedule", return_value=(True, None)):
+            futures = _tick(server_mod, dj)
+        assert all(f.done() for f in futures)
+        assert server_mod._steps_in_flight == set()
@@ -0,0 +1,157 @@
+"""Tests for per-step timings and per-routine lateness.
+
+_record_step_outcome only said whether a step worked. When a wake-up was
+late there was no telling whether the tick, a wait on the schedules lock, a
+lane still busy with the routine's previous step or a slow load was to blame.
+What has to hold: each execution records where its time went, relative to
+the minute it was due; a routine's histogram counts only what took effect;
+the history is bounded; and an edit never hands one step's history to
+another.
+"""
+import concurrent.futures
+import datetime
+from unittest.mock import patch
+
+import pytest
+
+
+def _dt(hour, minute, second=0):
+    # 2026-08-03 is a Monday.
+    return datetime.datetime(2026, 8, 3, hour, minute, second)
+
+
+def _add(server_mod, steps, id="wake"):
+    server_mod._schedules.append({
+        "id": id, "time": "07:00", "days": [], "label": id, "enabled": True,
+        "steps": [{"last_fired": None, **s} for s in steps],
+    })
+
+
+@pytest.fixture
+def clock(clock):
+    clock.at = _dt(7, 0, 3).timestamp()
+    return clock
+
+
+def _tick(server_mod, dj):
+    concurrent.futures.wait(server_mod.run_due_schedules(dj), timeout=10)
+
+
+class TestWhatIsRecorded:
+    def test_where_the_time_went(self, dj, server_mod, clock):
+        _add(server_mod, [{"offset": 0, "action": "volume", "volume": 20}])
+
+        def slow_volume(**_):
+            clock.at += 1.5
+            return {"status": "success"}
+
+        with patch.object(dj, "_do_volume", side_effect=slow_volume):
+            _tick(server_mod, dj)
+        run = server_mod._annotate_schedule(server_mod._schedules[0])["steps"][0]["history"][0]
+        assert run["scheduled"] == "2026-08-03T07:00"
+        assert run["claimed"] == 3.0 and run["started"] == 3.0
+        assert run["finished"] == 4.5
+        assert run["ok"] and run["error"] is None
+        assert run["lock_wait"] >= 0 and not run["preload"]
+
+    def test_a_failure_is_kept_with_its_error(self, dj, server_mod, clock):
+        _add(server_mod, [{"offset": 0, "action": "pause"}])
+        with patch.object(dj, "_do_pause", return_value={"error": "Cannot reach Sonos"}):
+            _tick(server_mod, dj)
+        run = server_mod._step_history[("wake", 0, (0, "pause", None, None))][0]
+        assert not run["ok"] and run["error"] == "Cannot reach Sonos"
+        assert run["attempt"] == 1
+
+    def test_the_time_is_the_call_not_the_bookkeeping(self, dj, server_mod, clock):
+        """Recording the outcome waits on the schedules lock; that wait is
+        not the speaker's, and a failure there must not lose the sample."""
+        _add(server_mod, [{"offset": 0, "action": "pause"}])
+
+        def slow_and_broken(*_):
+            clock.at += 5
+            raise OSError("disk full")
+
+        with patch.object(dj, "_do_pause", return_value={"status": "paused"}), \
+                patch.object(server_mod, "_record_step_outcome", side_effect=slow_and_broken):
+            _tick(server_mod, dj)
+        run = server_mod._step_history[("wake", 0, (0, "pause", None, None))][0]
+        assert run["ok"] and run["finished"] == 3.0
+
+    def test_a_preload_starts_before_its_minute(self, dj, server_mod, clock):
+        clock.at = _dt(6, 59, 10).timestamp()
+        _add(server_mod, [{"offset": 0, "action": "play", "uri": "spotify:playlist:abc"}])
+        with patch.object(server_mod, "_sonos_readiness", return_value=(True, "ok")), \
+                patch.object(dj, "_sonos_request", return_value={"status": "success"}):
+            _tick(server_mod, dj)
+        clock.at = _dt(7, 0).timestamp()
+        with patch.object(dj, "_do_resume", return_value={"status": "playing"}):
+            _tick(server_mod, dj)
+        cue, play = server_mod._annotate_schedule(server_mod._schedules[0])["steps"][0]["history"]
+        assert cue["preload"] and cue["started"] == -50.0
+        # The play went out on the minute, and that is what counts as late.
+        assert not play["preload"] and play["finished"] == 0.0
+        assert sum(server_mod._routine_latency["wake"].counts) == 1
+
+    def test_the_history_is_bounded(self, server_mod, monkeypatch):
+        monkeypatch.setattr(server_mod, "SCHEDULE_HISTORY_PER_STEP", 3)
+        claim = {"_entry_id": "wake", "_step_index": 0, "offset": 0, "action": "pause",
+                 "_due_at": "2026-08-03T07:00", "_trigger_date": "2026-08-03"}
+        due = _dt(7, 0).timestamp()
+        for i in range(5):
+            server_mod._record_step_timing(claim, due, due + i, True, None)
+        history = server_mod._step_history[("wake", 0, (0, "pause", None, None))]
+        assert [r["finished"] for r in history] == [2.0, 3.0, 4.0]
+
+
+class TestTheHistogram:
+    def test_only_what_took_effect_is_counted(self, server_mod):
+        claim = {"_entry_id": "wake", "_step_index": 0, "offset": 0, "action": "pause",
+                 "_due_at": "2026-08-03T07:00", "_trigger_date": "2026-08-03"}
+        due = _dt(7, 0).timestamp()
+        server_mod._record_step_timing(claim, due, due + 0.2, True, None)
+        server_mod._record_step_timing(claim, due, due + 40, False, "boom")
+        server_mod._record_step_timing(claim, due, due + 46, True, None)
+        latency = server_mod._routine_latency["wake"].snapshot()
+        assert latency["samples"] == 2
+        assert latency["buckets"]["le_0.5"] == 1 and latency["buckets"]["le_60"] == 1
+        assert latency["seconds_max"] == 46.0
+
+    def test_beyond_the_last_bound(self, server_mod):
+        histogram = server_mod._Histogram((1, 10))
+        for value in (0.5, 1, 5, 11):
+            histogram.observe(value)
+        assert histogram.snapshot()["buckets"] == {"le_1": 2, "le_10": 1, "slower": 1}
+
+    def test_it_is_in_metrics_and_schedules(self, dj, server_mod, clock):
+        _add(server_mod, [{"offset": 0, "action": "pause"}])
+        with patch.object(dj, "_do_pause", return_value={"status": "paused"}):
+            _tick(server_mod, dj)
+        assert dj.metrics()["schedule_latency"]["wake"]["samples"] == 1
+        assert dj.schedules()["schedules"][0]["latency"]["samples"] == 1
+
+
+class TestEdits:
+    def test_a_moved_step_does_not_inherit_history(self, dj, server_mod, clock, save_schedule):
+        saved = save_schedule(time="07:00", days=[], label="wake",
+                              steps=[{"offset": 0, "action": "pause"}])
+        with patch.object(dj, "_do_pause", return_value={"status": "paused"}):
+            _tick(server_mod, dj)
+        entry_id = saved["schedule"]["id"]
+        assert server_mod._schedules[0]["id"] == entry_id
+
+        save_schedule(id=entry_id, time="07:00", days=[], label="wake",
+                      steps=[{"offset": 0, "action": "skip"},
+                             {"offset": 5, "action": "pause"}])
+        steps = dj.schedules()["schedules"][0]["steps"]
+        assert [s["history"] for s in steps] == [[], []]
+
+    def test_a_deleted_routine_is_forgotten(self, dj, server_mod, clock, save_schedule):
+        saved = save_schedule(time="07:00", days=[], label="wake",
+                              steps=[{"offset": 0, "action": "pause"}])
+        with patch.object(dj, "_do_pause", return_value={"status": "paused"}):
+            _tick(server_mod, dj)
+        assert server_mod._routine_latency
+        server_mod._schedules.clear()
+        with server_mod._schedules_lock:
+            server_mod._save_schedules_locked()
+        assert server_mod._routine_latency == {} and server_mod._step_history == {}
@@ -0,0 +1,136 @@
+"""Tests for /suggest, search as you type.
+
+A query per keystroke as full /search calls would hold a worker each until
+Spotify answered, and a slow answer for "beat" could land after the one for
+"beatles". What has to hold: a query older than its session's newest is
+answered as superseded, whether it arrives late, is overtaken while it waits
+out the debounce, or is overtaken while Spotify answers; an answered query is
+served again from the trie, and a longer one narrowed from it when enough
+still matches; the trie stays bounded; and suggestions never replace the
+session's numbered results.
+"""
+from unittest.mock import patch
+
+import cherrypy
+import pytest
+
+
+def _search(q, type, limit):
+    """Spotify as far as these tests need it: a track per word variant."""
+    names = [f"{q} {n}" for n in range(limit)]
+    return {"tracks": {"items": [
+        {"name": name, "artists": [{"name": "The Beatles"}],
+         "album": {"name": "Abbey Road"}, "uri": f"spotify:track:{i}"}
+        for i, name in enumerate(names)]}}
+
+
+@pytest.fixture
+def sp(server_mod):
+    with patch.object(server_mod, "sp") as sp:
+        sp.search.side_effect = _search
+        yield sp
+
+
+class TestSuperseding:
+    def test_an_older_seq_is_answered_at_once(self, dj, sp, clock):
+        dj.suggest(q="beatles", seq=5)
+        assert dj.suggest(q="beat", seq=4) == {"seq": 4, "superseded": True}
+        assert sp.search.call_count == 1
+
+    def test_a_query_overtaken_in_the_debounce_makes_no_call(self, dj, sp, clock):
+        clock.during_sleep = lambda: dj.suggest(q="beatles", seq=2)
+        assert dj.suggest(q="beat", seq=1)["superseded"] is True
+        assert [c.kwargs["q"] for c in sp.search.call_args_list] == ["beatles"]
+
+    def test_an_answer_overtaken_in_flight_is_kept_but_not_returned(
+            self, dj, server_mod, sp, clock):
+        def overtaken(q, type, limit):
+            server_mod._claim_suggest_seq("global", 2)
+            return _search(q, type, limit)
+        sp.search.side_effect = overtaken
+        assert dj.suggest(q="beat", seq=1)["superseded"] is True
+        assert dj.suggest(q="beat", seq=3)["source"] == "cache"
+
+    def test_a_counter_that_starts_again_is_a_new_stream(self, dj, server_mod, sp, clock):
+        dj.suggest(q="beatles", seq=40)
+        assert dj.suggest(q="abba", seq=1)["superseded"] is True
+        clock.at += server_mod.SUGGEST_SESSION_IDLE_SECONDS
+        assert "suggestions" in dj.suggest(q="abba", seq=1)
+        assert dj.suggest(q="abb", seq=0)["superseded"] is True
+
+    def test_sessions_do_not_supersede_each_other(self, dj, sp, clock):
+        dj.suggest(q="beatles", seq=9, session_id="a")
+        assert "suggestions" in dj.suggest(q="abba", seq=1, session_id="b")
+
+    def test_the_session_table_is_bounded(self, dj, server_mod, sp, clock, monkeypatch):
+        monkeypatch.setattr(server_mod, "MAX_SEARCH_SESSIONS", 3)
+        for n in range(10):
+            clock.at += 1
+            server_mod._claim_suggest_seq(f"s{n}", 1)
+        assert sorted(server_mod._suggest_latest) == ["s7", "s8", "s9"]
+
+
+class TestTheTrie:
+    def test_an_answered_query_is_served_again(self, dj, sp, clock):
+        dj.suggest(q="Beatles", seq=1)
+        result = dj.suggest(q="beatles ", seq=2)
+        assert result["source"] == "cache"
+        assert sp.search.call_count == 1
+
+    def test_a_longer_query_is_narrowed_from_a_shorter_one(self, dj, sp, clock):
+        sp.search.side_effect = lambda q, type, limit: {"tracks": {"items": [
+            {"name": f"Song {n}", "artists": [{"name": "The Beatles"}],
+             "album": {"name": "x"}, "uri": f"spotify:track:{n}"} for n in range(limit)]}}
+        dj.suggest(q="the", seq=1)
+        result = dj.suggest(q="the beat", seq=2)
+        assert result["source"] == "prefix"
+        assert len(result["suggestions"]) == 8
+        assert sp.search.call_count == 1
+
+    def test_too_few_matches_go_to_spotify(self, dj, sp, clock):
+        dj.suggest(q="the", seq=1)
+        assert dj.suggest(q="thez", seq=2)["source"] == "spotify"
+        assert sp.search.call_count == 2
+
+    def test_an_expired_answer_is_not_served(self, dj, server_mod, sp, clock):
+        dj.suggest(q="beatles", seq=1)
+        clock.at += server_mod.SEARCH_CACHE_TTL_SECONDS + 1
+        assert dj.suggest(q="beatles", seq=2)["source"] == "spotify"
+
+    def test_nothing_found_is_kept_for_less(self, dj, server_mod, sp, clock):
+        sp.search.side_effect = lambda q, type, limit: {"tracks": {"items": []}}
+        dj.suggest(q="beatels", seq=1)
+        clock.at += server_mod.SEARCH_CACHE_EMPTY_TTL_SECONDS + 1
+        assert dj.suggest(q="beatels", seq=2)["source"] == "spotify"
+
+    def test_it_is_bounded_and_prunes_what_it_drops(self, server_mod, clock):
+        cache = server_mod._PrefixCache(max_entries=2, ttl=60)
+        for query in ("abc", "abd", "xyz"):
+            cache.store(query, [])
+        assert len(cache) == 2
+        assert cache.lookup("abc", 0) == (None, None)
+        assert "a" in cache._root and "c" not in cache._root["a"]["b"]
+
+    @pytest.mark.parametrize("query,matches", [
+        ("beat", True), ("the beat", True), ("abbey", False), ("tles", False),
+    ])
+    def test_what_a_narrowed_row_must_match(self, server_mod, query, matches):
+        row = {"name": "Come Together", "artist": "The Beatles"}
+        assert server_mod._suggestion_matches(row, query) is matches
+
+
+class TestTheEndpoint:
+    def test_numbered_results_are_untouched(self, dj, server_mod, sp, clock):
+        server_mod.set_results([{"num": 1, "name": "kept", "uri": "spotify:track:k"}])
+        dj.suggest(q="beatles", seq=1)
+        assert server_mod.get_results()[0]["name"] == "kept"
+
+    def test_one_character_makes_no_call(self, dj, sp, clock):
+        assert dj.suggest(q="b", seq=1)["suggestions"] == []
+        sp.search.assert_not_called()
+
+    @pytest.mark.parametrize("seq", [None, "x", "-1"])
+    def test_a_missing_or_bad_seq_is_a_400(self, dj, clock, seq):
+        with pytest.raises(cherrypy.HTTPError) as exc:
+            dj.suggest(q="beatles", seq=seq)
+        assert exc.value.status == 400
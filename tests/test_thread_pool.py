@@ -0,0 +1,123 @@
+"""Tests for the thread-pool metrics.
+
+server_thread_pool was sized by guesswork against max_stream_clients, and
+nothing said how close the pool ran to exhaustion. What has to hold: /metrics
+reports busy, idle, stream-held and queued workers; a connection's wait for
+a worker is measured once per queueing; and a connection turned away for
+want of room is counted.
+"""
+import queue
+import threading
+import types
+
+import cherrypy
+import pytest
+
+from paths import SERVER_PY, read
+
+
+class FakePool:
+    """Enough of cheroot's ThreadPool: workers with a conn, and a queue."""
+
+    def __init__(self, workers=4, busy=0, queued=0):
+        self._threads = [types.SimpleNamespace(conn=object() if i < busy else None)
+                         for i in range(workers)]
+        self.qsize = queued
+        self.put_calls = []
+
+    @property
+    def idle(self):
+        return len([t for t in self._threads if t.conn is None])
+
+    def put(self, conn):
+        self.put_calls.append(conn)
+
+
+@pytest.fixture
+def pool(server_mod, monkeypatch):
+    pool = FakePool(workers=4, busy=3, queued=2)
+    monkeypatch.setattr(cherrypy.server, "httpserver",
+                        types.SimpleNamespace(requests=pool), raising=False)
+    return pool
+
+
+class TestTheCounts:
+    def test_busy_idle_and_queued(self, dj, server_mod, pool):
+        result = dj.metrics()
+        assert result["pool_workers"] == 4
+        assert result["pool_busy"] == 3 and result["pool_idle"] == 1
+        assert result["pool_queued"] == 2
+        assert result["pool_max"] == server_mod.SERVER_THREAD_POOL
+
+    def test_workers_held_by_streams(self, dj, server_mod, pool):
+        server_mod._stream_clients.extend([queue.Queue(), queue.Queue()])
+        assert dj.metrics()["pool_streams"] == 2
+
+    def test_before_the_server_starts(self, dj, server_mod, monkeypatch):
+        monkeypatch.setattr(cherrypy.server, "httpserver", None, raising=False)
+        result = dj.metrics()
+        assert result["pool_workers"] == 0 and result["pool_queued"] == 0
+
+    def test_they_are_in_the_prometheus_exposition(self, dj, pool):
+        text = dj.metrics(format="prometheus")
+        assert "dj_pool_busy 3\n" in text
+        assert 'dj_pool_queue_wait_seconds_count{pool="http"}' in text
+
+
+class TestTheQueueWait:
+    @pytest.fixture
+    def worker(self, monkeypatch):
+        """The current thread, playing a cheroot worker holding `conn`."""
+        conn = types.SimpleNamespace()
+        monkeypatch.setattr(threading.current_thread(), "conn", conn, raising=False)
+        return conn
+
+    def test_put_stamps_and_pickup_observes(self, server_mod, pool, worker):
+        server_mod._instrument_thread_pool()
+        pool.put(worker)
+        assert pool.put_calls == [worker]
+
+        server_mod._record_pool_pickup(worker.dj_queued + 0.25)
+        snap = server_mod._pool_wait.snapshot()
+        assert snap["samples"] == 1 and snap["seconds_max"] == 0.25
+
+    def test_one_pickup_is_counted_once(self, server_mod, pool, worker):
+        """An internal redirect runs the request hooks again on the same
+        worker without the connection having waited again."""
+        worker.dj_queued = 1.0
+        server_mod._record_pool_pickup(1.5)
+        server_mod._record_pool_pickup(9.0)
+        assert server_mod._pool_wait.snapshot()["samples"] == 1
+
+    def test_each_keep_alive_request_is_counted_from_its_own_queueing(
+            self, server_mod, pool, worker):
+        """cheroot puts a kept-alive connection back on the queue after each
+        response, so every request on it waited for a worker of its own."""
+        server_mod._instrument_thread_pool()
+        for _ in range(3):
+            pool.put(worker)
+            server_mod._record_pool_pickup(worker.dj_queued + 0.25)
+        assert server_mod._pool_wait.snapshot()["samples"] == 3
+
+    def test_the_busy_peak(self, server_mod, pool, worker):
+        server_mod._record_pool_pickup(0.0)
+        assert server_mod._metrics["pool_busy_peak"] == 3
+
+    def test_instrumenting_twice_wraps_once(self, server_mod, pool):
+        server_mod._instrument_thread_pool()
+        wrapped = pool.put
+        server_mod._instrument_thread_pool()
+        assert pool.put is wrapped
+
+    def test_a_full_queue_is_counted_and_still_raised(self, server_mod, pool):
+        def full(conn):
+            raise queue.Full
+        pool.put = full
+        server_mod._instrument_thread_pool()
+        with pytest.raises(queue.Full):
+            pool.put(types.SimpleNamespace())
+        assert server_mod._metrics["pool_rejected"] == 1
+
+    def test_it_is_installed_after_the_server_starts(self):
+        source = read(SERVER_PY)
+        assert "subscribe('start', _instrument_thread_pool, priority=80)" in source
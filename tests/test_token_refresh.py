@@ -0,0 +1,147 @@
+"""Tests for the background Spotify token refresh and the .cache writes.
+
+Once an hour the first Spotify call found the access token expired and paid
+for the refresh inline, stalling whichever guest made it. A Monitor now
+refreshes the token shortly before expiry. spotipy also truncated .cache and
+rewrote it in place, so a reader could find it empty. What has to hold: the
+refresh happens ahead of expiry and not before; it is counted as background,
+with its latency; a failure never escapes the tick; and .cache is always
+either the old token or the new one, and private from its first byte.
+"""
+import json
+import os
+import stat
+import threading
+import types
+from unittest.mock import patch
+
+import pytest
+import requests
+import spotipy
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+
+from paths import SERVER_PY, read
+
+
+@pytest.fixture
+def clock(clock):
+    # FRESH below expires a million seconds after this.
+    clock.at = 1_000_000.0
+    return clock
+
+
+@pytest.fixture
+def token_expiring(server_mod, clock, monkeypatch):
+    """An instrumented auth manager whose token expires `seconds` from now."""
+    def make(seconds):
+        token = {"access_token": "old", "refresh_token": "r", "token_type": "Bearer",
+                 "expires_at": clock.at + seconds, "expires_in": 3600,
+                 "scope": "user-library-read"}
+        auth = SpotifyOAuth(client_id="id", client_secret="secret",
+                            redirect_uri="http://127.0.0.1:8888/callback",
+                            scope="user-library-read",
+                            cache_handler=MemoryCacheHandler(token_info=token))
+        server_mod._instrument_spotify(
+            types.SimpleNamespace(_session=requests.Session(), auth_manager=auth))
+        monkeypatch.setattr(server_mod, "sp", types.SimpleNamespace(
+            _client=types.SimpleNamespace(auth_manager=auth)))
+        return auth
+    return make
+
+
+FRESH = {"access_token": "new", "refresh_token": "r", "expires_at": 2_000_000,
+         "scope": "user-library-read"}
+
+
+class TestTheTick:
+    def test_a_token_near_expiry_is_refreshed_in_the_background(
+            self, dj, server_mod, token_expiring):
+        with patch.object(SpotifyOAuth, "refresh_access_token", return_value=FRESH) as refresh:
+            token_expiring(server_mod.SPOTIFY_TOKEN_REFRESH_AHEAD_SECONDS - 10)
+            server_mod.refresh_spotify_token()
+        refresh.assert_called_once_with("r")
+        [event] = server_mod._token_refreshes
+        assert event["ok"] and event["background"]
+        result = dj.metrics()
+        assert result["spotify_token_refreshes_background"] == 1
+        assert result["spotify_token_refresh_latency"]["samples"] == 1
+        assert result["spotify_token_expires_in_seconds"] == 1_000_000
+
+    def test_a_token_with_time_left_is_left_alone(self, dj, server_mod, token_expiring):
+        with patch.object(SpotifyOAuth, "refresh_access_token") as refresh:
+            token_expiring(server_mod.SPOTIFY_TOKEN_REFRESH_AHEAD_SECONDS + 60)
+            server_mod.refresh_spotify_token()
+        refresh.assert_not_called()
+        assert dj.metrics()["spotify_token_expires_in_seconds"] == \
+            server_mod.SPOTIFY_TOKEN_REFRESH_AHEAD_SECONDS + 60
+
+    def test_a_failure_is_counted_and_does_not_escape(self, server_mod, token_expiring):
+        with patch.object(SpotifyOAuth, "refresh_access_token",
+                          side_effect=spotipy.SpotifyOauthError("invalid_grant")):
+            token_expiring(10)
+            server_mod.refresh_spotify_token()
+        assert server_mod._metrics["spotify_token_refresh_failures"] == 1
+        assert server_mod._token_refreshes[0]["background"] is True
+
+    def test_an_inline_refresh_is_not_background(self, server_mod, token_expiring):
+        with patch.object(SpotifyOAuth, "refresh_access_token", return_value=FRESH):
+            auth = token_expiring(-10)
+            auth.get_access_token(as_dict=False)
+        assert server_mod._token_refreshes[0]["background"] is False
+        assert server_mod._metrics["spotify_token_refreshes_background"] == 0
+
+    def test_it_runs_as_a_monitor(self):
+        source = read(SERVER_PY)
+        assert "refresh_spotify_token,\n        frequency=SPOTIFY_TOKEN_CHECK_SECONDS" in source
+
+
+class TestTheCacheFile:
+    def test_it_is_written_whole_and_private(self, server_mod, tmp_path):
+        path = str(tmp_path / ".cache")
+        server_mod._AtomicCacheFileHandler(cache_path=path).save_token_to_cache(FRESH)
+        with open(path) as f:
+            assert json.load(f) == FRESH
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        assert os.listdir(tmp_path) == [".cache"]
+
+    def test_a_failed_write_keeps_the_old_token(self, server_mod, tmp_path, monkeypatch):
+        path = str(tmp_path / ".cache")
+        handler = server_mod._AtomicCacheFileHandler(cache_path=path)
+        handler.save_token_to_cache(FRESH)
+
+        def full_disk(*args):
+            raise OSError(28, "No space left on device")
+        monkeypatch.setattr(server_mod.os, "replace", full_disk)
+        handler.save_token_to_cache({"access_token": "newer"})
+        assert handler.get_cached_token() == FRESH
+        assert os.listdir(tmp_path) == [".cache"]
+
+    def test_a_reader_never_sees_half_a_token(self, server_mod, tmp_path):
+        path = str(tmp_path / ".cache")
+        handler = server_mod._AtomicCacheFileHandler(cache_path=path)
+        handler.save_token_to_cache(FRESH)
+        # Big enough that a non-atomic write would be visible part-way.
+        big = {**FRESH, "scope": "x" * 200_000}
+        done = threading.Event()
+        torn = []
+
+        def reader():
+            while not done.is_set():
+                with open(path) as f:
+                    text = f.read()
+                try:
+                    json.loads(text)
+                except ValueError:
+                    torn.append(len(text))
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        try:
+            for n in range(30):
+                handler.save_token_to_cache({**big, "access_token": str(n)})
+        finally:
+            done.set()
+            thread.join(5)
+        assert torn == []
+        assert handler.get_cached_token()["access_token"] == "29"
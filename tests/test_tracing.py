@@ -0,0 +1,135 @@
+"""Tests for per-request traces and /debug/slow.
+
+When a guest said "it took ages to queue", nothing tied that request to the
+Spotify, Sonos and Claude calls it made. Each request now carries a trace
+that those calls add spans to, and the slowest are kept. What has to hold:
+spans land on the request that made them and nowhere else; outside a
+request a span is a no-op; an exception is noted and still raised; and only
+the slowest N survive, slowest first.
+"""
+from unittest.mock import MagicMock, patch
+
+import cherrypy
+import pytest
+
+
+@pytest.fixture
+def request_at(server_mod, monkeypatch):
+    """Start a request the way the on_start_resource hook does."""
+    def start(path="/search"):
+        monkeypatch.setattr(cherrypy.request, "path_info", path)
+        monkeypatch.setattr(cherrypy.request, "hooks",
+                            cherrypy._cprequest.HookMap(["on_end_request"]))
+        server_mod._start_request_timer()
+    return start
+
+
+def _finish():
+    cherrypy.request.hooks.run("on_end_request")
+
+
+class TestSpans:
+    def test_calls_made_by_a_request_land_on_its_trace(self, dj, server_mod, request_at):
+        request_at("/search")
+        response = MagicMock(status_code=200)
+        response.json.return_value = {"ok": True}
+        with patch.object(server_mod.requests, "get", return_value=response):
+            dj._sonos_request("volume/20")
+        server_mod._TracedSpotify(MagicMock()).search(q="x")
+        with server_mod._Span("json"):
+            pass
+        _finish()
+
+        trace = server_mod._slowest_traces()[0]
+        assert trace["endpoint"] == "search"
+        assert [s["name"] for s in trace["spans"]] == [
+            "sonos volume", "spotify search", "json"]
+        assert all(s["start"] >= 0 and s["seconds"] >= 0 for s in trace["spans"])
+
+    def test_claude_is_a_span(self, server_mod, request_at, monkeypatch):
+        monkeypatch.setattr(server_mod, "ANTHROPIC_API_KEY", "")
+        request_at("/chat")
+        server_mod.call_claude("play jazz")
+        _finish()
+        assert server_mod._slowest_traces()[0]["spans"][0]["name"] == "claude"
+
+    def test_auth_is_a_span(self, server_mod, request_at):
+        request_at("/search")
+        server_mod._check_auth()
+        _finish()
+        assert server_mod._slowest_traces()[0]["spans"][0]["name"] == "auth"
+
+    def test_an_exception_is_noted_and_still_raised(self, server_mod, request_at):
+        request_at()
+        client = MagicMock()
+        client.track.side_effect = ValueError("bad id")
+        with pytest.raises(ValueError):
+            server_mod._TracedSpotify(client).track("x")
+        _finish()
+        assert server_mod._slowest_traces()[0]["spans"][0]["error"] == "ValueError"
+
+    def test_outside_a_request_nothing_is_recorded(self, server_mod):
+        with server_mod._Span("sonos pause"):
+            pass
+        assert server_mod._slowest_traces() == []
+
+    def test_a_trace_ends_with_its_request(self, server_mod, request_at):
+        request_at()
+        _finish()
+        with server_mod._Span("late"):
+            pass
+        assert server_mod._slowest_traces()[0]["spans"] == []
+
+    def test_the_span_count_is_capped(self, server_mod, request_at):
+        request_at()
+        for _ in range(server_mod.MAX_SPANS_PER_TRACE + 10):
+            with server_mod._Span("sonos state"):
+                pass
+        _finish()
+        assert len(server_mod._slowest_traces()[0]["spans"]) == server_mod.MAX_SPANS_PER_TRACE
+
+    def test_spotify_attributes_pass_through(self, server_mod):
+        client = MagicMock()
+        client.auth_manager = "manager"
+        assert server_mod._TracedSpotify(client).auth_manager == "manager"
+
+
+class TestTheSlowest:
+    def _offer(self, server_mod, seconds):
+        server_mod._keep_if_slow({"at": 0, "spans": []}, "search", seconds)
+
+    def test_only_the_slowest_are_kept(self, server_mod, monkeypatch):
+        monkeypatch.setattr(server_mod, "SLOW_TRACES_KEPT", 3)
+        for seconds in (0.1, 5.0, 0.2, 3.0, 0.05, 4.0):
+            self._offer(server_mod, seconds)
+        assert [t["seconds"] for t in server_mod._slowest_traces()] == [5.0, 4.0, 3.0]
+
+    def test_equal_durations_do_not_compare_records(self, server_mod, monkeypatch):
+        monkeypatch.setattr(server_mod, "SLOW_TRACES_KEPT", 2)
+        for _ in range(4):
+            self._offer(server_mod, 1.0)
+        assert len(server_mod._slowest_traces()) == 2
+
+    def test_streams_are_left_out(self, server_mod, request_at):
+        request_at("/stream")
+        _finish()
+        assert server_mod._slowest_traces() == []
+
+
+class TestTheEndpoint:
+    def test_debug_slow(self, dj, server_mod):
+        server_mod._keep_if_slow({"at": 0, "spans": []}, "queue", 2.5)
+        result = dj.debug("slow")
+        assert result["kept"] == server_mod.SLOW_TRACES_KEPT
+        assert result["traces"][0]["endpoint"] == "queue"
+
+    def test_an_unknown_view_is_a_404(self, dj):
+        with pytest.raises(cherrypy.HTTPError) as exc:
+            dj.debug("nonsense")
+        assert exc.value.status == 404
+
+    def test_it_is_not_public(self, server_mod):
+        assert "/debug" not in server_mod.PUBLIC_PATHS
+
+    def test_every_reply_is_serialised_inside_a_span(self, server_mod):
+        assert server_mod.DJServer._cp_config["tools.json_out.handler"] is server_mod._json_handler